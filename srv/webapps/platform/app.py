@@ -19,6 +19,7 @@ from data_access import (
 from modules.weather import weather_bp
 from modules.donation_receipts import donation_receipts_bp
 from modules.catalog import catalog_bp  # NEW
+from services.circuit_breaker import OPEN, breaker_states
 
 # -------------------------------------------------------------------
 # Configuration and Environment Setup
@@ -457,7 +458,10 @@ def client_catch_all(filename: str):
 
 @app.route("/api/health")
 def health():
-    return jsonify({"status": "ok"})
+    """Report process health plus the state of each upstream circuit breaker."""
+    upstreams = breaker_states()
+    degraded = any(state["state"] == OPEN for state in upstreams.values())
+    return jsonify({"status": "degraded" if degraded else "ok", "upstreams": upstreams})
 
 
 # -------------------------------------------------------------------
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# /srv/webapps/platform/bench/bench_square_shaping.py
+
+"""
+Micro-benchmark for Square catalog shaping (modules/square_inventory.py).
+
+Compares the indexed ``shape_catalog_items`` against the previous nested-scan
+shaping on synthetic pages of 100 to 10,000 catalog objects. The indexed
+version should show a roughly constant cost per object (linear scaling),
+the nested scan a cost per object that grows with page size.
+
+Run from srv/webapps/platform:
+
+    python bench/bench_square_shaping.py [--sizes 100,1000,10000] [--repeat 5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from modules.square_inventory import shape_catalog_items  # noqa: E402
+from standin.server import Profile, StandinServer  # noqa: E402
+
+
+def make_page(object_count: int, variations_per_item: int = 3) -> List[Dict[str, Any]]:
+    """Build a page of roughly ``object_count`` objects with the stand-in's generator."""
+    categories = max(1, object_count // 100)
+    items = max(1, (object_count - categories) // (variations_per_item + 1))
+    profile = Profile(
+        catalog_items=items,
+        variations_per_item=variations_per_item,
+        categories=categories,
+        images_per_item=1,
+    )
+    server = StandinServer(profiles={"square": profile})
+    try:
+        return server.catalog_objects()
+    finally:
+        server.stop()
+
+
+def legacy_shape(objects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The pre-index shaping loop: rescans ``objects`` for every item."""
+    items = []
+    for obj in objects:
+        obj_type = obj.get("type")
+        obj_data = obj.get(obj_type, {})
+        if obj_type == "ITEM":
+            variation_ids = obj_data.get("item_variation_ids", [])
+            variations = []
+            for var_obj in objects:
+                if var_obj.get("type") == "ITEM_VARIATION" and var_obj.get("id") in variation_ids:
+                    var_data = var_obj.get("ITEM_VARIATION", {})
+                    price_money = var_data.get("price_money", {})
+                    variations.append({
+                        "id": var_obj.get("id"),
+                        "name": var_data.get("name"),
+                        "price": {
+                            "amount": price_money.get("amount"),
+                            "currency": price_money.get("currency")
+                        } if price_money else None
+                    })
+            category_id = obj_data.get("category_id")
+            category = None
+            if category_id:
+                for cat_obj in objects:
+                    if cat_obj.get("type") == "CATEGORY" and cat_obj.get("id") == category_id:
+                        category = {"id": category_id, "name": cat_obj.get("CATEGORY", {}).get("name")}
+                        break
+            images = []
+            for image_id in obj_data.get("image_ids") or []:
+                for image_obj in objects:
+                    if image_obj.get("type") == "IMAGE" and image_obj.get("id") == image_id:
+                        image_data = image_obj.get("IMAGE", {})
+                        images.append({
+                            "id": image_id,
+                            "url": image_data.get("url"),
+                            "caption": image_data.get("caption"),
+                        })
+                        break
+            items.append({
+                "id": obj.get("id"),
+                "name": obj_data.get("name"),
+                "description": obj_data.get("description"),
+                "category": category,
+                "images": images,
+                "variations": variations,
+            })
+    return items
+
+
+def _normalized(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Variation order differs (page order vs item order); compare as sets."""
+    return [dict(item, variations=sorted(item["variations"], key=lambda v: v["id"])) for item in items]
+
+
+def best_of(func, objects, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(objects)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sizes", default="100,500,1000,2500,5000,10000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--legacy-limit", type=int, default=5000,
+                        help="skip the nested-scan baseline above this many objects")
+    args = parser.parse_args()
+
+    print(f"{'objects':>8} {'indexed ms':>11} {'us/object':>10} {'legacy ms':>10} {'us/object':>10}")
+    for size in (int(value) for value in args.sizes.split(",")):
+        objects = make_page(size)
+        indexed = best_of(shape_catalog_items, objects, args.repeat)
+        row = f"{len(objects):>8} {indexed * 1e3:>11.2f} {indexed * 1e6 / len(objects):>10.2f}"
+        if len(objects) <= args.legacy_limit:
+            assert _normalized(legacy_shape(objects)) == _normalized(shape_catalog_items(objects))
+            legacy = best_of(legacy_shape, objects, max(1, args.repeat // 2))
+            row += f" {legacy * 1e3:>10.2f} {legacy * 1e6 / len(objects):>10.2f}"
+        else:
+            row += f" {'-':>10} {'-':>10}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
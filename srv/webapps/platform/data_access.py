@@ -75,6 +75,10 @@ def load_client_manifest(paths: Dict[str, Path]) -> Dict[str, Any]:
     if not isinstance(backend_data, list):
         backend_data = []
 
+    square = mss.get("square") or {}
+    if not isinstance(square, dict):
+        square = {}
+
     frontend_root_setting = mss.get("frontend_root", "frontend")
     if Path(frontend_root_setting).is_absolute():
         resolved_frontend_dir = Path(frontend_root_setting)
@@ -86,6 +90,7 @@ def load_client_manifest(paths: Dict[str, Path]) -> Dict[str, Any]:
         "frontend_dir": resolved_frontend_dir,
         "default_entry": mss.get("default_entry", "index.html"),
         "backend_data": backend_data,
+        "square": square,
     }
 
 
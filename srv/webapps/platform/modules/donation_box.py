@@ -14,22 +14,38 @@ To register this Blueprint in your Flask app, add to app.py:
     app.register_blueprint(donation_bp)
 
 This will register the following endpoints:
-- POST /api/donations/create
+- POST /api/donations/create (accepts an Idempotency-Key header)
 - POST /api/donations/confirm
 - GET  /api/donations/status/<donation_id>
+- GET  /api/donations/stats
+
+Donation records are kept in SQLite (services/donation_store.py), so any
+worker can confirm or report on a donation created by another, and pending
+donations survive restarts. Donations left pending (the donor never came back
+to /confirm) are captured or expired by services/donation_reconcile.py.
+
+Completing a donation queues its receipt in the donation outbox in the same
+transaction (services/donation_store.py); the outbox dispatcher
+(services/donation_outbox.py) appends the receipts in batches through
+modules/donation_receipts.py, off the confirm request path. A donation that is
+later refunded or reversed in full has its receipt voided the same way.
 """
 
 from __future__ import annotations
 
 import uuid
 import logging
-from typing import Dict, Any, Optional
-from datetime import datetime
+import sqlite3
+from typing import Callable, Dict, Any, List, Optional
+from datetime import date, datetime
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 
 # Import PayPal gateway functions for provider integration
-from modules.paypal_gateway import _make_paypal_request, PayPalClientError
+from modules.paypal_gateway import _make_paypal_request, PayPalClientError, idempotent_endpoint
+from modules.donation_receipts import UnknownClientError, append_receipts, receipt_for_donation, void_receipts
+from data_access import DEFAULT_CLIENT_SLUG, get_client_slug
+from services import donation_outbox, donation_reconcile, donation_rollups, donation_store
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -37,18 +53,87 @@ logger = logging.getLogger(__name__)
 # Flask Blueprint for donation endpoints
 donation_bp = Blueprint("donations", __name__, url_prefix="/api/donations")
 
-# In-memory donation store
-# TODO: Replace with persistent database (e.g., PostgreSQL, SQLite)
-# Key: donation_reference_id (str)
-# Value: donation record dict
-_donations_store: Dict[str, Dict[str, Any]] = {}
-
 
 class DonationError(Exception):
     """Custom exception for donation processing errors."""
     pass
 
 
+def _by_client(donations: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    by_client: Dict[str, List[Dict[str, Any]]] = {}
+    for donation in donations:
+        by_client.setdefault(donation.get("client_id") or DEFAULT_CLIENT_SLUG, []).append(donation)
+    return by_client
+
+
+def _per_client(
+    donations: List[Dict[str, Any]],
+    action: str,
+    write: Callable[[str, List[Dict[str, Any]]], List[Dict[str, Any]]],
+) -> Dict[str, str]:
+    """
+    Run ``write(client_slug, donations)`` once per client, isolating failures.
+    
+    Donations filed under a client that doesn't exist are logged and dropped.
+    Any other failure (e.g. a corrupt receipts file) is returned for that
+    client's donations only, so the outbox retries just those.
+    
+    Returns:
+        dict: Error message by donation ID, for the donations to retry
+    """
+    errors: Dict[str, str] = {}
+    for client_slug, client_donations in _by_client(donations).items():
+        donation_ids = [donation["donation_id"] for donation in client_donations]
+        try:
+            done = write(client_slug, client_donations)
+        except UnknownClientError as exc:
+            logger.error(f"No receipt {action} for {', '.join(donation_ids)}: {exc}")
+            continue
+        except (ValueError, OSError) as exc:
+            logger.error(f"Donation receipts for {client_slug} not {action}: {exc}")
+            errors.update((donation_id, str(exc)) for donation_id in donation_ids)
+            continue
+        logger.info(f"{action.capitalize()} {len(done)} donation receipt(s) for {client_slug}")
+    return errors
+
+
+def _issue_donation_receipts(donations: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Outbox handler: append receipts for completed donations, one write per client.
+    
+    Donations whose receipt is already stored are skipped by append_receipts,
+    so a redelivered batch is harmless.
+    """
+    return _per_client(
+        donations,
+        "issued",
+        lambda client_slug, client_donations: append_receipts(
+            client_slug, [receipt_for_donation(donation) for donation in client_donations]
+        ),
+    )
+
+
+def _void_donation_receipts(donations: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Outbox handler: void the receipts of refunded or reversed donations.
+    
+    Receipts already void are left alone, so a redelivered batch is harmless.
+    """
+    voided_at = datetime.utcnow().isoformat()
+    return _per_client(
+        donations,
+        "voided",
+        lambda client_slug, client_donations: void_receipts(client_slug, [
+            dict(receipt_for_donation(donation), voided_at=voided_at, void_reason=donation["status"])
+            for donation in client_donations
+        ]),
+    )
+
+
+donation_outbox.register_handler(donation_store.RECEIPT_TOPIC, _issue_donation_receipts)
+donation_outbox.register_handler(donation_store.VOID_TOPIC, _void_donation_receipts)
+
+
 def _generate_donation_id() -> str:
     """
     Generate a unique donation reference ID.
@@ -64,7 +149,8 @@ def _create_paypal_donation(
     currency: str,
     description: Optional[str] = None,
     return_url: Optional[str] = None,
-    cancel_url: Optional[str] = None
+    cancel_url: Optional[str] = None,
+    request_id: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Create a PayPal order for a donation.
@@ -78,6 +164,7 @@ def _create_paypal_donation(
         description: Optional donation description
         return_url: Optional return URL after approval
         cancel_url: Optional cancel URL
+        request_id: Optional PayPal-Request-Id, so PayPal deduplicates retries
         
     Returns:
         dict: PayPal order response with order_id, status, approval_url, etc.
@@ -108,17 +195,22 @@ def _create_paypal_donation(
             order_data["application_context"]["cancel_url"] = cancel_url
     
     # Call PayPal API to create order
-    response = _make_paypal_request("POST", "/v2/checkout/orders", data=order_data)
+    headers = {"PayPal-Request-Id": request_id} if request_id else None
+    response = _make_paypal_request("POST", "/v2/checkout/orders", data=order_data, headers=headers)
     
     return response
 
 
-def _capture_paypal_donation(order_id: str) -> Dict[str, Any]:
+def _capture_paypal_donation(order_id: str, donation_id: str) -> Dict[str, Any]:
     """
     Capture a PayPal order after approval.
     
+    The PayPal-Request-Id is derived from the donation, so a capture racing
+    the reconciliation job's returns the same result instead of failing.
+    
     Args:
         order_id: PayPal order ID to capture
+        donation_id: Donation the order belongs to
         
     Returns:
         dict: PayPal capture response with transaction details
@@ -129,7 +221,8 @@ def _capture_paypal_donation(order_id: str) -> Dict[str, Any]:
     response = _make_paypal_request(
         "POST",
         f"/v2/checkout/orders/{order_id}/capture",
-        data={}
+        data={},
+        headers={"PayPal-Request-Id": donation_reconcile.capture_request_id(donation_id)}
     )
     
     return response
@@ -149,17 +242,20 @@ def _get_provider_for_donation(donation_record: Dict[str, Any]) -> str:
 
 
 @donation_bp.route("/create", methods=["POST"])
+@idempotent_endpoint("donations.create")
 def create_donation():
     """
     Create a new donation and initiate payment processing.
     
+    Send an ``Idempotency-Key`` header to make retries safe: a repeated key
+    returns the first response instead of creating another donation.
+    
     Request body (JSON):
     {
         "amount": 25.00,                    # Required: donation amount
         "currency": "USD",                  # Optional: currency code (default: "USD")
         "donor_name": "John Doe",            # Optional: donor name
         "donor_email": "john@example.com",  # Optional: donor email
-        "client_id": "optional",            # Optional: client/site identifier
         "description": "Donation",          # Optional: donation description
         "return_url": "https://...",        # Optional: return URL after approval
         "cancel_url": "https://..."         # Optional: cancel URL
@@ -204,7 +300,8 @@ def create_donation():
     # Extract optional metadata
     donor_name = data.get("donor_name")
     donor_email = data.get("donor_email")
-    client_id = data.get("client_id")
+    # Receipts are filed under client_id, so it only ever comes from the Host
+    client_id = get_client_slug(request)
     description = data.get("description", f"Donation of {currency} {amount_float:.2f}")
     return_url = data.get("return_url")
     cancel_url = data.get("cancel_url")
@@ -235,7 +332,8 @@ def create_donation():
             currency=currency,
             description=description,
             return_url=return_url,
-            cancel_url=cancel_url
+            cancel_url=cancel_url,
+            request_id=g.upstream_request_id
         )
         
         # Extract provider-specific data
@@ -255,8 +353,9 @@ def create_donation():
         donation_record["provider_data"] = provider_response
         
         # Store donation record
-        # TODO: Persist to database instead of in-memory store
-        _donations_store[donation_id] = donation_record
+        donation_store.create(donation_record)
+        donation_reconcile.start_scheduler(_make_paypal_request)
+        donation_outbox.start_dispatcher()
         
         # Prepare response
         result = {
@@ -278,6 +377,10 @@ def create_donation():
         logger.error(f"Donation creation failed (PayPal error): {exc}")
         return jsonify({"error": f"Payment provider error: {str(exc)}"}), 502
     
+    except sqlite3.Error as exc:
+        logger.error(f"Donation store unavailable creating {donation_id}: {exc}", exc_info=True)
+        return jsonify({"error": "Donation store unavailable"}), 503
+    
     except Exception as exc:
         logger.error(f"Unexpected error creating donation: {exc}", exc_info=True)
         return jsonify({"error": "Internal server error"}), 500
@@ -316,27 +419,30 @@ def confirm_donation():
         return jsonify({"error": "donation_id is required"}), 400
     
     # Retrieve donation record
-    # TODO: Query from database instead of in-memory store
-    donation_record = _donations_store.get(donation_id)
+    try:
+        donation_record = donation_store.get(donation_id)
+    except sqlite3.Error as exc:
+        logger.error(f"Donation store unavailable reading {donation_id}: {exc}", exc_info=True)
+        return jsonify({"error": "Donation store unavailable"}), 503
     if not donation_record:
         return jsonify({"error": "donation not found"}), 404
     
     # Check for terminal states - prevent retrying captures
     current_status = donation_record.get("status")
-    if current_status == "completed":
+    if current_status in ("completed", "refunded", "reversed"):
         return jsonify({
             "donation_id": donation_id,
-            "status": "completed",
+            "status": current_status,
             "message": "Donation already confirmed",
             "transaction_id": donation_record.get("transaction_id"),
             "confirmed_at": donation_record.get("confirmed_at")
         }), 200
     
-    if current_status == "failed":
+    if current_status in ("failed", "expired"):
         return jsonify({
             "donation_id": donation_id,
-            "status": "failed",
-            "error": "Donation capture previously failed. Cannot retry capture for failed donations.",
+            "status": current_status,
+            "error": f"Donation is {current_status}. Cannot retry capture for {current_status} donations.",
             "transaction_id": donation_record.get("transaction_id"),
             "confirmed_at": donation_record.get("confirmed_at")
         }), 409  # 409 Conflict - resource is in a state that prevents the operation
@@ -361,7 +467,7 @@ def confirm_donation():
         # Capture payment with provider
         # TODO: Add support for other providers via provider factory
         if provider == "paypal":
-            capture_response = _capture_paypal_donation(provider_order_id)
+            capture_response = _capture_paypal_donation(provider_order_id, donation_id)
         else:
             return jsonify({"error": f"Unsupported provider: {provider}"}), 400
         
@@ -378,15 +484,19 @@ def confirm_donation():
                 transaction_id = captures[0].get("id")
                 amount_info = captures[0].get("amount")
         
-        # Update donation record
-        donation_record["status"] = "completed" if status == "COMPLETED" else "failed"
-        donation_record["transaction_id"] = transaction_id
-        donation_record["confirmed_at"] = datetime.utcnow().isoformat()
-        donation_record["provider_data"] = capture_response
+        # Update donation record, unless a webhook already moved it on
+        donation_record = donation_store.transition(
+            donation_id,
+            ["pending"],
+            status="completed" if status == "COMPLETED" else "failed",
+            transaction_id=transaction_id,
+            confirmed_at=datetime.utcnow().isoformat(),
+            provider_data=capture_response
+        ) or donation_store.get(donation_id)
         
-        # Store updated record
-        # TODO: Persist to database
-        _donations_store[donation_id] = donation_record
+        # The receipt was queued with the status change; deliver it soon
+        donation_outbox.start_dispatcher()
+        donation_outbox.wake()
         
         # Prepare response
         result = {
@@ -405,6 +515,11 @@ def confirm_donation():
         logger.error(f"Donation confirmation failed (PayPal error): {exc}")
         return jsonify({"error": f"Payment provider error: {str(exc)}"}), 502
     
+    except sqlite3.Error as exc:
+        # The capture went through; reconciliation can recover the record
+        logger.error(f"Donation store unavailable confirming {donation_id}: {exc}", exc_info=True)
+        return jsonify({"error": "Donation store unavailable"}), 503
+    
     except Exception as exc:
         logger.error(f"Unexpected error confirming donation: {exc}", exc_info=True)
         return jsonify({"error": "Internal server error"}), 500
@@ -422,7 +537,7 @@ def get_donation_status(donation_id: str):
         JSON response with donation status and details:
         {
             "donation_id": "don_abc123...",
-            "status": "pending" | "completed" | "failed",
+            "status": "pending" | "completed" | "failed" | "expired" | "refunded" | "reversed",
             "amount": 25.00,
             "currency": "USD",
             "created_at": "2024-01-01T12:00:00",
@@ -431,8 +546,11 @@ def get_donation_status(donation_id: str):
         }
     """
     # Retrieve donation record
-    # TODO: Query from database instead of in-memory store
-    donation_record = _donations_store.get(donation_id)
+    try:
+        donation_record = donation_store.get(donation_id)
+    except sqlite3.Error as exc:
+        logger.error(f"Donation store unavailable reading {donation_id}: {exc}", exc_info=True)
+        return jsonify({"error": "Donation store unavailable"}), 503
     if not donation_record:
         return jsonify({"error": "donation not found"}), 404
     
@@ -449,3 +567,66 @@ def get_donation_status(donation_id: str):
     }
     
     return jsonify(result), 200
+
+
+@donation_bp.route("/stats", methods=["GET"])
+def get_donation_stats():
+    """
+    Donation totals from the precomputed rollups, for the requesting site only.
+    
+    Query parameters:
+        from: First day, YYYY-MM-DD (default: first day of this month, UTC)
+        to: Last day, inclusive (default: today, UTC)
+        group_by: Comma-separated client, day, month, currency, designation
+            (default: client); currency is always included
+        source: "receipts" (default, recorded receipts) or "donations"
+            (online donations, with refunds)
+        
+    Returns:
+        JSON response with one row per group:
+        {
+            "from": "2024-05-01",
+            "to": "2024-05-31",
+            "source": "receipts",
+            "group_by": ["client", "currency"],
+            "rows": [
+                {"client": "...", "currency": "USD", "count": 12,
+                 "amount": "1450.00", "refund_count": 0, "refunded": "0.00", "net": "1450.00"}
+            ]
+        }
+    """
+    today = datetime.utcnow().date()
+    try:
+        day_from = date.fromisoformat(request.args.get("from") or today.replace(day=1).isoformat())
+        day_to = date.fromisoformat(request.args.get("to") or today.isoformat())
+    except ValueError:
+        return jsonify({"error": "from and to must be dates (YYYY-MM-DD)"}), 400
+    if day_from > day_to:
+        return jsonify({"error": "from must not be after to"}), 400
+    
+    group_by = [field.strip() for field in (request.args.get("group_by") or "client").split(",") if field.strip()]
+    source = request.args.get("source", "receipts")
+    client = get_client_slug(request)
+    
+    try:
+        rows = donation_rollups.query(
+            source,
+            day_from.isoformat(),
+            day_to.isoformat(),
+            group_by,
+            client=client
+        )
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except sqlite3.Error as exc:
+        logger.error(f"Donation rollups unavailable: {exc}", exc_info=True)
+        return jsonify({"error": "Donation statistics unavailable"}), 503
+    
+    return jsonify({
+        "from": day_from.isoformat(),
+        "to": day_to.isoformat(),
+        "source": source,
+        "client": client,
+        "group_by": list(dict.fromkeys([*group_by, "currency"])),
+        "rows": rows
+    }), 200
@@ -14,7 +14,15 @@ Endpoints
     Query params:
       - filename (optional): override the target JSON filename (defaults to
         "donation_receipts.json"). ".json" is appended automatically if omitted.
-    Returns an array of stored receipts (empty array when file is absent).
+      - from, to (optional): first/last recorded day, YYYY-MM-DD (UTC)
+      - donor_email, designation, provider (optional): exact matches
+      - min_amount, max_amount (optional): inclusive amount bounds
+      - limit (optional): page size, 1-500 (default 50)
+      - cursor (optional): "next_cursor" from the previous page
+    Without any of these, returns every stored receipt (empty array when file
+    is absent). With any of them, returns one page, newest first, served from
+    the receipt index (services/receipt_index.py) plus "next_cursor" (null on
+    the last page).
 
 - POST /api/donation-receipts
     JSON body:
@@ -33,19 +41,32 @@ Endpoints
         "ein": "00-0000000"                # optional placeholder EIN
     }
 
-    Appends the receipt to the client-scoped JSON file.
+    Appends the receipt to the client-scoped JSON file, the receipt index and
+    the per-client/day/currency/designation totals (services/donation_rollups.py)
+    read by GET /api/donations/stats.
+
+Completed online donations get their receipt through the same path
+(``append_receipts``), delivered from the donation outbox by the handler in
+modules/donation_box.py; those receipts carry the ``donation_id``. When such a
+donation is refunded or reversed, ``void_receipts`` marks its receipt with
+``voided_at`` and ``void_reason``; void receipts stay in the file but are left
+out of tax statements (services/tax_statements.py).
 """
 
 from __future__ import annotations
 
+import fcntl
 import logging
-from datetime import datetime, timezone
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from flask import Blueprint, jsonify, request
 
 from data_access import (
+    CLIENTS_ROOT,
     get_client_paths,
     get_client_slug,
     load_client_manifest,
@@ -53,6 +74,7 @@ from data_access import (
     resolve_backend_data_path,
     save_json,
 )
+from services import donation_rollups, receipt_index
 
 logger = logging.getLogger(__name__)
 
@@ -62,6 +84,13 @@ donation_receipts_bp = Blueprint(
 
 DEFAULT_FILENAME = "donation_receipts.json"
 
+# GET parameters that switch to the paginated, indexed query.
+QUERY_PARAMS = ("from", "to", "donor_email", "designation", "provider", "min_amount", "max_amount", "limit", "cursor")
+
+
+class UnknownClientError(ValueError):
+    """A client slug that doesn't name a client directory."""
+
 
 def _normalize_filename(raw: str | None) -> str:
     """Ensure we only work with a filename (no directories) and a .json suffix."""
@@ -75,7 +104,18 @@ def _normalize_filename(raw: str | None) -> str:
 
 
 def _resolve_receipts_path(client_slug: str, filename: str) -> Path:
-    """Resolve the target receipts JSON path, preferring manifest-backed entries."""
+    """
+    Resolve the target receipts JSON path, preferring manifest-backed entries.
+
+    Raises:
+        UnknownClientError: If ``client_slug`` isn't a client directory
+            directly under CLIENTS_ROOT
+        ValueError: If the filename escapes the data directory
+    """
+    clients_root = CLIENTS_ROOT.resolve()
+    client_root = (CLIENTS_ROOT / client_slug).resolve() if client_slug else clients_root
+    if client_root.parent != clients_root or not client_root.is_dir():
+        raise UnknownClientError(f"Unknown client: {client_slug!r}")
     paths = get_client_paths(client_slug)
     cleaned_name = _normalize_filename(filename)
 
@@ -107,12 +147,94 @@ def _load_receipts(path: Path) -> List[Dict[str, Any]]:
     return payload
 
 
+def iter_all_receipts(only_client: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield ``(client_slug, receipt)`` for every receipt file of every client.
+    
+    Covers the default file plus any backend_data file with "receipt" in its
+    name. Used to rebuild the donation rollups and build tax statements.
+    
+    Args:
+        only_client: Read just this client's files
+    """
+    for client_root in sorted(CLIENTS_ROOT.iterdir()):
+        if not client_root.is_dir() or (only_client and client_root.name != only_client):
+            continue
+        client_slug = client_root.name
+        filenames = {DEFAULT_FILENAME}
+        try:
+            manifest = load_client_manifest(get_client_paths(client_slug))
+            filenames.update(
+                Path(name).name for name in manifest.get("backend_data", [])
+                if "receipt" in Path(name).name.lower()
+            )
+        except (FileNotFoundError, ValueError):
+            pass
+        
+        for filename in sorted(filenames):
+            try:
+                receipts = _load_receipts(_resolve_receipts_path(client_slug, filename))
+            except ValueError as exc:
+                logger.warning(f"Skipping receipts file {client_slug}/{filename}: {exc}")
+                continue
+            for receipt in receipts:
+                if isinstance(receipt, dict):
+                    yield client_slug, receipt
+
+
+def _query_receipts(client_slug: str, target_path: Path):
+    """Serve one filtered page from the receipt index, refreshing it if the file changed."""
+    args = request.args
+    try:
+        day_from = date.fromisoformat(args["from"]) if args.get("from") else None
+        day_to = date.fromisoformat(args["to"]) if args.get("to") else None
+        limit = int(args.get("limit") or receipt_index.DEFAULT_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "invalid_query", "message": "from and to must be dates (YYYY-MM-DD) and limit a number"}), 400
+
+    source = target_path.name
+    try:
+        try:
+            stat = target_path.stat()
+        except FileNotFoundError:
+            stat = None
+        if not receipt_index.is_current(client_slug, source, stat):
+            receipt_index.reindex(client_slug, source, _load_receipts(target_path), stat)
+        receipts, next_cursor = receipt_index.query(
+            client_slug,
+            source,
+            day_from=day_from,
+            day_to=day_to,
+            donor_email=args.get("donor_email"),
+            designation=args.get("designation"),
+            provider=args.get("provider"),
+            min_amount=args.get("min_amount"),
+            max_amount=args.get("max_amount"),
+            limit=limit,
+            cursor=args.get("cursor"),
+        )
+    except ValueError as exc:
+        return jsonify({"error": "invalid_query", "message": str(exc)}), 400
+    except sqlite3.Error:
+        logger.error("Receipt index unavailable", exc_info=True)
+        return jsonify({"error": "server_error", "message": "Receipt index unavailable"}), 503
+
+    return jsonify({"receipts": receipts, "source": source, "next_cursor": next_cursor})
+
+
 @donation_receipts_bp.route("", methods=["GET"])
 def get_donation_receipts():
     """Fetch stored donation receipts for the current client."""
     client_slug = get_client_slug(request)
     filename = request.args.get("filename")
 
+    if any(name in request.args for name in QUERY_PARAMS):
+        try:
+            target_path = _resolve_receipts_path(client_slug, filename)
+        except ValueError as exc:
+            return jsonify({"error": "invalid_receipts_file", "message": str(exc)}), 400
+        return _query_receipts(client_slug, target_path)
+
     try:
         target_path = _resolve_receipts_path(client_slug, filename)
         receipts = _load_receipts(target_path)
@@ -136,6 +258,156 @@ def _coerce_amount(raw: Any) -> float:
     return amount
 
 
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """Serialize read-modify-write of a receipts file across workers."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.parent / f".{path.name}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def append_receipts(
+    client_slug: str, receipts: List[Dict[str, Any]], target_path: Optional[Path] = None
+) -> List[Dict[str, Any]]:
+    """
+    Append receipts to a client's receipts file, the receipt index and the rollups.
+    
+    Receipts carrying a ``donation_id`` already present in the file are
+    skipped, so replaying a donation's receipt never duplicates it.
+    
+    Args:
+        client_slug: Client the receipts belong to
+        receipts: Receipts to append, in order
+        target_path: Receipts file (default: the client's default file)
+    
+    Returns:
+        list: The receipts actually appended
+    
+    Raises:
+        ValueError: If the file can't be resolved or isn't a JSON array
+    """
+    if target_path is None:
+        target_path = _resolve_receipts_path(client_slug, DEFAULT_FILENAME)
+    with _file_lock(target_path):
+        stored = _load_receipts(target_path)
+        seen = {receipt.get("donation_id") for receipt in stored if isinstance(receipt, dict)}
+        added = []
+        for receipt in receipts:
+            donation_id = receipt.get("donation_id")
+            if donation_id and donation_id in seen:
+                continue
+            seen.add(donation_id)
+            added.append(receipt)
+        if not added:
+            return []
+        first_seq = len(stored)
+        save_json(target_path, stored + added)
+        stat = target_path.stat()
+
+    try:
+        receipt_index.record(client_slug, target_path.name, first_seq, added, stat)
+    except sqlite3.Error:
+        # The next query sees the file changed and reindexes it
+        logger.error("Failed updating receipt index", exc_info=True)
+
+    try:
+        donation_rollups.record_receipts(client_slug, added)
+    except (sqlite3.Error, ValueError):
+        # The receipts themselves are saved; a rollup rebuild picks them up
+        logger.error("Failed updating donation rollups for receipts", exc_info=True)
+
+    return added
+
+
+def void_receipts(
+    client_slug: str, receipts: List[Dict[str, Any]], target_path: Optional[Path] = None
+) -> List[Dict[str, Any]]:
+    """
+    Mark receipts void in a client's receipts file, by ``donation_id``.
+
+    Each receipt in ``receipts`` carries ``voided_at`` and ``void_reason``.
+    Stored receipts for the same donation get those fields unless already
+    void; receipts not stored yet are appended already void, so the receipt
+    issued later for the same donation is skipped. The file's index rows are
+    rebuilt and the voided amounts counted as refunds in the rollups.
+    
+    Returns:
+        list: The receipts newly voided (stored or appended)
+    
+    Raises:
+        ValueError: If the file can't be resolved or isn't a JSON array
+    """
+    if target_path is None:
+        target_path = _resolve_receipts_path(client_slug, DEFAULT_FILENAME)
+    with _file_lock(target_path):
+        stored = _load_receipts(target_path)
+        by_donation = {
+            receipt.get("donation_id"): receipt
+            for receipt in stored
+            if isinstance(receipt, dict) and receipt.get("donation_id")
+        }
+        voided = []
+        appended = []
+        for receipt in receipts:
+            existing = by_donation.get(receipt["donation_id"])
+            if existing is None:
+                by_donation[receipt["donation_id"]] = receipt
+                stored.append(receipt)
+                appended.append(receipt)
+                voided.append(receipt)
+            elif not existing.get("voided_at"):
+                existing["voided_at"] = receipt["voided_at"]
+                existing["void_reason"] = receipt.get("void_reason")
+                voided.append(existing)
+        if not voided:
+            return []
+        save_json(target_path, stored)
+        stat = target_path.stat()
+
+    try:
+        # Receipts changed in place, so the file's rows are rebuilt
+        receipt_index.reindex(client_slug, target_path.name, stored, stat)
+    except sqlite3.Error:
+        logger.error("Failed updating receipt index", exc_info=True)
+
+    try:
+        donation_rollups.record_receipts(client_slug, appended)
+        donation_rollups.record_voids(client_slug, voided)
+    except (sqlite3.Error, ValueError):
+        logger.error("Failed updating donation rollups for voided receipts", exc_info=True)
+
+    return voided
+
+
+def receipt_for_donation(donation: Dict[str, Any]) -> Dict[str, Any]:
+    """The receipt recorded for a completed online donation (a donation_store record)."""
+    confirmed_at = donation.get("confirmed_at") or donation["created_at"]
+    recorded_at = datetime.fromisoformat(confirmed_at.replace("Z", "+00:00"))
+    if recorded_at.tzinfo is None:
+        # donation_store timestamps are naive UTC
+        recorded_at = recorded_at.replace(tzinfo=timezone.utc)
+    donor = {key: donation.get(f"donor_{key}") for key in ("name", "email") if donation.get(f"donor_{key}")}
+    return {
+        "amount": donation["amount"],
+        "currency": donation.get("currency") or "USD",
+        "donor": donor,
+        "designation": None,
+        "provider": donation.get("provider"),
+        "provider_metadata": {
+            "order_id": donation.get("provider_order_id"),
+            "transaction_id": donation.get("transaction_id"),
+        },
+        "no_goods_or_services_statement": None,
+        "ein": None,
+        "recorded_at": recorded_at.isoformat(),
+        "donation_id": donation["donation_id"],
+    }
+
+
 @donation_receipts_bp.route("", methods=["POST"])
 def save_donation_receipt():
     """Persist a donation receipt for the current client."""
@@ -183,20 +455,9 @@ def save_donation_receipt():
     }
 
     try:
-        receipts = _load_receipts(target_path)
+        append_receipts(client_slug, [receipt], target_path)
     except ValueError as exc:
         return jsonify({"error": "invalid_receipts_file", "message": str(exc)}), 400
-    except Exception:
-        logger.error("Failed reading existing receipts", exc_info=True)
-        return (
-            jsonify({"error": "server_error", "message": "Could not read existing receipts"}),
-            500,
-        )
-
-    receipts.append(receipt)
-
-    try:
-        save_json(target_path, receipts)
     except Exception:
         logger.error("Failed writing receipts file", exc_info=True)
         return (
@@ -6,7 +6,7 @@ PayPal card processing module for Flask backend.
 This module provides a Flask Blueprint with endpoints for:
 - Creating PayPal orders
 - Capturing PayPal orders
-- Webhook handling (stub for future implementation)
+- Webhook ingestion (events are queued and applied in the background)
 
 All PayPal API credentials are read from environment variables.
 
@@ -18,7 +18,7 @@ To register this Blueprint in your Flask app, add to app.py:
     app.register_blueprint(paypal_bp)
 
 This will register the following endpoints:
-- POST /api/payments/paypal/create-order
+- POST /api/payments/paypal/create-order (accepts an Idempotency-Key header)
 - POST /api/payments/paypal/capture-order
 - POST /api/payments/paypal/webhook
 - GET  /api/payments/paypal/health
@@ -33,17 +33,41 @@ Optional:
 - PAYPAL_API_BASE: PayPal API base URL (defaults to sandbox)
   Production: https://api-m.paypal.com
   Sandbox: https://api-m.sandbox.paypal.com
+- PAYPAL_RATE_LIMIT_PER_SECOND / PAYPAL_RATE_LIMIT_BURST: outbound request
+  budget per client ID, shared by all workers (defaults 10 / 20)
+- PLATFORM_RUN_DIR: where the OAuth token shared by all workers is kept
+  (default /run/platform)
+- PAYPAL_WEBHOOK_ID: ID of the webhook registered with PayPal; deliveries
+  must carry a valid PAYPAL-TRANSMISSION-SIG, and without it the webhook
+  answers 503
+- PAYPAL_WEBHOOK_VERIFY: "local" (default with the cryptography package),
+  "api" (PayPal's verify endpoint) or "off"
+- PAYPAL_WEBHOOK_ALLOW_UNVERIFIED: "1" accepts webhook events unverified when
+  PAYPAL_WEBHOOK_ID is unset or verification is "off" (local testing only)
+- PAYPAL_CERT_CA_FILE: PEM roots for PayPal's signing certificate chain
+  (defaults to certifi's bundle)
+- PAYPAL_WEBHOOK_CONSUMER: "thread" (default) applies queued webhook events
+  from a thread in each worker; "off" leaves that to
+  ``python -m services.paypal_webhook_queue consume``
+- IDEMPOTENCY_TTL_SECONDS: how long Idempotency-Key responses are replayed
+  (default 86400)
+- TOKEN_REFRESH_AHEAD_SECONDS: how long before expiry the token is renewed in
+  the background (default 600)
 """
 
 from __future__ import annotations
 
 import os
 import logging
-from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
+import sqlite3
+from functools import wraps
+from typing import Optional, Dict, Any, Tuple
 
 import requests
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response, g, has_request_context
+
+from services import donation_outbox, idempotency, paypal_webhook_queue, paypal_webhook_verify, rate_limit
+from services.token_cache import SharedToken
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -59,46 +83,54 @@ PAYPAL_API_BASE = os.getenv(
     "https://api-m.sandbox.paypal.com"  # Default to sandbox for safety
 )
 
-# In-memory token cache (in production, consider Redis or similar)
-_token_cache: Optional[Dict[str, Any]] = None
+# Outbound request budget per PayPal client ID (all workers combined)
+PAYPAL_RATE_LIMIT_PER_SECOND = float(os.getenv("PAYPAL_RATE_LIMIT_PER_SECOND", "10"))
+PAYPAL_RATE_LIMIT_BURST = float(os.getenv("PAYPAL_RATE_LIMIT_BURST", "20"))
 
 
 class PayPalClientError(Exception):
-    """Custom exception for PayPal API errors."""
-    pass
+    """Custom exception for PayPal API errors (status_code is PayPal's HTTP status, if any)."""
 
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
 
-def get_paypal_access_token() -> str:
+
+def _send_limited(send, idempotent: bool, timeout: float = 30) -> requests.Response:
     """
-    Obtain or refresh a PayPal OAuth access token.
-    
-    Uses client credentials flow. Caches the token until it expires.
+    Run one PayPal HTTP call under the shared rate limiter with retries.
+
+    While serving a web request the call, retries included, is kept within
+    REQUEST_DEADLINE_SECONDS; background jobs get the full retry budget.
+    """
+    try:
+        return rate_limit.send_with_retry(
+            send,
+            bucket=rate_limit.bucket_name("paypal", PAYPAL_CLIENT_ID),
+            rate=PAYPAL_RATE_LIMIT_PER_SECOND,
+            burst=PAYPAL_RATE_LIMIT_BURST,
+            idempotent=idempotent,
+            timeout=timeout,
+            deadline=rate_limit.REQUEST_DEADLINE_SECONDS if has_request_context() else None
+        )
+    except rate_limit.RateLimitExceeded as exc:
+        logger.warning(f"PayPal API request throttled locally: {exc}")
+        raise PayPalClientError(f"PayPal API rate limit reached; retry in {exc.retry_after:.0f}s")
+
+
+def _fetch_paypal_access_token() -> Tuple[str, int]:
+    """
+    Request a new PayPal OAuth access token (client credentials flow).
     
     Returns:
-        str: Access token for PayPal API requests
+        tuple: ``(access_token, expires_in_seconds)``
         
     Raises:
         PayPalClientError: If authentication fails
     """
-    global _token_cache
-    
-    # Check if we have a valid cached token
-    if _token_cache and _token_cache.get("expires_at"):
-        expires_at = _token_cache.get("expires_at")
-        if datetime.now() < expires_at:
-            return _token_cache["access_token"]
-    
-    # Validate credentials are configured
-    if not PAYPAL_CLIENT_ID or not PAYPAL_CLIENT_SECRET:
-        raise PayPalClientError(
-            "PayPal credentials not configured. Set PAYPAL_CLIENT_ID and PAYPAL_CLIENT_SECRET."
-        )
-    
-    # Determine OAuth endpoint based on API base URL
-    if "sandbox" in PAYPAL_API_BASE:
-        oauth_url = "https://api-m.sandbox.paypal.com/v1/oauth2/token"
-    else:
-        oauth_url = "https://api-m.paypal.com/v1/oauth2/token"
+    # OAuth endpoint lives on the same host as the REST API (sandbox, live,
+    # or a local stand-in)
+    oauth_url = f"{PAYPAL_API_BASE}/v1/oauth2/token"
     
     # Request access token
     auth = (PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET)
@@ -109,11 +141,16 @@ def get_paypal_access_token() -> str:
     data = {"grant_type": "client_credentials"}
     
     try:
-        response = requests.post(
-            oauth_url,
-            auth=auth,
-            headers=headers,
-            data=data,
+        # Asking for a token twice is harmless, so failures are retried
+        response = _send_limited(
+            lambda timeout: requests.post(
+                oauth_url,
+                auth=auth,
+                headers=headers,
+                data=data,
+                timeout=timeout
+            ),
+            idempotent=True,
             timeout=10
         )
         response.raise_for_status()
@@ -125,21 +162,47 @@ def get_paypal_access_token() -> str:
         if not access_token:
             raise PayPalClientError("PayPal OAuth response missing access_token")
         
-        # Cache the token (expire 5 minutes before actual expiry for safety)
-        expires_at = datetime.now() + timedelta(seconds=expires_in - 300)
-        _token_cache = {
-            "access_token": access_token,
-            "expires_at": expires_at
-        }
-        
         logger.info("PayPal access token obtained successfully")
-        return access_token
+        return access_token, int(expires_in)
         
     except requests.RequestException as exc:
         logger.error(f"PayPal OAuth request failed: {exc}")
         raise PayPalClientError(f"Failed to obtain PayPal access token: {exc}")
 
 
+# Token shared by all workers; one of them renews it ahead of expiry
+_paypal_token = SharedToken("paypal", PAYPAL_CLIENT_ID, fetch=_fetch_paypal_access_token)
+
+
+def get_paypal_access_token() -> str:
+    """
+    Obtain a PayPal OAuth access token.
+    
+    The token is cached in a file shared by all workers and renewed in the
+    background before it expires, so requests normally never wait on OAuth.
+    Only when no valid token exists (first boot, or PayPal unreachable for a
+    long time) does the calling request fetch one, and then only one process
+    does while the others wait for its result.
+    
+    Returns:
+        str: Access token for PayPal API requests
+        
+    Raises:
+        PayPalClientError: If authentication fails
+    """
+    # Validate credentials are configured
+    if not PAYPAL_CLIENT_ID or not PAYPAL_CLIENT_SECRET:
+        raise PayPalClientError(
+            "PayPal credentials not configured. Set PAYPAL_CLIENT_ID and PAYPAL_CLIENT_SECRET."
+        )
+    
+    try:
+        return _paypal_token.get()
+    except OSError as exc:
+        logger.error(f"PayPal token cache unavailable: {exc}")
+        raise PayPalClientError(f"PayPal token cache unavailable: {exc}")
+
+
 def _make_paypal_request(
     method: str,
     endpoint: str,
@@ -149,6 +212,10 @@ def _make_paypal_request(
     """
     Make an authenticated request to the PayPal API.
     
+    Calls go through the shared rate limiter. 429s are always retried after
+    ``Retry-After``; 5xx and network errors only for GETs and for writes
+    carrying a ``PayPal-Request-Id`` (which PayPal deduplicates).
+    
     Args:
         method: HTTP method (GET, POST, etc.)
         endpoint: API endpoint path (e.g., "/v2/checkout/orders")
@@ -172,20 +239,30 @@ def _make_paypal_request(
     if headers:
         request_headers.update(headers)
     
+    method = method.upper()
+    if method not in ("GET", "POST", "PATCH"):
+        raise PayPalClientError(f"Unsupported HTTP method: {method}")
+    
+    def send(timeout: float) -> requests.Response:
+        if method == "POST":
+            return requests.post(url, json=data, headers=request_headers, timeout=timeout)
+        if method == "GET":
+            return requests.get(url, headers=request_headers, timeout=timeout)
+        return requests.patch(url, json=data, headers=request_headers, timeout=timeout)
+    
     try:
-        if method.upper() == "POST":
-            response = requests.post(url, json=data, headers=request_headers, timeout=30)
-        elif method.upper() == "GET":
-            response = requests.get(url, headers=request_headers, timeout=30)
-        elif method.upper() == "PATCH":
-            response = requests.patch(url, json=data, headers=request_headers, timeout=30)
-        else:
-            raise PayPalClientError(f"Unsupported HTTP method: {method}")
-        
+        response = _send_limited(
+            send,
+            idempotent=method == "GET" or "PayPal-Request-Id" in request_headers
+        )
         response.raise_for_status()
         return response.json()
         
     except requests.HTTPError as exc:
+        if exc.response is not None and exc.response.status_code == 401:
+            # Revoked or rotated credentials; don't hand the token out again
+            _paypal_token.invalidate(access_token)
+        
         error_detail = "Unknown error"
         try:
             error_data = exc.response.json()
@@ -194,18 +271,84 @@ def _make_paypal_request(
             error_detail = str(exc)
         
         logger.error(f"PayPal API request failed: {method} {endpoint} - {error_detail}")
-        raise PayPalClientError(f"PayPal API error: {error_detail}")
+        raise PayPalClientError(
+            f"PayPal API error: {error_detail}",
+            status_code=exc.response.status_code if exc.response is not None else None
+        )
         
     except requests.RequestException as exc:
         logger.error(f"PayPal API request exception: {exc}")
         raise PayPalClientError(f"PayPal API request failed: {exc}")
 
 
+def idempotent_endpoint(scope: str):
+    """
+    Honour an ``Idempotency-Key`` header on a POST endpoint.
+    
+    The first request with a key runs the view and its response (if below 500)
+    is stored; retries with the same key and body get that response back
+    (``Idempotent-Replayed: true``) without running the view, waiting for the
+    first request if it is still in flight on any worker. Inside the view,
+    ``g.upstream_request_id`` holds an ID to forward to PayPal as
+    ``PayPal-Request-Id`` (None without a key).
+    
+    Args:
+        scope: Namespace for keys, e.g. "paypal.create-order"
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.upstream_request_id = None
+            key = request.headers.get("Idempotency-Key")
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > idempotency.MAX_KEY_LENGTH:
+                return jsonify({"error": "Idempotency-Key is too long"}), 400
+            
+            request_hash = idempotency.request_fingerprint(request.method, request.path, request.get_data())
+            try:
+                claim = idempotency.begin(scope, key, request_hash)
+            except idempotency.IdempotencyKeyReused:
+                return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+            except idempotency.IdempotencyInProgress:
+                return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409, {"Retry-After": "1"}
+            except sqlite3.Error as exc:
+                # Without the store we can't deduplicate, but PayPal-Request-Id still does upstream
+                logger.warning(f"Idempotency store unavailable, running {scope} unguarded: {exc}")
+                g.upstream_request_id = idempotency.upstream_request_id(scope, key)
+                return view(*args, **kwargs)
+            
+            if claim.replay:
+                return jsonify(claim.replay_body), claim.replay_status, {"Idempotent-Replayed": "true"}
+            
+            g.upstream_request_id = idempotency.upstream_request_id(scope, key)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                idempotency.release(claim)
+                raise
+            
+            try:
+                if response.is_json:
+                    idempotency.complete(claim, response.status_code, response.get_json())
+                else:
+                    idempotency.release(claim)
+            except sqlite3.Error as exc:
+                logger.warning(f"Could not store idempotent response for {scope}: {exc}")
+            return response
+        return wrapper
+    return decorator
+
+
 @paypal_bp.route("/create-order", methods=["POST"])
+@idempotent_endpoint("paypal.create-order")
 def create_order():
     """
     Create a PayPal order for card processing.
     
+    Send an ``Idempotency-Key`` header to make retries safe: a repeated key
+    returns the first response instead of creating another order.
+    
     Request body (JSON):
     {
         "amount": 10.00,              # Required: payment amount
@@ -338,8 +481,9 @@ def create_order():
             order_data["application_context"]["cancel_url"] = cancel_url
     
     try:
-        # Create order via PayPal API
-        response = _make_paypal_request("POST", "/v2/checkout/orders", data=order_data)
+        # Create order via PayPal API (PayPal deduplicates on PayPal-Request-Id too)
+        paypal_headers = {"PayPal-Request-Id": g.upstream_request_id} if g.upstream_request_id else None
+        response = _make_paypal_request("POST", "/v2/checkout/orders", data=order_data, headers=paypal_headers)
         
         # Extract relevant information for frontend
         order_id = response.get("id")
@@ -459,10 +603,14 @@ def webhook():
     """
     Webhook endpoint for PayPal event notifications.
     
-    This is a stub implementation. In production, you should:
-    1. Verify webhook signatures
-    2. Process events (payment completed, refunded, etc.)
-    3. Update your database/state accordingly
+    The signature is checked locally against PayPal's cached certificate
+    (see services/paypal_webhook_verify.py); unverifiable deliveries get a
+    400, and with no webhook ID configured every delivery gets a 503 unless
+    PAYPAL_WEBHOOK_ALLOW_UNVERIFIED is set. Accepted events are appended to
+    a durable queue and acknowledged immediately; a background consumer
+    deduplicates them by event ID and applies them to donation state (see
+    services/paypal_webhook_queue.py). If the queue can't be written the
+    endpoint answers 503 so PayPal redelivers.
     
     Request body: PayPal webhook event JSON
     
@@ -472,16 +620,49 @@ def webhook():
     if not request.is_json:
         return jsonify({"error": "Content-Type must be application/json"}), 400
     
-    event_data = request.get_json()
-    event_type = event_data.get("event_type") if event_data else None
+    event_data = request.get_json(silent=True)
+    if not isinstance(event_data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    event_type = event_data.get("event_type")
     
-    logger.info(f"PayPal webhook received: {event_type}")
+    try:
+        verified = paypal_webhook_verify.verify(
+            request.headers,
+            request.get_data(),
+            event_data,
+            request_fn=_make_paypal_request,
+            api_base=PAYPAL_API_BASE
+        )
+    except paypal_webhook_verify.WebhookNotConfigured as exc:
+        logger.error(f"Refusing PayPal webhook {event_data.get('id')}: {exc}")
+        return jsonify({"error": "Webhook verification not configured"}), 503
+    except paypal_webhook_verify.WebhookVerificationError as exc:
+        logger.warning(f"Rejected PayPal webhook {event_data.get('id')}: {exc}")
+        return jsonify({"error": "Invalid webhook signature"}), 400
+    except PayPalClientError as exc:
+        # The verify API is unreachable; PayPal will redeliver
+        logger.error(f"PayPal webhook verification unavailable: {exc}")
+        return jsonify({"error": "Webhook verification unavailable"}), 503
+    if not verified:
+        logger.warning("PAYPAL_WEBHOOK_ALLOW_UNVERIFIED set; accepting PayPal webhook without signature verification")
     
-    # TODO: Implement webhook signature verification
-    # TODO: Process webhook events based on event_type
-    # TODO: Update order status in database
+    try:
+        queued = paypal_webhook_queue.enqueue(event_data)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except sqlite3.Error as exc:
+        logger.error(f"PayPal webhook queue unavailable: {exc}")
+        return jsonify({"error": "Webhook queue unavailable"}), 503
+    
+    paypal_webhook_queue.start_consumer(_make_paypal_request)
+    # Captures completed by webhooks queue receipts in the donation outbox
+    donation_outbox.start_dispatcher()
+    logger.info(f"PayPal webhook {'queued' if queued else 'duplicate'}: {event_type} {event_data.get('id')}")
     
-    return jsonify({"status": "received", "event_type": event_type}), 200
+    return jsonify({
+        "status": "queued" if queued else "duplicate",
+        "event_type": event_type
+    }), 200
 
 
 @paypal_bp.route("/health", methods=["GET"])
@@ -494,8 +675,23 @@ def health():
     """
     has_credentials = bool(PAYPAL_CLIENT_ID and PAYPAL_CLIENT_SECRET)
     
+    try:
+        token_status = _paypal_token.status() if has_credentials else None
+    except OSError as exc:
+        logger.warning(f"PayPal token cache unavailable: {exc}")
+        token_status = None
+    
+    try:
+        webhook_queue = paypal_webhook_queue.stats()
+    except sqlite3.Error as exc:
+        logger.warning(f"PayPal webhook queue unavailable: {exc}")
+        webhook_queue = None
+    
     return jsonify({
         "status": "ok" if has_credentials else "misconfigured",
         "api_base": PAYPAL_API_BASE,
-        "credentials_configured": has_credentials
+        "credentials_configured": has_credentials,
+        "token": token_status,
+        "webhook_queue": webhook_queue,
+        "webhook_verification": paypal_webhook_verify.cache_info()
     }), 200 if has_credentials else 503
@@ -16,9 +16,43 @@ To register this Blueprint in your Flask app, add to app.py:
 
 This will register the following endpoints:
 - GET /api/square/items
+- GET /api/square/items/<item_id>
+- GET /api/square/search
+- GET /api/square/product-links
+- GET /api/square/export.ndjson
 - GET /api/square/items/<item_id>/inventory
+- POST /api/square/webhook
 - GET /api/square/health
 
+PER-CLIENT CONFIGURATION:
+-------------------------
+Each client site may declare its Square locations (and, for a separate Square
+account, the *name* of the environment variable holding its token) under
+"square" in the MSS section of its msn_<user>.json manifest. The manifest is
+served publicly, so it must never contain the token itself:
+
+    "MSS": {
+        "square": {
+            "location_ids": ["L1ABC...", "L2DEF..."],
+            "access_token_env": "SQUARE_ACCESS_TOKEN_MYFARM"
+        }
+    }
+
+The first location is the default. When a client declares locations, only
+those may be requested. Every ``location_id`` query parameter also accepts
+``all``, which queries each of the client's locations concurrently and merges
+the results. Sites without a "square" block use SQUARE_ACCESS_TOKEN and
+SQUARE_LOCATION_ID.
+
+CATALOG MIRROR:
+---------------
+Catalog reads are served from a local SQLite mirror
+(services/square_catalog_mirror.py) once it has completed a full sync. The
+mirror refreshes itself incrementally in the background every
+SQUARE_CATALOG_SYNC_SECONDS; until the first sync finishes, reads go to
+Square directly. The mirror holds the SQUARE_ACCESS_TOKEN account only;
+clients with their own account always read from Square.
+
 ENVIRONMENT VARIABLES:
 ---------------------
 Required:
@@ -29,16 +63,51 @@ Optional:
 - SQUARE_API_BASE: Square API base URL (defaults to production)
   Production: https://connect.squareup.com
   Sandbox: https://connect.squareupsandbox.com
+- SQUARE_CATALOG_MIRROR: "0" disables the local catalog mirror (default "1")
+- SQUARE_CATALOG_SYNC_SECONDS: mirror refresh interval (default 300)
+- SQUARE_INVENTORY_TTL_SECONDS: inventory count cache lifetime (default 60)
+- SQUARE_MAX_CONCURRENCY: parallel Square requests for bulk reads (default 4)
+- SQUARE_RELATED_MEMO_SECONDS: how long each worker remembers CATEGORY and
+  IMAGE objects fetched for listings (default 300)
+- SQUARE_RATE_LIMIT_PER_SECOND / SQUARE_RATE_LIMIT_BURST: outbound request
+  budget per access token, shared by all workers (defaults 10 / 20); see
+  services/rate_limit.py for the retry settings
+- SQUARE_WEBHOOK_SIGNATURE_KEY: webhook subscription signature key; webhook
+  requests without a valid x-square-hmacsha256-signature are rejected, and
+  without a key every webhook request is refused (503)
+- SQUARE_WEBHOOK_URL: notification URL registered with Square (used in the
+  signature; defaults to the URL the request arrived on)
 """
 
 from __future__ import annotations
 
 import os
+import base64
+import contextvars
+import hashlib
+import hmac
+import json
 import logging
-from typing import Optional, Dict, Any, List
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from typing import Optional, Dict, Any, Iterator, List, Tuple
 
 import requests
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, has_request_context, request, jsonify, stream_with_context
+
+from data_access import get_client_paths, get_client_slug, load_client_manifest
+from services import (
+    product_links,
+    rate_limit,
+    square_catalog_mirror,
+    square_inventory_cache,
+    square_search,
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -46,6 +115,39 @@ logger = logging.getLogger(__name__)
 # Flask Blueprint for Square endpoints
 square_bp = Blueprint("square_inventory", __name__, url_prefix="/api/square")
 
+# Square accepts at most this many catalog_object_ids per inventory request
+INVENTORY_BATCH_LIMIT = 1000
+
+# Upper bound on concurrent Square requests made for one API call
+SQUARE_MAX_CONCURRENCY = int(os.getenv("SQUARE_MAX_CONCURRENCY", "4"))
+
+# Outbound request budget per Square access token (all workers combined)
+SQUARE_RATE_LIMIT_PER_SECOND = float(os.getenv("SQUARE_RATE_LIMIT_PER_SECOND", "10"))
+SQUARE_RATE_LIMIT_BURST = float(os.getenv("SQUARE_RATE_LIMIT_BURST", "20"))
+
+# Square's read endpoints that take a POST body; safe to retry like GETs
+_IDEMPOTENT_POSTS = frozenset({
+    "/v2/catalog/list",
+    "/v2/catalog/search",
+    "/v2/catalog/batch-retrieve",
+    "/v2/inventory/batch-retrieve-counts",
+})
+
+# Page size bounds for mirror-backed listings
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+# Items read (and written to the response) per step of /export.ndjson
+EXPORT_PAGE_SIZE = 200
+
+# Per-process memo of categories and images referenced by listed items
+SQUARE_RELATED_MEMO_SECONDS = int(os.getenv("SQUARE_RELATED_MEMO_SECONDS", "300"))
+RELATED_MEMO_MAX_ENTRIES = 5000
+MEMOIZED_TYPES = ("CATEGORY", "IMAGE")
+
+# Square accepts at most this many object_ids per batch-retrieve
+BATCH_RETRIEVE_LIMIT = 1000
+
 # Square API configuration from environment variables
 SQUARE_ACCESS_TOKEN = os.getenv("SQUARE_ACCESS_TOKEN")
 SQUARE_LOCATION_ID = os.getenv("SQUARE_LOCATION_ID")
@@ -53,6 +155,14 @@ SQUARE_API_BASE = os.getenv(
     "SQUARE_API_BASE",
     "https://connect.squareup.com"  # Default to production
 )
+SQUARE_WEBHOOK_SIGNATURE_KEY = os.getenv("SQUARE_WEBHOOK_SIGNATURE_KEY")
+SQUARE_WEBHOOK_URL = os.getenv("SQUARE_WEBHOOK_URL")
+
+# ``location_id`` value that fans out over every location of the client
+ALL_LOCATIONS = "all"
+
+# Manifests may only point at Square token variables, never at other secrets
+_TOKEN_ENV_PATTERN = re.compile(r"^SQUARE_ACCESS_TOKEN(_[A-Z0-9_]+)?$")
 
 
 class SquareClientError(Exception):
@@ -60,42 +170,222 @@ class SquareClientError(Exception):
     pass
 
 
-def _get_square_headers() -> Dict[str, str]:
+class SquareLocationError(ValueError):
+    """Raised when a requested location is not available to the client."""
+    pass
+
+
+@dataclass(frozen=True)
+class SquareClientConfig:
+    """Square account and locations used for one client site."""
+    
+    location_ids: Tuple[str, ...] = ()
+    access_token_env: str = "SQUARE_ACCESS_TOKEN"
+    restrict_locations: bool = False
+    
+    @property
+    def shared_account(self) -> bool:
+        """True when the client uses the platform-wide SQUARE_ACCESS_TOKEN account."""
+        return self.access_token_env == "SQUARE_ACCESS_TOKEN"
+    
+    @property
+    def access_token(self) -> Optional[str]:
+        if self.shared_account:
+            return SQUARE_ACCESS_TOKEN
+        return os.getenv(self.access_token_env)
+    
+    @property
+    def default_location_id(self) -> Optional[str]:
+        return self.location_ids[0] if self.location_ids else None
+    
+    def resolve_locations(self, requested: Optional[str] = None) -> List[str]:
+        """
+        Map a ``location_id`` query value to the location IDs to query.
+        
+        Args:
+            requested: A location ID, ``all``, or None for the default location
+            
+        Returns:
+            list: One or more location IDs
+            
+        Raises:
+            SquareClientError: If no location is configured
+            SquareLocationError: If the location is not one of the client's
+        """
+        if requested == ALL_LOCATIONS:
+            locations = list(self.location_ids)
+        elif requested:
+            if self.restrict_locations and requested not in self.location_ids:
+                raise SquareLocationError(f"Unknown location_id: {requested}")
+            locations = [requested]
+        else:
+            locations = [self.default_location_id] if self.default_location_id else []
+        
+        if not locations:
+            raise SquareClientError(
+                "Square location ID not configured. Set SQUARE_LOCATION_ID or declare "
+                "square.location_ids in the client manifest."
+            )
+        return locations
+
+
+class _RelatedObjectMemo:
+    """
+    Bounded, time-limited memo of CATEGORY and IMAGE objects.
+    
+    These change rarely and are shared by many items, so keeping them per
+    worker saves most follow-up lookups. Entries are keyed by account (token
+    variable) and object ID.
+    """
+    
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_many(self, account: str, object_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        cutoff = time.monotonic() - self.ttl_seconds
+        found = {}
+        with self._lock:
+            for object_id in object_ids:
+                entry = self._entries.get((account, object_id))
+                if entry is None:
+                    continue
+                if entry[0] < cutoff:
+                    del self._entries[(account, object_id)]
+                    continue
+                self._entries.move_to_end((account, object_id))
+                found[object_id] = entry[1]
+        return found
+    
+    def put_many(self, account: str, objects: List[Dict[str, Any]]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for obj in objects:
+                if obj.get("type") in MEMOIZED_TYPES and obj.get("id") and not obj.get("is_deleted"):
+                    self._entries[(account, obj["id"])] = (now, obj)
+                    self._entries.move_to_end((account, obj["id"]))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_related_memo = _RelatedObjectMemo(SQUARE_RELATED_MEMO_SECONDS, RELATED_MEMO_MAX_ENTRIES)
+
+
+def _default_config() -> SquareClientConfig:
+    """Configuration from SQUARE_ACCESS_TOKEN / SQUARE_LOCATION_ID."""
+    return SquareClientConfig(location_ids=(SQUARE_LOCATION_ID,) if SQUARE_LOCATION_ID else ())
+
+
+def get_client_square_config() -> SquareClientConfig:
+    """
+    Resolve the Square configuration for the client serving this request.
+    
+    Reads the "square" block of the client's msn_<user>.json manifest (found
+    through the request host). Clients without one, or whose manifest can't be
+    loaded, get the environment defaults.
+    
+    Returns:
+        SquareClientConfig: Configuration for the current request
+    """
+    try:
+        manifest = load_client_manifest(get_client_paths(get_client_slug(request)))
+    except (FileNotFoundError, ValueError) as exc:
+        logger.debug(f"No usable client manifest, using Square defaults: {exc}")
+        return _default_config()
+    
+    square = manifest.get("square") or {}
+    if not square:
+        return _default_config()
+    
+    if "access_token" in square:
+        logger.error(
+            f"Ignoring access_token in public manifest {manifest['manifest_path']}; "
+            "use access_token_env instead"
+        )
+    
+    token_env = square.get("access_token_env") or "SQUARE_ACCESS_TOKEN"
+    if not isinstance(token_env, str) or not _TOKEN_ENV_PATTERN.match(token_env):
+        raise SquareClientError(
+            f"Invalid square.access_token_env in {manifest['manifest_path'].name}; "
+            "it must name a SQUARE_ACCESS_TOKEN* environment variable"
+        )
+    
+    location_ids = tuple(
+        location for location in square.get("location_ids") or []
+        if isinstance(location, str) and location
+    )
+    if not location_ids and token_env == "SQUARE_ACCESS_TOKEN" and SQUARE_LOCATION_ID:
+        location_ids = (SQUARE_LOCATION_ID,)
+    
+    return SquareClientConfig(
+        location_ids=location_ids,
+        access_token_env=token_env,
+        restrict_locations=bool(square.get("location_ids"))
+    )
+
+
+def _get_square_headers(config: Optional[SquareClientConfig] = None) -> Dict[str, str]:
     """
     Get headers for Square API requests.
     
+    Args:
+        config: Client configuration (defaults to the environment account)
+        
     Returns:
         dict: Headers with authorization and content type
         
     Raises:
         SquareClientError: If access token is not configured
     """
-    if not SQUARE_ACCESS_TOKEN:
+    config = config or _default_config()
+    access_token = config.access_token
+    if not access_token:
         raise SquareClientError(
-            "Square access token not configured. Set SQUARE_ACCESS_TOKEN."
+            f"Square access token not configured. Set {config.access_token_env}."
         )
     
     return {
-        "Authorization": f"Bearer {SQUARE_ACCESS_TOKEN}",
+        "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
         "Square-Version": "2024-01-18"  # Square API version
     }
 
 
+def _parallel_map(fn, items: List[Any]) -> List[Any]:
+    """
+    ``fn`` over ``items`` on up to SQUARE_MAX_CONCURRENCY threads, in order.
+
+    Each call runs in a copy of the caller's context, so Square requests made
+    for a web request keep its deadline.
+    """
+    with ThreadPoolExecutor(max_workers=min(SQUARE_MAX_CONCURRENCY, len(items))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+
 def _make_square_request(
     method: str,
     endpoint: str,
     data: Optional[Dict[str, Any]] = None,
-    params: Optional[Dict[str, Any]] = None
+    params: Optional[Dict[str, Any]] = None,
+    config: Optional[SquareClientConfig] = None
 ) -> Dict[str, Any]:
     """
     Make an authenticated request to the Square API.
     
+    Calls go through the shared rate limiter for the access token. 429s are
+    retried after ``Retry-After``; 5xx and network errors are retried for
+    GETs and the read-only POST endpoints. While serving a web request the
+    call, retries included, is kept within REQUEST_DEADLINE_SECONDS.
+    
     Args:
         method: HTTP method (GET, POST, etc.)
         endpoint: API endpoint path (e.g., "/v2/catalog/list")
         data: Optional request body as dict
         params: Optional query parameters
+        config: Client configuration (defaults to the environment account)
         
     Returns:
         dict: JSON response from Square API
@@ -103,20 +393,34 @@ def _make_square_request(
     Raises:
         SquareClientError: If the request fails
     """
-    headers = _get_square_headers()
+    headers = _get_square_headers(config)
     url = f"{SQUARE_API_BASE}{endpoint}"
     
+    method = method.upper()
+    if method not in ("GET", "POST"):
+        raise SquareClientError(f"Unsupported HTTP method: {method}")
+    
+    def send(timeout: float) -> requests.Response:
+        if method == "GET":
+            return requests.get(url, headers=headers, params=params, timeout=timeout)
+        return requests.post(url, json=data, headers=headers, params=params, timeout=timeout)
+    
     try:
-        if method.upper() == "GET":
-            response = requests.get(url, headers=headers, params=params, timeout=30)
-        elif method.upper() == "POST":
-            response = requests.post(url, json=data, headers=headers, params=params, timeout=30)
-        else:
-            raise SquareClientError(f"Unsupported HTTP method: {method}")
-        
+        response = rate_limit.send_with_retry(
+            send,
+            bucket=rate_limit.bucket_name("square", headers["Authorization"]),
+            rate=SQUARE_RATE_LIMIT_PER_SECOND,
+            burst=SQUARE_RATE_LIMIT_BURST,
+            idempotent=method == "GET" or endpoint in _IDEMPOTENT_POSTS,
+            deadline=rate_limit.REQUEST_DEADLINE_SECONDS if has_request_context() else None
+        )
         response.raise_for_status()
         return response.json()
         
+    except rate_limit.RateLimitExceeded as exc:
+        logger.warning(f"Square API request throttled locally: {method} {endpoint} - {exc}")
+        raise SquareClientError(f"Square API rate limit reached; retry in {exc.retry_after:.0f}s")
+        
     except requests.HTTPError as exc:
         error_detail = "Unknown error"
         try:
@@ -144,15 +448,18 @@ def _make_square_request(
 def list_catalog_items(
     location_id: Optional[str] = None,
     types: Optional[List[str]] = None,
-    cursor: Optional[str] = None
+    cursor: Optional[str] = None,
+    config: Optional[SquareClientConfig] = None
 ) -> Dict[str, Any]:
     """
     List catalog items from Square.
     
     Args:
-        location_id: Optional location ID filter (defaults to SQUARE_LOCATION_ID)
+        location_id: Optional location ID filter (defaults to the client's
+            default location)
         types: Optional list of catalog object types (e.g., ["ITEM", "ITEM_VARIATION"])
         cursor: Optional pagination cursor
+        config: Client configuration (defaults to the environment account)
         
     Returns:
         dict: Square API response with catalog objects
@@ -160,13 +467,8 @@ def list_catalog_items(
     Raises:
         SquareClientError: If API call fails
     """
-    # TODO: Support per-client location_id override (e.g., from client settings)
-    # For now, use environment variable or provided location_id
-    effective_location_id = location_id or SQUARE_LOCATION_ID
-    if not effective_location_id:
-        raise SquareClientError(
-            "Square location ID not configured. Set SQUARE_LOCATION_ID or provide location_id parameter."
-        )
+    config = config or _default_config()
+    effective_location_id = location_id or config.resolve_locations()[0]
     
     request_data = {
         "location_ids": [effective_location_id]
@@ -181,21 +483,24 @@ def list_catalog_items(
     if cursor:
         request_data["cursor"] = cursor
     
-    return _make_square_request("POST", "/v2/catalog/list", data=request_data)
+    return _make_square_request("POST", "/v2/catalog/list", data=request_data, config=config)
 
 
 def get_inventory_counts(
     catalog_object_ids: Optional[List[str]] = None,
     location_ids: Optional[List[str]] = None,
-    cursor: Optional[str] = None
+    cursor: Optional[str] = None,
+    config: Optional[SquareClientConfig] = None
 ) -> Dict[str, Any]:
     """
     Get inventory counts for catalog objects.
     
     Args:
         catalog_object_ids: Optional list of catalog object IDs to filter
-        location_ids: Optional list of location IDs (defaults to SQUARE_LOCATION_ID)
+        location_ids: Optional list of location IDs (defaults to the client's
+            default location)
         cursor: Optional pagination cursor
+        config: Client configuration (defaults to the environment account)
         
     Returns:
         dict: Square API response with inventory counts
@@ -203,12 +508,8 @@ def get_inventory_counts(
     Raises:
         SquareClientError: If API call fails
     """
-    # TODO: Support per-client location_ids override
-    effective_location_ids = location_ids or ([SQUARE_LOCATION_ID] if SQUARE_LOCATION_ID else None)
-    if not effective_location_ids:
-        raise SquareClientError(
-            "Square location ID not configured. Set SQUARE_LOCATION_ID or provide location_ids parameter."
-        )
+    config = config or _default_config()
+    effective_location_ids = location_ids or config.resolve_locations()
     
     request_data = {
         "location_ids": effective_location_ids
@@ -220,7 +521,547 @@ def get_inventory_counts(
     if cursor:
         request_data["cursor"] = cursor
     
-    return _make_square_request("POST", "/v2/inventory/batch-retrieve-counts", data=request_data)
+    return _make_square_request(
+        "POST", "/v2/inventory/batch-retrieve-counts", data=request_data, config=config
+    )
+
+
+def get_inventory_counts_bulk(
+    catalog_object_ids: List[str],
+    location_ids: Optional[List[str]] = None,
+    config: Optional[SquareClientConfig] = None
+) -> List[Dict[str, Any]]:
+    """
+    Get inventory counts for any number of catalog objects and locations.
+    
+    IDs are split into chunks of INVENTORY_BATCH_LIMIT; every (chunk, location)
+    pair is fetched on a bounded thread pool and follows its own ``cursor``
+    to the last page, so wall time stays close to one round trip.
+    
+    Args:
+        catalog_object_ids: Catalog object IDs (normally ITEM_VARIATION IDs,
+            which is where Square keeps counts)
+        location_ids: Optional list of location IDs (defaults to the client's
+            default location)
+        config: Client configuration (defaults to the environment account)
+        
+    Returns:
+        list: All counts, in Square's count format
+        
+    Raises:
+        SquareClientError: If any request fails
+    """
+    config = config or _default_config()
+    effective_location_ids = location_ids or config.resolve_locations()
+    if not catalog_object_ids:
+        return []
+    
+    unique_ids = list(dict.fromkeys(catalog_object_ids))
+    tasks = [
+        (unique_ids[start:start + INVENTORY_BATCH_LIMIT], location_id)
+        for start in range(0, len(unique_ids), INVENTORY_BATCH_LIMIT)
+        for location_id in effective_location_ids
+    ]
+    
+    def fetch(task: Tuple[List[str], str]) -> List[Dict[str, Any]]:
+        chunk, location_id = task
+        counts = []
+        cursor = None
+        while True:
+            response = get_inventory_counts(
+                catalog_object_ids=chunk,
+                location_ids=[location_id],
+                cursor=cursor,
+                config=config
+            )
+            counts.extend(response.get("counts", []))
+            cursor = response.get("cursor")
+            if not cursor:
+                return counts
+    
+    if len(tasks) == 1:
+        return fetch(tasks[0])
+    
+    results = _parallel_map(fetch, tasks)
+    
+    return [count for counts in results for count in counts]
+
+
+def rollup_inventory(
+    counts: List[Dict[str, Any]],
+    parent_ids: Optional[Dict[str, str]] = None
+) -> Dict[str, Dict[str, str]]:
+    """
+    Sum inventory quantities per state, optionally rolled up to a parent ID.
+    
+    Args:
+        counts: Counts in Square's format (quantities are decimal strings)
+        parent_ids: Optional mapping of catalog_object_id -> parent ID (e.g.
+            variation -> item); unmapped IDs are kept as they are
+        
+    Returns:
+        dict: ``{id: {state: quantity}}`` with quantities as decimal strings
+    """
+    totals: Dict[str, Dict[str, Decimal]] = {}
+    for count in counts:
+        object_id = count.get("catalog_object_id")
+        state = count.get("state")
+        if not object_id or not state:
+            continue
+        try:
+            quantity = Decimal(str(count.get("quantity") or "0"))
+        except InvalidOperation:
+            continue
+        key = (parent_ids or {}).get(object_id, object_id)
+        by_state = totals.setdefault(key, {})
+        by_state[state] = by_state.get(state, Decimal(0)) + quantity
+    
+    return {
+        key: {state: format(total.normalize(), "f") for state, total in by_state.items()}
+        for key, by_state in totals.items()
+    }
+
+
+def rollup_inventory_by_location(
+    counts: List[Dict[str, Any]],
+    parent_ids: Optional[Dict[str, str]] = None
+) -> Dict[str, Dict[str, Dict[str, str]]]:
+    """
+    Like ``rollup_inventory`` but kept apart per location.
+    
+    Returns:
+        dict: ``{id: {location_id: {state: quantity}}}``
+    """
+    by_location: Dict[str, List[Dict[str, Any]]] = {}
+    for count in counts:
+        by_location.setdefault(count.get("location_id") or "", []).append(count)
+    
+    result: Dict[str, Dict[str, Dict[str, str]]] = {}
+    for location_id, location_counts in by_location.items():
+        for key, states in rollup_inventory(location_counts, parent_ids).items():
+            result.setdefault(key, {})[location_id] = states
+    return result
+
+
+def get_inventory_counts_cached(
+    catalog_object_ids: List[str],
+    location_ids: Optional[List[str]] = None,
+    config: Optional[SquareClientConfig] = None
+) -> Dict[str, Any]:
+    """
+    Get inventory counts through the shared inventory count cache.
+    
+    Only objects without a fresh cache entry for every requested location are
+    fetched from Square (via ``get_inventory_counts_bulk``), and the answer is
+    written back to the cache.
+    
+    Args:
+        catalog_object_ids: Catalog object IDs to get counts for
+        location_ids: Optional list of location IDs (defaults to the client's
+            default location)
+        config: Client configuration (defaults to the environment account)
+        
+    Returns:
+        dict: ``{"counts": [...]}`` in Square's count format
+        
+    Raises:
+        SquareClientError: If the Square call for cache misses fails
+    """
+    config = config or _default_config()
+    effective_location_ids = location_ids or config.resolve_locations()
+    
+    try:
+        counts, missing = square_inventory_cache.get_counts(catalog_object_ids, effective_location_ids)
+    except Exception as exc:
+        logger.warning(f"Inventory cache unavailable, fetching from Square: {exc}")
+        counts, missing = [], list(catalog_object_ids)
+    
+    if missing:
+        fetched = get_inventory_counts_bulk(missing, effective_location_ids, config=config)
+        
+        try:
+            square_inventory_cache.store_counts(missing, effective_location_ids, fetched)
+        except Exception as exc:
+            logger.warning(f"Failed to cache inventory counts: {exc}")
+        counts.extend(fetched)
+    
+    return {"counts": counts}
+
+
+def iter_catalog_objects(
+    location_id: Optional[str] = None,
+    types: Optional[List[str]] = None,
+    cursor: Optional[str] = None,
+    config: Optional[SquareClientConfig] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over catalog pages, following Square's ``cursor`` until exhausted.
+    
+    Args:
+        location_id: Optional location ID filter (defaults to the client's
+            default location)
+        types: Optional list of catalog object types
+        cursor: Optional cursor to resume from
+        config: Client configuration (defaults to the environment account)
+        
+    Yields:
+        dict: One raw Square list response (``objects`` + ``cursor``) per page
+        
+    Raises:
+        SquareClientError: If any page request fails
+    """
+    while True:
+        page = list_catalog_items(location_id=location_id, types=types, cursor=cursor, config=config)
+        yield page
+        cursor = page.get("cursor")
+        if not cursor:
+            return
+
+
+def _object_data(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return the type-specific payload of a catalog object.
+    
+    Square nests it under ``<type>_data`` (e.g. ``item_data``); the keyed-by-type
+    form (``obj["ITEM"]``) is accepted as well.
+    """
+    obj_type = obj.get("type") or ""
+    return obj.get(f"{obj_type.lower()}_data") or obj.get(obj_type) or {}
+
+
+def index_catalog_objects(objects: List[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Group catalog objects by type and index each group by object ID.
+    
+    Built once per page so shaping does dictionary lookups instead of
+    rescanning ``objects`` for every item.
+    
+    Returns:
+        dict: ``{type: {object_id: object}}``
+    """
+    index: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for obj in objects:
+        obj_type = obj.get("type")
+        obj_id = obj.get("id")
+        if obj_type and obj_id:
+            index.setdefault(obj_type, {})[obj_id] = obj
+    return index
+
+
+def _shape_variation(var_obj: Dict[str, Any]) -> Dict[str, Any]:
+    var_data = _object_data(var_obj)
+    price_money = var_data.get("price_money", {})
+    return {
+        "id": var_obj.get("id"),
+        "name": var_data.get("name"),
+        "price": {
+            "amount": price_money.get("amount"),
+            "currency": price_money.get("currency")
+        } if price_money else None
+    }
+
+
+def shape_catalog_items(objects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Shape one page of raw catalog objects into the ``/items`` item format.
+    
+    Runs in O(len(objects)): related variations and categories are resolved
+    through ``index_catalog_objects``. Variations embedded in the item
+    (``item_data.variations``) are used directly, so they resolve even when
+    the ITEM_VARIATION objects sit on another page.
+    
+    Returns:
+        list: Shaped items in page order
+    """
+    index = index_catalog_objects(objects)
+    variations_by_id = index.get("ITEM_VARIATION", {})
+    categories_by_id = index.get("CATEGORY", {})
+    images_by_id = index.get("IMAGE", {})
+    
+    items = []
+    for obj in objects:
+        if obj.get("type") != "ITEM":
+            continue
+        
+        obj_data = _object_data(obj)
+        
+        # Get variations for this item
+        variations = []
+        embedded = {
+            var.get("id"): var for var in obj_data.get("variations", []) if _object_data(var)
+        }
+        variation_ids = obj_data.get("item_variation_ids") or [
+            var.get("id") for var in obj_data.get("variations", [])
+        ]
+        for var_id in variation_ids:
+            var_obj = variations_by_id.get(var_id) or embedded.get(var_id)
+            if var_obj:
+                variations.append(_shape_variation(var_obj))
+        
+        # Get category if available
+        category_id = obj_data.get("category_id")
+        category = None
+        if category_id and category_id in categories_by_id:
+            category = {
+                "id": category_id,
+                "name": _object_data(categories_by_id[category_id]).get("name")
+            }
+        
+        images = []
+        for image_id in obj_data.get("image_ids") or []:
+            if image_id in images_by_id:
+                image_data = _object_data(images_by_id[image_id])
+                images.append({
+                    "id": image_id,
+                    "url": image_data.get("url"),
+                    "caption": image_data.get("caption")
+                })
+        
+        items.append({
+            "id": obj.get("id"),
+            "name": obj_data.get("name"),
+            "description": obj_data.get("description"),
+            "category": category,
+            "images": images,
+            "variations": variations
+        })
+    
+    return items
+
+
+def expand_related_objects(
+    objects: List[Dict[str, Any]],
+    config: Optional[SquareClientConfig] = None
+) -> List[Dict[str, Any]]:
+    """
+    Add every variation, category and image referenced by a page's items.
+    
+    Objects already on the page are used first, then the per-process memo of
+    categories and images. Whatever is still missing is fetched with a single
+    ``/v2/catalog/batch-retrieve`` call (for pages of up to
+    BATCH_RETRIEVE_LIMIT missing IDs). If that call fails the page is
+    returned as far as it could be expanded.
+    
+    Args:
+        objects: Raw objects of one listing page
+        config: Client configuration (defaults to the environment account)
+        
+    Returns:
+        list: ``objects`` followed by the related objects that were missing
+    """
+    config = config or _default_config()
+    account = config.access_token_env
+    present = {obj.get("id") for obj in objects}
+    _related_memo.put_many(account, objects)
+    
+    wanted: List[str] = []
+    for obj in objects:
+        if obj.get("type") != "ITEM":
+            continue
+        data = _object_data(obj)
+        embedded = {var.get("id") for var in data.get("variations") or [] if _object_data(var)}
+        variation_ids = data.get("item_variation_ids") or [var.get("id") for var in data.get("variations") or []]
+        wanted.extend(vid for vid in variation_ids if vid not in embedded)
+        if data.get("category_id"):
+            wanted.append(data["category_id"])
+        wanted.extend(category.get("id") for category in data.get("categories") or [])
+        wanted.extend(data.get("image_ids") or [])
+    
+    missing = [object_id for object_id in dict.fromkeys(wanted) if object_id and object_id not in present]
+    if not missing:
+        return objects
+    
+    memoized = _related_memo.get_many(account, missing)
+    missing = [object_id for object_id in missing if object_id not in memoized]
+    fetched: List[Dict[str, Any]] = []
+    try:
+        for start in range(0, len(missing), BATCH_RETRIEVE_LIMIT):
+            response = _make_square_request(
+                "POST",
+                "/v2/catalog/batch-retrieve",
+                data={"object_ids": missing[start:start + BATCH_RETRIEVE_LIMIT], "include_related_objects": False},
+                config=config
+            )
+            fetched.extend(response.get("objects", []))
+    except SquareClientError as exc:
+        logger.warning(f"Failed to expand related catalog objects: {exc}")
+    _related_memo.put_many(account, fetched)
+    
+    return objects + list(memoized.values()) + fetched
+
+
+def iter_catalog_items(
+    location_id: Optional[str] = None,
+    cursor: Optional[str] = None
+) -> Iterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+    """
+    Iterate over the whole catalog as shaped items, one page at a time.
+    
+    Yields:
+        tuple: (shaped items of the page, cursor for the next page or None)
+    """
+    for page in iter_catalog_objects(
+        location_id=location_id,
+        types=["ITEM", "ITEM_VARIATION", "CATEGORY"],
+        cursor=cursor
+    ):
+        yield shape_catalog_items(expand_related_objects(page.get("objects", []))), page.get("cursor")
+
+
+# Listing cursors handed out for mirror pages carry this prefix before the
+# last item ID; Square's cursors (and packed per-location ones) never
+# contain a colon, so each kind goes back to the source that issued it.
+_MIRROR_CURSOR_PREFIX = "mirror:"
+
+
+def _is_mirror_cursor(cursor: Optional[str]) -> bool:
+    return bool(cursor) and cursor.startswith(_MIRROR_CURSOR_PREFIX)
+
+
+def _list_items_from_mirror(
+    location_ids: List[str],
+    category_id: Optional[str],
+    limit: int,
+    cursor: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    """
+    Read one listing page from the catalog mirror, refreshing it in the background.
+    
+    Args:
+        cursor: A mirror cursor from a previous page, or None
+    
+    Returns:
+        dict: ``{"objects", "cursor", "source"}`` like a list response, or None
+        if the mirror can't serve yet (caller falls back to Square)
+        
+    Raises:
+        SquareLocationError: If ``cursor`` is malformed
+    """
+    after = None
+    if cursor:
+        after = cursor[len(_MIRROR_CURSOR_PREFIX):]
+        if not after:
+            raise SquareLocationError("Invalid cursor")
+    try:
+        square_catalog_mirror.refresh_in_background(_make_square_request)
+        objects, next_cursor = square_catalog_mirror.query_item_page(
+            location_ids=location_ids,
+            category_id=category_id,
+            limit=limit,
+            cursor=after
+        )
+    except square_catalog_mirror.MirrorEmptyError:
+        return None
+    except Exception as exc:
+        logger.warning(f"Square catalog mirror unavailable, using Square directly: {exc}")
+        return None
+    
+    return {
+        "objects": objects,
+        "cursor": f"{_MIRROR_CURSOR_PREFIX}{next_cursor}" if next_cursor else None,
+        "source": "mirror"
+    }
+
+
+def _encode_location_cursor(cursors: Dict[str, str]) -> Optional[str]:
+    if not cursors:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursors).encode("utf-8")).decode("ascii")
+
+
+def _decode_location_cursor(cursor: str) -> Dict[str, str]:
+    try:
+        cursors = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError) as exc:
+        raise SquareLocationError("Invalid cursor") from exc
+    if not isinstance(cursors, dict):
+        raise SquareLocationError("Invalid cursor")
+    return cursors
+
+
+def _list_items_across_locations(
+    location_ids: List[str],
+    types: Optional[List[str]],
+    cursor: Optional[str],
+    config: SquareClientConfig
+) -> Dict[str, Any]:
+    """
+    Fetch one catalog page per location concurrently and merge them.
+    
+    The returned ``cursor`` packs every location's own cursor; locations
+    whose listing is exhausted drop out of it.
+    
+    Returns:
+        dict: ``{"objects", "cursor"}`` like a list response
+        
+    Raises:
+        SquareClientError: If any location's request fails
+        SquareLocationError: If ``cursor`` is malformed
+    """
+    if cursor:
+        cursors = _decode_location_cursor(cursor)
+        pending = [(location_id, cursors[location_id]) for location_id in location_ids if location_id in cursors]
+    else:
+        pending = [(location_id, None) for location_id in location_ids]
+    
+    def fetch(task: Tuple[str, Optional[str]]) -> Dict[str, Any]:
+        location_id, location_cursor = task
+        return list_catalog_items(location_id=location_id, types=types, cursor=location_cursor, config=config)
+    
+    if not pending:
+        return {"objects": [], "cursor": None}
+    
+    pages = _parallel_map(fetch, pending)
+    
+    objects: Dict[str, Dict[str, Any]] = {}
+    next_cursors: Dict[str, str] = {}
+    for (location_id, _), page in zip(pending, pages):
+        for obj in page.get("objects", []):
+            objects.setdefault(obj.get("id"), obj)
+        if page.get("cursor"):
+            next_cursors[location_id] = page["cursor"]
+    
+    return {"objects": list(objects.values()), "cursor": _encode_location_cursor(next_cursors)}
+
+
+def _attach_inventory(
+    items: List[Dict[str, Any]],
+    location_ids: List[str],
+    config: SquareClientConfig
+) -> None:
+    """
+    Add ``inventory`` to shaped items and their variations, in place.
+    
+    Square keeps counts on ITEM_VARIATIONs, so those are fetched (through the
+    count cache) and rolled up per item. With several locations each item
+    also gets ``inventory_by_location``.
+    
+    Raises:
+        SquareClientError: If counts can't be fetched
+    """
+    variation_parents = {
+        variation["id"]: item["id"]
+        for item in items
+        for variation in item["variations"]
+    }
+    inventory_response = get_inventory_counts_cached(
+        catalog_object_ids=list(variation_parents),
+        location_ids=location_ids,
+        config=config
+    )
+    counts = inventory_response.get("counts", [])
+    variation_inventory = rollup_inventory(counts)
+    item_inventory = rollup_inventory(counts, variation_parents)
+    item_locations = (
+        rollup_inventory_by_location(counts, variation_parents) if len(location_ids) > 1 else None
+    )
+    
+    for item in items:
+        item["inventory"] = item_inventory.get(item["id"], {})
+        if item_locations is not None:
+            item["inventory_by_location"] = item_locations.get(item["id"], {})
+        for variation in item["variations"]:
+            variation["inventory"] = variation_inventory.get(variation["id"], {})
 
 
 @square_bp.route("/items", methods=["GET"])
@@ -228,10 +1069,18 @@ def list_items():
     """
     List products/items from Square catalog.
     
+    Served from the local catalog mirror when it is ready (and ``types`` is
+    not given); otherwise from Square's ``/v2/catalog/list``, one request per
+    location in parallel when several are queried.
+    
     Query parameters:
-        location_id: Optional location ID (overrides SQUARE_LOCATION_ID)
+        location_id: Optional location ID, or ``all`` for every location of
+            the client (defaults to the client's first location)
         types: Optional comma-separated list of catalog types (default: ITEM,ITEM_VARIATION)
-        cursor: Optional pagination cursor
+        cursor: Optional pagination cursor from the previous page; a mirror
+            cursor the mirror can no longer serve is rejected (400)
+        category_id: Optional category filter (mirror only)
+        limit: Optional page size, 1-1000 (mirror only, default: 100)
         include_inventory: Optional boolean to include inventory counts (default: false)
         
     Returns:
@@ -244,16 +1093,23 @@ def list_items():
                     "description": "...",
                     "price": {...},
                     "category": {...},
+                    "images": [{"id": "...", "url": "...", "caption": "..."}],
                     "variations": [...]
                 }
             ],
             "cursor": "...",
-            "has_more": false
+            "has_more": false,
+            "source": "mirror" | "square",
+            "location_ids": ["..."]
         }
+        
+        With several locations, each item also carries
+        ``inventory_by_location`` when inventory is included.
     """
     try:
         # Parse query parameters
-        location_id = request.args.get("location_id")
+        config = get_client_square_config()
+        location_ids = config.resolve_locations(request.args.get("location_id"))
         types_param = request.args.get("types")
         cursor = request.args.get("cursor")
         include_inventory = request.args.get("include_inventory", "false").lower() == "true"
@@ -263,84 +1119,50 @@ def list_items():
         if types_param:
             types = [t.strip() for t in types_param.split(",")]
         
-        # Fetch catalog items
-        response = list_catalog_items(
-            location_id=location_id,
-            types=types,
-            cursor=cursor
-        )
+        try:
+            limit = max(1, min(int(request.args.get("limit", DEFAULT_PAGE_LIMIT)), MAX_PAGE_LIMIT))
+        except ValueError:
+            return jsonify({"error": "limit must be a whole number"}), 400
         
-        # Extract and format items
-        objects = response.get("objects", [])
-        items = []
-        item_ids = []
+        response = None
+        mirror_cursor = _is_mirror_cursor(cursor)
+        # A Square cursor keeps paging through Square even once the mirror is ready
+        if (square_catalog_mirror.SQUARE_CATALOG_MIRROR_ENABLED and config.shared_account and not types
+                and (not cursor or mirror_cursor)):
+            response = _list_items_from_mirror(
+                location_ids=location_ids,
+                category_id=request.args.get("category_id"),
+                limit=limit,
+                cursor=cursor
+            )
         
-        for obj in objects:
-            obj_type = obj.get("type")
-            obj_data = obj.get(obj_type, {})
-            
-            # Process ITEM objects
-            if obj_type == "ITEM":
-                item_id = obj.get("id")
-                item_ids.append(item_id)
-                
-                # Get variations for this item
-                variation_ids = obj_data.get("item_variation_ids", [])
-                variations = []
-                for var_obj in objects:
-                    if var_obj.get("type") == "ITEM_VARIATION" and var_obj.get("id") in variation_ids:
-                        var_data = var_obj.get("ITEM_VARIATION", {})
-                        price_money = var_data.get("price_money", {})
-                        variations.append({
-                            "id": var_obj.get("id"),
-                            "name": var_data.get("name"),
-                            "price": {
-                                "amount": price_money.get("amount"),
-                                "currency": price_money.get("currency")
-                            } if price_money else None
-                        })
-                
-                # Get category if available
-                category_id = obj_data.get("category_id")
-                category = None
-                if category_id:
-                    for cat_obj in objects:
-                        if cat_obj.get("type") == "CATEGORY" and cat_obj.get("id") == category_id:
-                            category = {
-                                "id": category_id,
-                                "name": cat_obj.get("CATEGORY", {}).get("name")
-                            }
-                            break
-                
-                items.append({
-                    "id": item_id,
-                    "name": obj_data.get("name"),
-                    "description": obj_data.get("description"),
-                    "category": category,
-                    "variations": variations
-                })
+        if response is None and mirror_cursor:
+            raise SquareLocationError(
+                "Cursor is from the catalog mirror, which can't serve this listing now; start again without it"
+            )
+        
+        if response is None:
+            # Fetch catalog items
+            if len(location_ids) == 1:
+                response = list_catalog_items(
+                    location_id=location_ids[0],
+                    types=types,
+                    cursor=cursor,
+                    config=config
+                )
+            else:
+                response = _list_items_across_locations(location_ids, types, cursor, config)
+            response["objects"] = expand_related_objects(response.get("objects", []), config)
+            response["source"] = "square"
+        
+        # Extract and format items
+        items = shape_catalog_items(response.get("objects", []))
+        item_ids = [item["id"] for item in items]
         
         # Optionally include inventory counts
-        inventory_data = {}
         if include_inventory and item_ids:
             try:
-                inventory_response = get_inventory_counts(
-                    catalog_object_ids=item_ids,
-                    location_ids=[location_id] if location_id else None
-                )
-                counts = inventory_response.get("counts", [])
-                for count in counts:
-                    catalog_id = count.get("catalog_object_id")
-                    state = count.get("state")
-                    quantity = count.get("quantity")
-                    if catalog_id:
-                        if catalog_id not in inventory_data:
-                            inventory_data[catalog_id] = {}
-                        inventory_data[catalog_id][state] = quantity
-                
-                # Attach inventory to items
-                for item in items:
-                    item["inventory"] = inventory_data.get(item["id"], {})
+                _attach_inventory(items, location_ids, config)
             except SquareClientError as exc:
                 logger.warning(f"Failed to fetch inventory counts: {exc}")
                 # Continue without inventory data
@@ -348,11 +1170,16 @@ def list_items():
         result = {
             "items": items,
             "cursor": response.get("cursor"),
-            "has_more": bool(response.get("cursor"))
+            "has_more": bool(response.get("cursor")),
+            "source": response["source"],
+            "location_ids": location_ids
         }
         
         return jsonify(result), 200
         
+    except SquareLocationError as exc:
+        return jsonify({"error": str(exc)}), 400
+    
     except SquareClientError as exc:
         logger.error(f"Square items listing failed: {exc}")
         return jsonify({"error": str(exc)}), 502
@@ -362,6 +1189,386 @@ def list_items():
         return jsonify({"error": "Internal server error"}), 500
 
 
+@square_bp.route("/items/<item_id>", methods=["GET"])
+def get_item(item_id: str):
+    """
+    Get a single catalog item with its variations and category.
+    
+    Served from the catalog mirror when it is ready, otherwise from Square's
+    ``/v2/catalog/object/{id}`` with related objects.
+    
+    Returns:
+        JSON response with the item in the same shape as ``/items`` entries,
+        or 404 if the item does not exist
+    """
+    try:
+        config = get_client_square_config()
+        objects = None
+        source = "square"
+        if square_catalog_mirror.SQUARE_CATALOG_MIRROR_ENABLED and config.shared_account:
+            try:
+                square_catalog_mirror.refresh_in_background(_make_square_request)
+                objects = square_catalog_mirror.get_item_objects(item_id)
+                source = "mirror"
+                if objects is None:
+                    return jsonify({"error": "item not found"}), 404
+            except square_catalog_mirror.MirrorEmptyError:
+                objects = None
+        
+        if objects is None:
+            response = _make_square_request(
+                "GET",
+                f"/v2/catalog/object/{item_id}",
+                params={"include_related_objects": "true"},
+                config=config
+            )
+            objects = [response["object"]] if response.get("object") else []
+            objects = expand_related_objects(objects + response.get("related_objects", []), config)
+        
+        items = [item for item in shape_catalog_items(objects) if item["id"] == item_id]
+        if not items:
+            return jsonify({"error": "item not found"}), 404
+        
+        return jsonify({"item": items[0], "source": source}), 200
+        
+    except SquareClientError as exc:
+        logger.error(f"Square item fetch failed: {exc}")
+        return jsonify({"error": str(exc)}), 502
+    
+    except Exception as exc:
+        logger.error(f"Unexpected error fetching Square item: {exc}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+def _iter_export_pages(
+    config: SquareClientConfig,
+    location_ids: List[str],
+    category_id: Optional[str]
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield the catalog as pages of raw objects, from the mirror when it is
+    ready and from Square otherwise. Only one page is held at a time.
+    """
+    if square_catalog_mirror.SQUARE_CATALOG_MIRROR_ENABLED and config.shared_account:
+        cursor = None
+        try:
+            while True:
+                objects, cursor = square_catalog_mirror.query_item_page(
+                    location_ids=location_ids,
+                    category_id=category_id,
+                    limit=EXPORT_PAGE_SIZE,
+                    cursor=cursor
+                )
+                yield objects
+                if not cursor:
+                    return
+        except square_catalog_mirror.MirrorEmptyError:
+            square_catalog_mirror.refresh_in_background(_make_square_request)
+    
+    types = ["ITEM", "ITEM_VARIATION", "CATEGORY"]
+    cursor = None
+    while True:
+        if len(location_ids) == 1:
+            page = list_catalog_items(location_id=location_ids[0], types=types, cursor=cursor, config=config)
+        else:
+            page = _list_items_across_locations(location_ids, types, cursor, config)
+        yield expand_related_objects(page.get("objects", []), config)
+        cursor = page.get("cursor")
+        if not cursor:
+            return
+
+
+@square_bp.route("/export.ndjson", methods=["GET"])
+def export_items():
+    """
+    Stream the whole catalog as newline-delimited JSON.
+    
+    Items are read, shaped and given inventory one page at a time, and each
+    page is written as one chunk, so memory stays flat and a slow client
+    simply slows the export down.
+    
+    Query parameters:
+        location_id: Optional location ID, or ``all`` for every location of
+            the client (defaults to the client's first location)
+        category_id: Optional category filter
+        include_inventory: Optional boolean (default: true)
+        
+    Returns:
+        ``application/x-ndjson``: one item per line in the ``/items`` format,
+        then a final status line, either
+        ``{"export_complete": true, "items": N}`` or
+        ``{"export_error": "...", "items": N}`` if the export stopped early
+    """
+    try:
+        config = get_client_square_config()
+        location_ids = config.resolve_locations(request.args.get("location_id"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except SquareClientError as exc:
+        logger.error(f"Square export failed: {exc}")
+        return jsonify({"error": str(exc)}), 502
+    
+    category_id = request.args.get("category_id") or None
+    include_inventory = request.args.get("include_inventory", "true").lower() != "false"
+    
+    def generate() -> Iterator[str]:
+        exported = 0
+        try:
+            for objects in _iter_export_pages(config, location_ids, category_id):
+                items = shape_catalog_items(objects)
+                if category_id:
+                    items = [item for item in items if (item["category"] or {}).get("id") == category_id]
+                if include_inventory and items:
+                    _attach_inventory(items, location_ids, config)
+                exported += len(items)
+                if items:
+                    yield "".join(json.dumps(item, separators=(",", ":")) + "\n" for item in items)
+        except SquareClientError as exc:
+            logger.error(f"Square export stopped after {exported} items: {exc}")
+            yield json.dumps({"export_error": str(exc), "items": exported}) + "\n"
+            return
+        except Exception as exc:
+            logger.error(f"Unexpected error exporting Square items: {exc}", exc_info=True)
+            yield json.dumps({"export_error": "Internal server error", "items": exported}) + "\n"
+            return
+        
+        yield json.dumps({"export_complete": True, "items": exported}) + "\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-store",
+            # Let nginx pass chunks through as they are produced
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+def _optional_int(value: Optional[str], name: str) -> Optional[int]:
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a whole number")
+
+
+@square_bp.route("/search", methods=["GET"])
+def search_items():
+    """
+    Search catalog items through the local search index (no Square call).
+    
+    Query parameters:
+        q: Optional search text; every word must match an item's name or
+            description (the last letters of a word may be left off)
+        category_id: Optional category filter
+        min_price, max_price: Optional bounds on the lowest variation price,
+            in the currency's smallest unit (e.g. cents)
+        location_id: Optional location ID, or ``all`` for every location of
+            the client (defaults to the client's first location)
+        sort: relevance (default when q is given), name, price or -price
+        limit: Optional page size, 1-100 (default: 20)
+        cursor: Optional pagination cursor from a previous response
+        
+    Returns:
+        JSON response with ranked items in the ``/items`` format:
+        {
+            "items": [...],
+            "total": 42,
+            "cursor": "...",
+            "has_more": true,
+            "took_ms": 0.4
+        }
+        
+        503 until the catalog mirror has completed its first sync, or for
+        clients on their own Square account (which the mirror doesn't cover).
+    """
+    started = time.perf_counter()
+    try:
+        config = get_client_square_config()
+        if not (square_catalog_mirror.SQUARE_CATALOG_MIRROR_ENABLED and config.shared_account):
+            return jsonify({"error": "Catalog search is not available for this site"}), 503
+        
+        location_ids = config.resolve_locations(request.args.get("location_id"))
+        query = request.args.get("q", "").strip()
+        sort = request.args.get("sort") or ("relevance" if query else "name")
+        if sort not in square_search.SORT_ORDERS:
+            return jsonify({"error": f"sort must be one of {', '.join(square_search.SORT_ORDERS)}"}), 400
+        
+        limit = _optional_int(request.args.get("limit"), "limit") or 20
+        limit = max(1, min(limit, 100))
+        offset = _optional_int(request.args.get("cursor"), "cursor") or 0
+        
+        objects, total = square_search.search(
+            query=query,
+            category_id=request.args.get("category_id") or None,
+            min_price=_optional_int(request.args.get("min_price"), "min_price"),
+            max_price=_optional_int(request.args.get("max_price"), "max_price"),
+            location_ids=location_ids,
+            sort=sort,
+            offset=max(0, offset),
+            limit=limit
+        )
+        
+        square_catalog_mirror.refresh_in_background(_make_square_request)
+        
+        next_offset = offset + limit
+        return jsonify({
+            "items": shape_catalog_items(objects),
+            "total": total,
+            "cursor": str(next_offset) if next_offset < total else None,
+            "has_more": next_offset < total,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
+        }), 200
+        
+    except ValueError as exc:
+        # Bad query parameter, including an unknown location_id
+        return jsonify({"error": str(exc)}), 400
+    
+    except square_catalog_mirror.MirrorEmptyError:
+        square_catalog_mirror.refresh_in_background(_make_square_request)
+        return jsonify({"error": "Catalog search is not ready yet"}), 503
+    
+    except SquareClientError as exc:
+        logger.error(f"Square search failed: {exc}")
+        return jsonify({"error": str(exc)}), 502
+    
+    except Exception as exc:
+        logger.error(f"Unexpected error searching Square items: {exc}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@square_bp.route("/product-links", methods=["GET"])
+def get_product_links():
+    """
+    Square items linked to product_type_crop products, keyed by product_id.
+    
+    Links are precomputed by services/product_links.py from the catalog
+    mirror, so CSA recipe and haul pages can look up stock for a
+    ``product_id`` directly.
+    
+    Query parameters:
+        product_ids: Optional comma-separated product IDs to return
+        include_inventory: Optional boolean; adds each product's stock summed
+            over its linked items (default: false)
+        location_id: Optional location ID, or ``all`` for every location of
+            the client (inventory only)
+        
+    Returns:
+        JSON response:
+        {
+            "products": {
+                "1": {
+                    "taxonomy_id": "...",
+                    "items": [{"item_id": "...", "name": "...", "method": "exact",
+                               "variation_ids": [...]}],
+                    "inventory": {"IN_STOCK": "12"}
+                }
+            }
+        }
+    """
+    try:
+        config = get_client_square_config()
+        if not (square_catalog_mirror.SQUARE_CATALOG_MIRROR_ENABLED and config.shared_account):
+            return jsonify({"error": "Product links are not available for this site"}), 503
+        
+        product_ids = [p.strip() for p in request.args.get("product_ids", "").split(",") if p.strip()]
+        include_inventory = request.args.get("include_inventory", "false").lower() == "true"
+        location_ids = config.resolve_locations(request.args.get("location_id")) if include_inventory else None
+        
+        try:
+            product_links.refresh_if_due()
+        except square_catalog_mirror.MirrorEmptyError:
+            raise
+        except Exception as exc:
+            # Serve the links from the last successful run.
+            logger.warning(f"Failed to refresh product links: {exc}")
+        
+        grouped = product_links.links_by_product(product_ids or None)
+        products = {
+            product_id: {
+                "taxonomy_id": items[0]["taxonomy_id"],
+                "items": [
+                    {key: item[key] for key in ("item_id", "name", "method", "variation_ids")}
+                    for item in items
+                ]
+            }
+            for product_id, items in grouped.items()
+        }
+        
+        if include_inventory and products:
+            variation_products = {
+                variation_id: product_id
+                for product_id, entry in products.items()
+                for item in entry["items"]
+                for variation_id in item["variation_ids"]
+            }
+            try:
+                response = get_inventory_counts_cached(
+                    catalog_object_ids=list(variation_products),
+                    location_ids=location_ids,
+                    config=config
+                )
+                rolled = rollup_inventory(response.get("counts", []), variation_products)
+                for product_id, entry in products.items():
+                    entry["inventory"] = rolled.get(product_id, {})
+            except SquareClientError as exc:
+                logger.warning(f"Failed to fetch inventory counts for product links: {exc}")
+        
+        return jsonify({"products": products}), 200
+        
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    
+    except square_catalog_mirror.MirrorEmptyError:
+        square_catalog_mirror.refresh_in_background(_make_square_request)
+        return jsonify({"error": "Product links are not ready yet"}), 503
+    
+    except SquareClientError as exc:
+        logger.error(f"Square product links failed: {exc}")
+        return jsonify({"error": str(exc)}), 502
+    
+    except Exception as exc:
+        logger.error(f"Unexpected error reading product links: {exc}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+def _variation_ids_for(object_id: str, config: Optional[SquareClientConfig] = None) -> List[str]:
+    """
+    Return the ITEM_VARIATION IDs holding stock for a catalog object.
+    
+    ITEM IDs expand to their variations (from the catalog mirror when it is
+    ready, otherwise from Square); any other ID is returned as-is.
+    """
+    config = config or _default_config()
+    objects = None
+    if square_catalog_mirror.SQUARE_CATALOG_MIRROR_ENABLED and config.shared_account:
+        try:
+            objects = square_catalog_mirror.get_item_objects(object_id)
+            if objects is None:
+                return [object_id]
+        except square_catalog_mirror.MirrorEmptyError:
+            objects = None
+    
+    if objects is None:
+        try:
+            response = _make_square_request("GET", f"/v2/catalog/object/{object_id}", config=config)
+        except SquareClientError:
+            return [object_id]
+        objects = [response.get("object") or {}]
+    
+    item = objects[0]
+    if item.get("type") != "ITEM":
+        return [object_id]
+    
+    item_data = _object_data(item)
+    variation_ids = item_data.get("item_variation_ids") or [
+        variation.get("id") for variation in item_data.get("variations", [])
+    ]
+    return variation_ids or [object_id]
+
+
 @square_bp.route("/items/<item_id>/inventory", methods=["GET"])
 def get_item_inventory(item_id: str):
     """
@@ -371,7 +1578,8 @@ def get_item_inventory(item_id: str):
         item_id: Square catalog object ID (ITEM or ITEM_VARIATION)
         
     Query parameters:
-        location_id: Optional location ID (overrides SQUARE_LOCATION_ID)
+        location_id: Optional location ID, or ``all`` for every location of
+            the client (defaults to the client's first location)
         
     Returns:
         JSON response with inventory counts:
@@ -384,37 +1592,46 @@ def get_item_inventory(item_id: str):
             },
             "location_id": "..."
         }
+        
+        With several locations, ``inventory`` is summed across them,
+        ``location_id`` is replaced by ``location_ids`` and a per-location
+        breakdown is returned in ``locations``.
     """
     if not item_id:
         return jsonify({"error": "item_id is required"}), 400
     
     try:
-        location_id = request.args.get("location_id")
+        config = get_client_square_config()
+        location_ids = config.resolve_locations(request.args.get("location_id"))
         
-        # Fetch inventory counts for this item
-        response = get_inventory_counts(
-            catalog_object_ids=[item_id],
-            location_ids=[location_id] if location_id else None
+        # Counts live on variations; an ITEM ID is expanded to its variations
+        # and the result rolled up
+        variation_ids = _variation_ids_for(item_id, config)
+        response = get_inventory_counts_cached(
+            catalog_object_ids=variation_ids,
+            location_ids=location_ids,
+            config=config
         )
         
         counts = response.get("counts", [])
-        inventory = {}
-        
-        for count in counts:
-            if count.get("catalog_object_id") == item_id:
-                state = count.get("state")
-                quantity = count.get("quantity")
-                if state:
-                    inventory[state] = quantity
+        parents = {vid: item_id for vid in variation_ids}
+        inventory = rollup_inventory(counts, parents).get(item_id, {})
         
         result = {
             "item_id": item_id,
-            "inventory": inventory,
-            "location_id": location_id or SQUARE_LOCATION_ID
+            "inventory": inventory
         }
+        if len(location_ids) == 1:
+            result["location_id"] = location_ids[0]
+        else:
+            result["location_ids"] = location_ids
+            result["locations"] = rollup_inventory_by_location(counts, parents).get(item_id, {})
         
         return jsonify(result), 200
         
+    except SquareLocationError as exc:
+        return jsonify({"error": str(exc)}), 400
+    
     except SquareClientError as exc:
         logger.error(f"Square inventory fetch failed: {exc}")
         return jsonify({"error": str(exc)}), 502
@@ -424,19 +1641,98 @@ def get_item_inventory(item_id: str):
         return jsonify({"error": "Internal server error"}), 500
 
 
+def _verify_webhook_signature(raw_body: bytes, signature: Optional[str], notification_url: str) -> bool:
+    """
+    Check Square's ``x-square-hmacsha256-signature`` header.
+    
+    The signature is base64(HMAC-SHA256(signature_key, notification_url + body)).
+    """
+    if not signature:
+        return False
+    digest = hmac.new(
+        SQUARE_WEBHOOK_SIGNATURE_KEY.encode("utf-8"),
+        notification_url.encode("utf-8") + raw_body,
+        hashlib.sha256
+    ).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode("ascii"), signature)
+
+
+@square_bp.route("/webhook", methods=["POST"])
+def webhook():
+    """
+    Receive Square webhook events.
+    
+    ``inventory.count.updated`` events update the inventory count cache
+    immediately; other event types are acknowledged and ignored.
+    
+    Returns:
+        JSON acknowledgement (200), 401 on a bad signature, 400 on a bad body,
+        503 if no signature key is configured
+    """
+    if not SQUARE_WEBHOOK_SIGNATURE_KEY:
+        # Unsigned events would let anyone set stock levels
+        logger.error("Square webhook refused: SQUARE_WEBHOOK_SIGNATURE_KEY is not set")
+        return jsonify({"error": "Webhook signature key not configured"}), 503
+    
+    raw_body = request.get_data()
+    notification_url = SQUARE_WEBHOOK_URL or request.url
+    signature = request.headers.get("x-square-hmacsha256-signature")
+    if not _verify_webhook_signature(raw_body, signature, notification_url):
+        logger.warning("Square webhook rejected: invalid signature")
+        return jsonify({"error": "invalid signature"}), 401
+    
+    event = request.get_json(silent=True)
+    if not isinstance(event, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    
+    event_type = event.get("type")
+    updated = 0
+    
+    if event_type == "inventory.count.updated":
+        data_object = (event.get("data") or {}).get("object") or {}
+        counts = data_object.get("inventory_counts") or []
+        try:
+            updated = square_inventory_cache.apply_counts(counts)
+        except Exception as exc:
+            # Let Square retry; the cache would otherwise serve old stock until the TTL.
+            logger.error(f"Failed to apply Square inventory webhook: {exc}", exc_info=True)
+            return jsonify({"error": "Failed to apply inventory update"}), 500
+    
+    logger.info(f"Square webhook received: {event_type} ({event.get('event_id')}), {updated} counts updated")
+    
+    return jsonify({"status": "received", "type": event_type, "counts_updated": updated}), 200
+
+
 @square_bp.route("/health", methods=["GET"])
 def health():
     """
     Health check endpoint for Square module.
     
     Returns:
-        JSON response indicating if Square credentials are configured
+        JSON response indicating if Square credentials are configured for
+        the requesting client
     """
-    has_credentials = bool(SQUARE_ACCESS_TOKEN and SQUARE_LOCATION_ID)
+    try:
+        config = get_client_square_config()
+    except SquareClientError as exc:
+        return jsonify({"status": "misconfigured", "error": str(exc)}), 503
+    
+    has_credentials = bool(config.access_token and config.location_ids)
+    
+    mirror = {"enabled": square_catalog_mirror.SQUARE_CATALOG_MIRROR_ENABLED}
+    if mirror["enabled"]:
+        try:
+            mirror["ready"] = square_catalog_mirror.is_ready()
+            mirror["last_synced_at"] = square_catalog_mirror.last_synced_at()
+        except Exception as exc:
+            mirror["error"] = str(exc)
     
     return jsonify({
         "status": "ok" if has_credentials else "misconfigured",
         "api_base": SQUARE_API_BASE,
         "credentials_configured": has_credentials,
-        "location_id_configured": bool(SQUARE_LOCATION_ID)
+        "location_id_configured": bool(config.location_ids),
+        "location_count": len(config.location_ids),
+        "shared_account": config.shared_account,
+        "catalog_mirror": mirror
     }), 200 if has_credentials else 503
@@ -40,6 +40,49 @@ JSON response (abridged):
 Arrays in ``daily`` share the same index ordering. The first element covers the
 earliest day returned (today when ``past_days`` is 0).
 
+POST /api/weather/daily/batch
+
+JSON body:
+```
+{
+    "locations": [{"lat": 41.24, "lon": -81.55}, ...],   # required, 1..50 entries
+    "days": 7,                                          # optional, as above
+    "past_days": 0                                      # optional, as above
+}
+```
+Returns ``{"results": [...], "source": "open-meteo"}`` where ``results[i]`` is
+the single-location response for ``locations[i]``. Locations are deduplicated
+by cache key and every cache miss is fetched in one multi-coordinate
+Open-Meteo request.
+
+GET /api/weather/agro
+
+Accepts the same ``lat``/``lon``/``days``/``past_days`` parameters as
+``/api/weather/daily`` plus:
+- ``base`` (optional): comma-separated GDD base temperatures in °C (default "10")
+- ``cap`` (optional, float): GDD upper temperature cap in °C (default 30)
+- ``frost_threshold`` (optional, float): frost-risk minimum temperature in °C (default 0)
+- ``window`` (optional, int): rolling mean window, clamped to 1–30 (default 7)
+
+Returns growing degree days, frost-risk day counts, cumulative precipitation
+and rolling means computed from the cached daily series (see
+services/agronomy.py).
+
+Settled past days are persisted by services/weather_store.py, so ``past_days``
+requests only fetch the days not stored yet plus the forecast tail upstream.
+
+Shaped responses are kept in a small in-process cache for
+``WEATHER_CACHE_TTL_SECONDS`` (default 900) so repeated lookups for the same
+farm don't go upstream.
+
+Upstream calls go through the "open_meteo" circuit breaker
+(services/circuit_breaker.py). While it is open, or when Open-Meteo fails,
+expired entries younger than ``WEATHER_STALE_TTL_SECONDS`` (default 21600) are
+served with ``"stale": true``; without one the endpoints return 503 at once.
+
+``OPEN_METEO_BASE_URL`` overrides the forecast endpoint (e.g. to point at the
+local stand-in in standin/).
+
 Registration example in app.py::
 
     from modules.weather import weather_bp
@@ -50,11 +93,18 @@ from __future__ import annotations
 
 import logging
 import math
-from typing import Any, Dict, Tuple
+import os
+import threading
+import time
+from typing import Any, Dict, List, Tuple
 
 from flask import Blueprint, request, jsonify
 import requests
 
+from services import weather_store
+from services.agronomy import compute_aggregates
+from services.circuit_breaker import get_breaker
+
 # Configure logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -63,7 +113,9 @@ logger.setLevel(logging.INFO)
 weather_bp = Blueprint("weather", __name__)
 
 # Open-Meteo API configuration
-OPEN_METEO_BASE_URL = "https://api.open-meteo.com/v1/forecast"
+OPEN_METEO_BASE_URL = os.getenv(
+    "OPEN_METEO_BASE_URL", "https://api.open-meteo.com/v1/forecast"
+)
 
 # Open-Meteo allows requesting multiple daily variables at once.
 # Keep them in a single list so the query string and the response shaping stay in sync.
@@ -81,6 +133,45 @@ DAILY_VARIABLES = [
     "uv_index_max",
 ]
 
+# Response cache configuration. Coordinates are rounded before keying so that
+# farms a few metres apart (well inside one Open-Meteo grid cell) share an entry.
+WEATHER_CACHE_TTL_SECONDS = int(os.getenv("WEATHER_CACHE_TTL_SECONDS", "900"))
+WEATHER_STALE_TTL_SECONDS = int(os.getenv("WEATHER_STALE_TTL_SECONDS", "21600"))
+WEATHER_CACHE_MAX_ENTRIES = 1024
+COORDINATE_KEY_PRECISION = 4
+
+# Open-Meteo usually answers well under a second; calls slower than this count
+# as failures towards tripping the breaker.
+open_meteo_breaker = get_breaker(
+    "open_meteo",
+    slow_call_seconds=float(os.getenv("WEATHER_SLOW_CALL_SECONDS", "3")),
+    open_seconds=float(os.getenv("WEATHER_BREAKER_OPEN_SECONDS", "30")),
+)
+
+# Upper bound on GDD base temperatures per agro request.
+MAX_GDD_BASES = 5
+
+# Upper bound on locations per batch request (keeps the upstream URL short).
+MAX_BATCH_LOCATIONS = 50
+
+CacheKey = Tuple[float, float, int, int]
+
+# Key: (lat, lon, days, past_days); Value: (expires_at, shaped response)
+_weather_cache: Dict[CacheKey, Tuple[float, Dict[str, Any]]] = {}
+_weather_cache_lock = threading.Lock()
+
+
+class WeatherUpstreamError(Exception):
+    """Raised when Open-Meteo fails or returns unusable data.
+
+    ``payload`` is the JSON error body returned to the client.
+    """
+
+    def __init__(self, payload: Dict[str, str], status_code: int = 502):
+        super().__init__(payload.get("message"))
+        self.payload = payload
+        self.status_code = status_code
+
 
 def _parse_float(name: str, raw: str | None, *, min_value: float, max_value: float) -> Tuple[Dict[str, Any] | None, float | None]:
     """Parse and validate a float query parameter with range enforcement.
@@ -145,108 +236,164 @@ def _parse_int(
     return None, value
 
 
-@weather_bp.route("/api/weather/daily", methods=["GET"])
-def get_daily_weather():
-    """
-    Query Open-Meteo for daily forecast data (optionally including recent past days).
+def _parse_range_params(source) -> Tuple[Dict[str, Any] | None, int | None, int | None]:
+    """Parse ``days`` and ``past_days`` from a mapping (query args or JSON body).
 
-    Error responses:
-        400: missing/invalid query parameters
-        502: upstream weather API failure
+    Returns (error_response, days, past_days).
     """
-    # Validate required parameters: lat and lon
-    lat_param = request.args.get("lat")
-    lon_param = request.args.get("lon")
-
-    lat_error, lat = _parse_float("lat", lat_param, min_value=-90, max_value=90)
-    if lat_error:
-        logger.warning("Invalid latitude: %s", lat_param)
-        return jsonify(lat_error[0]), lat_error[1]
 
-    lon_error, lon = _parse_float("lon", lon_param, min_value=-180, max_value=180)
-    if lon_error:
-        logger.warning("Invalid longitude: %s", lon_param)
-        return jsonify(lon_error[0]), lon_error[1]
-
-    # Validate optional parameters: days and past_days
+    raw_days = source.get("days")
     days_error, days = _parse_int(
         "days",
-        request.args.get("days"),
+        None if raw_days is None else str(raw_days),
         default=7,
         min_value=1,
         max_value=16,
     )
     if days_error:
-        logger.warning("Invalid days parameter: %s", request.args.get("days"))
-        return jsonify(days_error[0]), days_error[1]
+        logger.warning(f"Invalid days parameter: {raw_days}")
+        return days_error, None, None
 
+    raw_past_days = source.get("past_days")
     past_days_error, past_days = _parse_int(
         "past_days",
-        request.args.get("past_days"),
+        None if raw_past_days is None else str(raw_past_days),
         default=0,
         min_value=0,
         max_value=92,
     )
     if past_days_error:
-        logger.warning("Invalid past_days parameter: %s", request.args.get("past_days"))
-        return jsonify(past_days_error[0]), past_days_error[1]
+        logger.warning(f"Invalid past_days parameter: {raw_past_days}")
+        return past_days_error, None, None
 
-    logger.info(
-        "Weather request received",
-        extra={
-            "lat": lat,
-            "lon": lon,
-            "days": days,
-            "past_days": past_days,
-        },
+    return None, days, past_days
+
+
+def _cache_key(lat: float, lon: float, days: int, past_days: int) -> CacheKey:
+    return (
+        round(lat, COORDINATE_KEY_PRECISION),
+        round(lon, COORDINATE_KEY_PRECISION),
+        days,
+        past_days,
     )
-    
-    # Build request parameters for Open-Meteo API
+
+
+def _cache_get(key: CacheKey, allow_stale: bool = False) -> Dict[str, Any] | None:
+    with _weather_cache_lock:
+        entry = _weather_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        now = time.monotonic()
+        if now > expires_at + WEATHER_STALE_TTL_SECONDS:
+            del _weather_cache[key]
+            return None
+        if now > expires_at and not allow_stale:
+            return None
+        return value
+
+
+def _cache_put(key: CacheKey, value: Dict[str, Any]) -> None:
+    with _weather_cache_lock:
+        if len(_weather_cache) >= WEATHER_CACHE_MAX_ENTRIES and key not in _weather_cache:
+            # Entries are inserted in chronological order, so the first key is
+            # the oldest one.
+            _weather_cache.pop(next(iter(_weather_cache)))
+        _weather_cache[key] = (time.monotonic() + WEATHER_CACHE_TTL_SECONDS, value)
+
+
+def _fetch_open_meteo(lats: List[float], lons: List[float], days: int, past_days: int) -> List[Dict[str, Any]]:
+    """
+    Request daily data for one or more coordinates from Open-Meteo.
+
+    Multiple coordinates are sent as comma-separated ``latitude``/``longitude``
+    values, in which case Open-Meteo answers with a JSON list in the same order.
+
+    Returns:
+        list: One raw Open-Meteo location object per input coordinate
+
+    Raises:
+        WeatherUpstreamError: If the request fails or the payload is malformed
+    """
     params = {
-        "latitude": lat,
-        "longitude": lon,
+        "latitude": ",".join(str(lat) for lat in lats),
+        "longitude": ",".join(str(lon) for lon in lons),
         "daily": ",".join(DAILY_VARIABLES),
         "timezone": "auto",
         "forecast_days": days,
         "past_days": past_days,
     }
-    
+    where = f"lat={params['latitude']}, lon={params['longitude']}"
+
+    if not open_meteo_breaker.allow():
+        logger.warning(f"Open-Meteo circuit open, failing fast for {where}")
+        raise WeatherUpstreamError({
+            "error": "Weather service unavailable",
+            "message": "The weather service is failing; try again shortly",
+            "retry_after": open_meteo_breaker.retry_after(),
+        }, status_code=503)
+
+    started = time.monotonic()
+    try:
+        locations = _request_open_meteo(params, where, len(lats))
+    except WeatherUpstreamError:
+        open_meteo_breaker.record(False, time.monotonic() - started)
+        raise
+    open_meteo_breaker.record(True, time.monotonic() - started)
+    return locations
+
+
+def _request_open_meteo(params: Dict[str, Any], where: str, expected: int) -> List[Dict[str, Any]]:
+    """Perform the Open-Meteo request itself; see ``_fetch_open_meteo``."""
     try:
         resp = requests.get(OPEN_METEO_BASE_URL, params=params, timeout=10)
         resp.raise_for_status()
     except requests.Timeout:
-        logger.error(f"Weather API request timed out for lat={lat}, lon={lon}")
-        return jsonify({
+        logger.error(f"Weather API request timed out for {where}")
+        raise WeatherUpstreamError({
             "error": "Weather API request timed out",
             "message": "The weather service did not respond in time"
-        }), 502
+        })
     except requests.HTTPError as exc:
-        logger.error(f"Weather API HTTP error: {exc.response.status_code} for lat={lat}, lon={lon}")
-        return jsonify({
+        logger.error(f"Weather API HTTP error: {exc.response.status_code} for {where}")
+        raise WeatherUpstreamError({
             "error": "Weather API request failed",
             "message": f"Upstream service returned status {exc.response.status_code}"
-        }), 502
+        })
     except requests.RequestException as exc:
-        logger.error(f"Weather API request exception: {exc} for lat={lat}, lon={lon}")
-        return jsonify({
+        logger.error(f"Weather API request exception: {exc} for {where}")
+        raise WeatherUpstreamError({
             "error": "Weather API request failed",
             "message": "Unable to connect to weather service"
-        }), 502
-    
+        })
+
     try:
         data = resp.json()
     except ValueError:
-        logger.error(
-            "Weather API returned invalid JSON for lat=%s, lon=%s", lat, lon
-        )
-        return (
-            jsonify({
-                "error": "Weather API returned invalid response",
-                "message": "The weather service returned malformed data",
-            }),
-            502,
-        )
+        logger.error(f"Weather API returned invalid JSON for {where}")
+        raise WeatherUpstreamError({
+            "error": "Weather API returned invalid response",
+            "message": "The weather service returned malformed data",
+        })
+
+    locations = data if isinstance(data, list) else [data]
+    if len(locations) != expected or not all(isinstance(loc, dict) for loc in locations):
+        logger.error(f"Weather API returned {len(locations)} locations for {expected} requested ({where})")
+        raise WeatherUpstreamError({
+            "error": "Weather API returned invalid response",
+            "message": "The weather service returned malformed data",
+        })
+
+    return locations
+
+
+def _shape_daily(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert one raw Open-Meteo location object into the public response shape.
 
+    Raises:
+        WeatherUpstreamError: If the payload cannot be shaped or lacks daily data
+    """
     try:
         daily = data.get("daily") or {}
         out = {
@@ -271,28 +418,148 @@ def get_daily_weather():
             "source": "open-meteo",
         }
     except Exception as exc:  # Broad catch to avoid leaking 500s to clients
-        logger.exception(
-            "Failed to shape weather response for lat=%s, lon=%s", lat, lon
-        )
-        return (
-            jsonify({
-                "error": "Failed to process weather data",
-                "message": str(exc),
-            }),
-            502,
-        )
+        logger.exception("Failed to shape weather response")
+        raise WeatherUpstreamError({
+            "error": "Failed to process weather data",
+            "message": str(exc),
+        })
 
     if not out["daily"].get("time"):
         logger.error(
-            "Weather API response missing daily data for lat=%s, lon=%s", lat, lon
-        )
-        return (
-            jsonify({
-                "error": "Weather API returned incomplete data",
-                "message": "Daily forecast data unavailable for the given coordinates",
-            }),
-            502,
+            f"Weather API response missing daily data for lat={out['latitude']}, lon={out['longitude']}"
         )
+        raise WeatherUpstreamError({
+            "error": "Weather API returned incomplete data",
+            "message": "Daily forecast data unavailable for the given coordinates",
+        })
+
+    return out
+
+
+def get_daily_forecasts(
+    coordinates: List[Tuple[float, float]], days: int, past_days: int
+) -> List[Dict[str, Any]]:
+    """
+    Return shaped daily weather for each (lat, lon), aligned to input order.
+
+    Coordinates are deduplicated by cache key; all misses are fetched with a
+    single multi-coordinate upstream request.
+
+    Raises:
+        WeatherUpstreamError: If the upstream request for the misses fails (or
+            the breaker is open) and no stale copy is cached for every miss
+    """
+    keys = [_cache_key(lat, lon, days, past_days) for lat, lon in coordinates]
+
+    resolved: Dict[CacheKey, Dict[str, Any]] = {}
+    misses: List[CacheKey] = []
+    for key in keys:
+        if key in resolved or key in misses:
+            continue
+        cached = _cache_get(key)
+        if cached is not None:
+            resolved[key] = cached
+        else:
+            misses.append(key)
+
+    if misses:
+        # History already in the observation store is served locally; one
+        # upstream call covers the largest remaining gap plus the forecast.
+        plans = {
+            key: weather_store.plan(weather_store.location_key(key[0], key[1]), past_days)
+            for key in misses
+        }
+        upstream_past_days = max(plans[key].upstream_past_days for key in misses)
+
+        try:
+            locations = _fetch_open_meteo(
+                [key[0] for key in misses], [key[1] for key in misses], days, upstream_past_days
+            )
+        except WeatherUpstreamError:
+            stale = {key: _cache_get(key, allow_stale=True) for key in misses}
+            if any(value is None for value in stale.values()):
+                raise
+            logger.warning(f"Serving stale weather for {len(misses)} locations")
+            for key, value in stale.items():
+                resolved[key] = dict(value, stale=True)
+            return [resolved[key] for key in keys]
+
+        for key, location in zip(misses, locations):
+            shaped = _shape_daily(location)
+            weather_store.record(
+                weather_store.location_key(key[0], key[1]),
+                shaped,
+                location.get("utc_offset_seconds"),
+            )
+            history = plans[key]
+            history.upstream_past_days = upstream_past_days
+            shaped = weather_store.merge(shaped, history, past_days)
+            _cache_put(key, shaped)
+            resolved[key] = shaped
+
+    logger.info(
+        "Weather lookup served",
+        extra={"locations": len(coordinates), "unique": len(resolved), "fetched": len(misses)},
+    )
+    return [resolved[key] for key in keys]
+
+
+def _upstream_error_response(exc: WeatherUpstreamError):
+    """Render a WeatherUpstreamError, adding Retry-After while the breaker is open."""
+    headers = {}
+    if exc.payload.get("retry_after"):
+        headers["Retry-After"] = str(exc.payload["retry_after"])
+    return jsonify(exc.payload), exc.status_code, headers
+
+
+def get_daily_forecast(lat: float, lon: float, days: int, past_days: int) -> Dict[str, Any]:
+    """Return shaped daily weather for a single coordinate (cached)."""
+    return get_daily_forecasts([(lat, lon)], days, past_days)[0]
+
+
+@weather_bp.route("/api/weather/daily", methods=["GET"])
+def get_daily_weather():
+    """
+    Query Open-Meteo for daily forecast data (optionally including recent past days).
+
+    Error responses:
+        400: missing/invalid query parameters
+        502: upstream weather API failure
+        503: weather circuit open and nothing cached to serve
+    """
+    # Validate required parameters: lat and lon
+    lat_param = request.args.get("lat")
+    lon_param = request.args.get("lon")
+
+    lat_error, lat = _parse_float("lat", lat_param, min_value=-90, max_value=90)
+    if lat_error:
+        logger.warning(f"Invalid latitude: {lat_param}")
+        return jsonify(lat_error[0]), lat_error[1]
+
+    lon_error, lon = _parse_float("lon", lon_param, min_value=-180, max_value=180)
+    if lon_error:
+        logger.warning(f"Invalid longitude: {lon_param}")
+        return jsonify(lon_error[0]), lon_error[1]
+
+    # Validate optional parameters: days and past_days
+    range_error, days, past_days = _parse_range_params(request.args)
+    if range_error:
+        return jsonify(range_error[0]), range_error[1]
+
+    logger.info(
+        "Weather request received",
+        extra={
+            "lat": lat,
+            "lon": lon,
+            "days": days,
+            "past_days": past_days,
+        },
+    )
+
+    try:
+        out = get_daily_forecast(lat, lon, days, past_days)
+    except WeatherUpstreamError as exc:
+        return _upstream_error_response(exc)
 
     logger.info(
         "Weather data retrieved successfully",
@@ -305,3 +572,137 @@ def get_daily_weather():
     )
 
     return jsonify(out)
+
+
+@weather_bp.route("/api/weather/daily/batch", methods=["POST"])
+def get_daily_weather_batch():
+    """
+    Fetch daily weather for many locations in one round trip.
+
+    Error responses:
+        400: invalid body, location list or parameters
+        502: upstream weather API failure
+        503: weather circuit open and nothing cached to serve
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+
+    locations = payload.get("locations")
+    if not isinstance(locations, list) or not locations:
+        return jsonify({"error": "locations must be a non-empty array", "parameter": "locations"}), 400
+    if len(locations) > MAX_BATCH_LOCATIONS:
+        return jsonify({
+            "error": f"locations cannot contain more than {MAX_BATCH_LOCATIONS} entries",
+            "parameter": "locations",
+        }), 400
+
+    coordinates: List[Tuple[float, float]] = []
+    for index, location in enumerate(locations):
+        if not isinstance(location, dict):
+            return jsonify({
+                "error": "each location must be an object with lat and lon",
+                "parameter": f"locations[{index}]",
+            }), 400
+
+        for name, limit in (("lat", 90), ("lon", 180)):
+            raw = location.get(name)
+            error, _ = _parse_float(
+                name,
+                None if raw is None or isinstance(raw, bool) else str(raw),
+                min_value=-limit,
+                max_value=limit,
+            )
+            if error:
+                body = dict(error[0], parameter=f"locations[{index}].{name}")
+                return jsonify(body), error[1]
+
+        coordinates.append((float(location["lat"]), float(location["lon"])))
+
+    range_error, days, past_days = _parse_range_params(payload)
+    if range_error:
+        return jsonify(range_error[0]), range_error[1]
+
+    try:
+        results = get_daily_forecasts(coordinates, days, past_days)
+    except WeatherUpstreamError as exc:
+        return _upstream_error_response(exc)
+
+    return jsonify({"results": results, "source": "open-meteo"})
+
+
+@weather_bp.route("/api/weather/agro", methods=["GET"])
+def get_agro_weather():
+    """
+    Return agronomic aggregates (GDD, frost risk, precipitation, rolling means)
+    derived from the cached daily weather series.
+
+    Error responses:
+        400: missing/invalid query parameters
+        502: upstream weather API failure
+        503: weather circuit open and nothing cached to serve
+    """
+    lat_error, lat = _parse_float("lat", request.args.get("lat"), min_value=-90, max_value=90)
+    if lat_error:
+        return jsonify(lat_error[0]), lat_error[1]
+
+    lon_error, lon = _parse_float("lon", request.args.get("lon"), min_value=-180, max_value=180)
+    if lon_error:
+        return jsonify(lon_error[0]), lon_error[1]
+
+    range_error, days, past_days = _parse_range_params(request.args)
+    if range_error:
+        return jsonify(range_error[0]), range_error[1]
+
+    bases = []
+    for raw_base in request.args.get("base", "10").split(","):
+        base_error, base = _parse_float("base", raw_base.strip(), min_value=-50, max_value=50)
+        if base_error:
+            return jsonify(base_error[0]), base_error[1]
+        if base not in bases:
+            bases.append(base)
+    if len(bases) > MAX_GDD_BASES:
+        return jsonify({
+            "error": f"base cannot list more than {MAX_GDD_BASES} temperatures",
+            "parameter": "base",
+        }), 400
+
+    cap_error, cap = _parse_float("cap", request.args.get("cap", "30"), min_value=-50, max_value=60)
+    if cap_error:
+        return jsonify(cap_error[0]), cap_error[1]
+
+    frost_error, frost_threshold = _parse_float(
+        "frost_threshold", request.args.get("frost_threshold", "0"), min_value=-50, max_value=50
+    )
+    if frost_error:
+        return jsonify(frost_error[0]), frost_error[1]
+
+    window_error, window = _parse_int(
+        "window", request.args.get("window"), default=7, min_value=1, max_value=30
+    )
+    if window_error:
+        return jsonify(window_error[0]), window_error[1]
+
+    try:
+        weather = get_daily_forecast(lat, lon, days, past_days)
+    except WeatherUpstreamError as exc:
+        return _upstream_error_response(exc)
+
+    time_axis = weather["daily"]["time"]
+    aggregates = compute_aggregates(
+        weather["daily"],
+        bases=bases,
+        cap=cap,
+        frost_threshold=frost_threshold,
+        window=window,
+    )
+    aggregates["frost"]["dates"] = [time_axis[i] for i in aggregates["frost"].pop("indexes")]
+
+    return jsonify({
+        "latitude": weather["latitude"],
+        "longitude": weather["longitude"],
+        "timezone": weather["timezone"],
+        "time": time_axis,
+        **aggregates,
+        "source": "open-meteo",
+    })
@@ -0,0 +1,3 @@
+# /srv/webapps/platform/services/__init__.py
+
+# This file just makes 'services' a package.
@@ -0,0 +1,201 @@
+# /srv/webapps/platform/services/agronomy.py
+
+"""
+Agronomic aggregates over the shaped ``daily`` arrays from modules/weather.py.
+
+Computed metrics:
+- growing degree days (GDD) per base temperature, using the capped average
+  method: ``max(0, (min(tmax, cap) + max(tmin, base)) / 2 - base)``
+- frost-risk day count (``temperature_min <= frost_threshold``)
+- cumulative precipitation
+- trailing rolling means of mean temperature and precipitation
+
+NumPy is used when it is installed; otherwise an equivalent pure-Python path
+runs. Missing values (``null`` in the Open-Meteo arrays) contribute nothing to
+sums and are skipped in means. Units follow the weather response (°C, mm).
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised on hosts without numpy
+    np = None
+
+ENGINE = "numpy" if np is not None else "python"
+
+
+def _format_base(base: float) -> str:
+    """Render a base temperature as a stable JSON key (10.0 -> "10")."""
+    return f"{base:g}"
+
+
+def _to_json(values) -> List[Optional[float]]:
+    """Convert floats (NaN for missing) into a JSON-safe list."""
+    return [None if value is None or math.isnan(value) else round(value, 3) for value in values]
+
+
+def _aggregate_numpy(
+    daily: Dict[str, Sequence[Any]],
+    bases: Sequence[float],
+    cap: float,
+    frost_threshold: float,
+    window: int,
+) -> Dict[str, Any]:
+    tmax = np.array(daily.get("temperature_max", []), dtype=float)
+    tmin = np.array(daily.get("temperature_min", []), dtype=float)
+    tmean = np.array(daily.get("temperature_mean", []), dtype=float)
+    precip = np.array(daily.get("precipitation_sum", []), dtype=float)
+
+    gdd = {}
+    capped_max = np.minimum(tmax, cap)
+    for base in bases:
+        day_values = (capped_max + np.maximum(tmin, base)) / 2.0 - base
+        day_values = np.nan_to_num(np.maximum(day_values, 0.0), nan=0.0)
+        cumulative = np.cumsum(day_values)
+        gdd[_format_base(base)] = {
+            "daily": _to_json(day_values.tolist()),
+            "cumulative": _to_json(cumulative.tolist()),
+            "total": round(float(cumulative[-1]), 3) if cumulative.size else 0.0,
+        }
+
+    with np.errstate(invalid="ignore"):
+        frost_mask = tmin <= frost_threshold
+
+    precip_cumulative = np.nancumsum(precip)
+
+    def rolling_mean(values):
+        if values.size < window:
+            return [None] * values.size
+        present = ~np.isnan(values)
+        kernel = np.ones(window)
+        sums = np.convolve(np.where(present, values, 0.0), kernel, mode="valid")
+        counts = np.convolve(present.astype(float), kernel, mode="valid")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        return [None] * (window - 1) + _to_json(means.tolist())
+
+    return {
+        "gdd": gdd,
+        "frost": {
+            "threshold": frost_threshold,
+            "days": int(frost_mask.sum()),
+            "indexes": np.flatnonzero(frost_mask).tolist(),
+        },
+        "precipitation": {
+            "cumulative": _to_json(precip_cumulative.tolist()),
+            "total": round(float(precip_cumulative[-1]), 3) if precip_cumulative.size else 0.0,
+        },
+        "rolling_mean": {
+            "window": window,
+            "temperature_mean": rolling_mean(tmean),
+            "precipitation_sum": rolling_mean(precip),
+        },
+    }
+
+
+def _aggregate_python(
+    daily: Dict[str, Sequence[Any]],
+    bases: Sequence[float],
+    cap: float,
+    frost_threshold: float,
+    window: int,
+) -> Dict[str, Any]:
+    tmax = list(daily.get("temperature_max", []))
+    tmin = list(daily.get("temperature_min", []))
+    tmean = list(daily.get("temperature_mean", []))
+    precip = list(daily.get("precipitation_sum", []))
+
+    gdd = {}
+    for base in bases:
+        day_values = []
+        cumulative = []
+        running = 0.0
+        for high, low in zip(tmax, tmin):
+            if high is None or low is None:
+                value = 0.0
+            else:
+                value = max((min(high, cap) + max(low, base)) / 2.0 - base, 0.0)
+            running += value
+            day_values.append(value)
+            cumulative.append(running)
+        gdd[_format_base(base)] = {
+            "daily": _to_json(day_values),
+            "cumulative": _to_json(cumulative),
+            "total": round(running, 3),
+        }
+
+    frost_indexes = [
+        index for index, low in enumerate(tmin) if low is not None and low <= frost_threshold
+    ]
+
+    precip_cumulative = []
+    running = 0.0
+    for value in precip:
+        if value is not None:
+            running += value
+        precip_cumulative.append(running)
+
+    def rolling_mean(values):
+        out: List[Optional[float]] = []
+        for index in range(len(values)):
+            if index < window - 1:
+                out.append(None)
+                continue
+            present = [v for v in values[index - window + 1:index + 1] if v is not None]
+            out.append(sum(present) / len(present) if present else None)
+        return _to_json(out)
+
+    return {
+        "gdd": gdd,
+        "frost": {
+            "threshold": frost_threshold,
+            "days": len(frost_indexes),
+            "indexes": frost_indexes,
+        },
+        "precipitation": {
+            "cumulative": _to_json(precip_cumulative),
+            "total": round(running, 3),
+        },
+        "rolling_mean": {
+            "window": window,
+            "temperature_mean": rolling_mean(tmean),
+            "precipitation_sum": rolling_mean(precip),
+        },
+    }
+
+
+def compute_aggregates(
+    daily: Dict[str, Sequence[Any]],
+    bases: Sequence[float] = (10.0,),
+    cap: float = 30.0,
+    frost_threshold: float = 0.0,
+    window: int = 7,
+    engine: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Compute agronomic aggregates from a shaped weather ``daily`` mapping.
+
+    Args:
+        daily: The ``daily`` object from the weather response
+        bases: Base temperatures (°C) to compute GDD for
+        cap: Upper temperature cap (°C) for GDD
+        frost_threshold: Minimum temperature (°C) at or below which a day counts as frost risk
+        window: Rolling mean window in days
+        engine: Force "numpy" or "python" (defaults to numpy when available)
+
+    Returns:
+        dict: Aggregates keyed by metric, plus the ``engine`` that computed them
+    """
+    engine = engine or ENGINE
+    if engine == "numpy" and np is not None:
+        result = _aggregate_numpy(daily, bases, cap, frost_threshold, window)
+    else:
+        engine = "python"
+        result = _aggregate_python(daily, bases, cap, frost_threshold, window)
+
+    result["engine"] = engine
+    return result
@@ -0,0 +1,158 @@
+# /srv/webapps/platform/services/circuit_breaker.py
+
+"""
+Circuit breaker for outbound calls to slow or failing upstream services.
+
+A breaker watches the outcome of the last ``window`` calls. Calls that raise,
+or that take longer than ``slow_call_seconds``, count as failures. Once at
+least ``min_calls`` have been seen and the failure rate reaches
+``failure_rate_threshold`` the breaker opens: callers fail fast instead of
+holding a worker for the full upstream timeout. After ``open_seconds`` one
+half-open probe is let through; its outcome closes or re-opens the breaker.
+
+State is per process (each gunicorn worker trips independently).
+
+Usage::
+
+    breaker = get_breaker("open_meteo", slow_call_seconds=3)
+    if not breaker.allow():
+        ...  # fail fast / serve stale
+    started = time.monotonic()
+    try:
+        result = call_upstream()
+    except Exception:
+        breaker.record(False, time.monotonic() - started)
+        raise
+    breaker.record(True, time.monotonic() - started)
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Failure-rate and latency based breaker with a single half-open probe."""
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 5.0,
+        open_seconds: float = 30.0,
+    ):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+
+        self._lock = threading.Lock()
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._last_failure_at: float | None = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+
+    def retry_after(self) -> int:
+        """Seconds until the next half-open probe is allowed (0 when not open)."""
+        with self._lock:
+            if self._state != OPEN:
+                return 0
+            remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+            return max(0, int(remaining + 0.999))
+
+    def allow(self) -> bool:
+        """Return True if a call may proceed now."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, success: bool, duration: float) -> None:
+        """Record the outcome of a call that ``allow()`` let through."""
+        failed = not success or duration > self.slow_call_seconds
+        with self._lock:
+            if failed:
+                self._last_failure_at = time.time()
+
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+                if failed:
+                    self._trip()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                return
+
+            self._outcomes.append(not failed)
+            if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_rate_threshold:
+                    self._trip()
+
+    def _trip(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-friendly view of the breaker for health endpoints."""
+        with self._lock:
+            self._maybe_half_open()
+            recent = len(self._outcomes)
+            return {
+                "state": self._state,
+                "recent_calls": recent,
+                "recent_failures": self._outcomes.count(False),
+                "last_failure_at": self._last_failure_at,
+                "failure_rate_threshold": self.failure_rate_threshold,
+                "slow_call_seconds": self.slow_call_seconds,
+                "open_seconds": self.open_seconds,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str, **options: Any) -> CircuitBreaker:
+    """Return the process-wide breaker for ``name``, creating it on first use."""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **options)
+            _breakers[name] = breaker
+        return breaker
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every registered breaker, keyed by name."""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,224 @@
+# /srv/webapps/platform/services/donation_outbox.py
+
+"""
+Dispatcher for the donation outbox.
+
+services/donation_store.py writes an ``outbox`` entry in the same transaction
+as the donation change that calls for it (a ``donation.receipt`` entry when a
+donation becomes completed, a ``donation.receipt.void`` entry when it becomes
+refunded or reversed), so ``/api/donations/confirm`` only pays for one extra
+insert. This module delivers the entries afterwards, in batches, to the
+handler registered for their topic; modules/donation_box.py registers the
+ones that append and void receipts in the client's receipt file.
+
+Delivery is at least once: entries a handler reports as failed (or all of
+them, if it raises) are retried with backoff and parked as ``failed`` after
+``MAX_ATTEMPTS``, and a crash between a handler finishing and the entries
+being marked done replays them.
+Handlers must therefore skip work already done for an entry's key (the
+receipt handler skips donations whose receipt is already in the file), which
+makes the end result exactly once. Entries whose topic has no handler in this
+process are left for a process that has one.
+
+One worker at a time holds the dispatcher lease (see
+services/leased_worker.py). Set
+``DONATION_OUTBOX_DISPATCHER=off`` to keep the dispatcher out of the web
+workers and run it as its own process instead::
+
+    python -m services.donation_outbox dispatch
+    python -m services.donation_outbox drain   # once, e.g. from cron
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from services import donation_store
+from services.leased_worker import LeasedWorker, prune_handled, status_counts
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+DONATION_OUTBOX_DISPATCHER = os.getenv("DONATION_OUTBOX_DISPATCHER", "thread")
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 8
+
+# Idle dispatchers look for entries written by other workers this often.
+POLL_SECONDS = 5
+
+# A dispatcher lease older than this belongs to a worker that died.
+DISPATCHER_LEASE_SECONDS = 60
+
+# Dispatched entries are kept this long for auditing.
+RETENTION_DAYS = 30
+
+# topic -> handler(payloads) -> {entry key: error} for the entries that
+# failed; see register_handler
+Handler = Callable[[List[Dict[str, Any]]], Optional[Dict[str, str]]]
+HANDLERS: Dict[str, Handler] = {}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dispatcher_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+
+
+def _state_connection() -> sqlite3.Connection:
+    return get_connection("donation_outbox", schema=_SCHEMA)
+
+
+def register_handler(topic: str, handler: Handler) -> None:
+    """
+    Deliver ``topic`` entries to ``handler``.
+
+    The handler gets the payloads of up to ``BATCH_SIZE`` entries at once and
+    must tolerate seeing an entry again after a failure. It returns the
+    entries that failed as ``{key: error}`` (the key being the donation ID
+    for donation topics) so only those are retried; the rest are done.
+    """
+    HANDLERS[topic] = handler
+
+
+def dispatch_batch(limit: int = BATCH_SIZE, renew: Optional[Callable[[], bool]] = None) -> int:
+    """
+    Deliver up to ``limit`` due entries. Returns the number handled.
+
+    ``renew`` is called before each topic's handler; once it returns False
+    the remaining entries are left pending for the worker that now holds the
+    lease.
+    """
+    if not HANDLERS:
+        return 0
+    conn = donation_store.connection()
+    topics = sorted(HANDLERS)
+    rows = conn.execute(
+        f"SELECT seq, topic, key, payload, attempts FROM outbox "
+        f"WHERE status = 'pending' AND available_at <= ? AND topic IN ({', '.join('?' * len(topics))}) "
+        "ORDER BY seq LIMIT ?",
+        (time.time(), *topics, limit),
+    ).fetchall()
+
+    by_topic: Dict[str, List[sqlite3.Row]] = {}
+    for row in rows:
+        by_topic.setdefault(row["topic"], []).append(row)
+
+    results = []
+    for topic, entries in by_topic.items():
+        if renew is not None and not renew():
+            break
+        try:
+            errors = HANDLERS[topic]([json.loads(row["payload"]) for row in entries]) or {}
+        except Exception as exc:
+            logger.warning(f"Donation outbox {topic} batch of {len(entries)} failed: {exc}")
+            errors = {row["key"]: str(exc) for row in entries}
+        for row in entries:
+            attempts = row["attempts"] + 1
+            error = errors.get(row["key"])
+            if error is None:
+                results.append((row["seq"], "done", None, attempts))
+            else:
+                results.append((row["seq"], "failed" if attempts >= MAX_ATTEMPTS else "pending", error, attempts))
+
+    now = time.time()
+    with transaction(conn):
+        conn.executemany(
+            "UPDATE outbox SET status = ?, error = ?, attempts = ?, dispatched_at = ?, available_at = ? WHERE seq = ?",
+            [
+                (
+                    status,
+                    error,
+                    attempts,
+                    now if status == "done" else None,
+                    now + min(3600, 2 ** attempts) if status == "pending" else now,
+                    seq,
+                )
+                for seq, status, error, attempts in results
+            ],
+        )
+    return len(results)
+
+
+def _batch(renew: Callable[[], bool]) -> int:
+    return dispatch_batch(renew=renew)
+
+
+def drain(owner: Optional[str] = None, max_batches: Optional[int] = None) -> Optional[int]:
+    """
+    Deliver due entries batch by batch until none are left.
+
+    Returns:
+        int: Entries handled, or None if another dispatcher holds the lease
+    """
+    return _worker.drain(_batch, owner, max_batches)
+
+
+def prune() -> int:
+    """Delete dispatched entries older than RETENTION_DAYS."""
+    return prune_handled(donation_store.connection(), "outbox", "dispatched_at", RETENTION_DAYS)
+
+
+def stats() -> Dict[str, Any]:
+    """Outbox depth by status."""
+    return status_counts(donation_store.connection(), "outbox", "created_at")
+
+
+_worker = LeasedWorker(
+    "donation-outbox-dispatcher",
+    _state_connection,
+    "dispatcher_state",
+    lease_seconds=DISPATCHER_LEASE_SECONDS,
+    batch_size=BATCH_SIZE,
+    poll_seconds=POLL_SECONDS,
+    prune=prune,
+)
+
+
+def wake() -> None:
+    """Have this worker's dispatcher look for new entries now rather than at the next poll."""
+    _worker.wake()
+
+
+def start_dispatcher() -> bool:
+    """
+    Start this worker's dispatcher thread unless disabled or already running.
+
+    Returns True if a dispatcher was started by this call.
+    """
+    if DONATION_OUTBOX_DISPATCHER != "thread":
+        return False
+    return _worker.start(_batch)
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Donation outbox dispatcher")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("drain", help="deliver all due entries once")
+    sub.add_parser("dispatch", help="deliver entries as they are written")
+    sub.add_parser("stats", help="show outbox depth")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # The handlers are registered by the blueprint; only the CLI reaches into it
+    import modules.donation_box  # noqa: F401
+
+    if args.command == "drain":
+        print(json.dumps({"handled": drain()}))
+    elif args.command == "stats":
+        print(json.dumps(stats()))
+    else:
+        _worker.run_forever(_batch, f"cli-{os.getpid()}", threading.Event())
+
+
+if __name__ == "__main__":
+    main()
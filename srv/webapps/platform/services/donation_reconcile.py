@@ -0,0 +1,307 @@
+# /srv/webapps/platform/services/donation_reconcile.py
+
+"""
+Reconciliation of donations stuck in ``pending``.
+
+A donation is only captured when the browser calls ``/api/donations/confirm``.
+If the donor approves the payment and closes the tab, nothing ever captures
+it; if they abandon checkout, it stays pending forever. This job finds pending
+donations older than ``DONATION_RECONCILE_MIN_AGE_MINUTES`` and asks PayPal
+what became of each order:
+
+- ``APPROVED``: captured now (same ``PayPal-Request-Id`` as ``/confirm``, so a
+  donor confirming at the same moment can't cause a double capture);
+- ``COMPLETED``: already captured elsewhere, recorded as completed;
+- ``VOIDED`` or unknown to PayPal: expired;
+- ``CREATED`` / ``PAYER_ACTION_REQUIRED``: expired once older than
+  ``DONATION_EXPIRE_HOURS``, otherwise left for the next run.
+
+Lookups and captures run on a bounded thread pool (the shared PayPal rate
+limiter still applies, see PAYPAL_RATE_LIMIT_PER_SECOND); each page's results
+are written in one transaction, and only donations still pending are changed.
+
+Run it once (cron) or in a loop::
+
+    python -m services.donation_reconcile run
+    python -m services.donation_reconcile schedule
+
+Web workers also run it every ``DONATION_RECONCILE_SECONDS`` (0 disables);
+one worker at a time holds the job lease (services/leased_worker.py) and
+renews it before every page. Functions take the caller's PayPal request
+function (``modules.paypal_gateway._make_paypal_request``) so this module
+does not import the blueprint.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from services import donation_store
+from services.leased_worker import Lease, RenewFn
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+DONATION_RECONCILE_MIN_AGE_MINUTES = int(os.getenv("DONATION_RECONCILE_MIN_AGE_MINUTES", "15"))
+DONATION_EXPIRE_HOURS = int(os.getenv("DONATION_EXPIRE_HOURS", "24"))
+DONATION_RECONCILE_CONCURRENCY = int(os.getenv("DONATION_RECONCILE_CONCURRENCY", "8"))
+DONATION_RECONCILE_SECONDS = int(os.getenv("DONATION_RECONCILE_SECONDS", "300"))
+
+PAGE_SIZE = 200
+
+# A job lease older than this belongs to a worker that died mid-run. It is
+# renewed before every page, so it only has to outlast one page of lookups.
+JOB_LEASE_SECONDS = 600
+
+RequestFn = Callable[..., Dict[str, Any]]
+
+# (donation_id, fields to set) for one reconciled donation; None leaves it pending
+Outcome = Optional[Tuple[str, Dict[str, Any]]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("donation_reconcile", schema=_SCHEMA)
+
+
+def capture_request_id(donation_id: str) -> str:
+    """PayPal-Request-Id for capturing a donation's order (shared with /confirm)."""
+    return f"capture-{donation_id}"
+
+
+def capture_outcome(capture_response: Dict[str, Any]) -> Dict[str, Any]:
+    """Donation fields for a PayPal capture (or completed order) response."""
+    transaction_id = None
+    purchase_units = capture_response.get("purchase_units") or []
+    if purchase_units:
+        captures = (purchase_units[0].get("payments") or {}).get("captures") or []
+        if captures:
+            transaction_id = captures[0].get("id")
+    return {
+        "status": "completed" if capture_response.get("status") == "COMPLETED" else "failed",
+        "transaction_id": transaction_id,
+        "confirmed_at": datetime.utcnow().isoformat(),
+        "provider_data": capture_response,
+    }
+
+
+def _reconcile_one(donation: Dict[str, Any], request_fn: RequestFn, expire_before: str) -> Outcome:
+    donation_id = donation["donation_id"]
+    order_id = donation.get("provider_order_id")
+    expired = {"status": "expired", "confirmed_at": datetime.utcnow().isoformat()}
+    if not order_id:
+        return (donation_id, expired) if donation["created_at"] < expire_before else None
+
+    try:
+        order = request_fn("GET", f"/v2/checkout/orders/{order_id}")
+    except Exception as exc:
+        if getattr(exc, "status_code", None) == 404:
+            return donation_id, expired
+        logger.warning(f"Reconcile: lookup of {donation_id} (order {order_id}) failed: {exc}")
+        return None
+
+    status = order.get("status")
+    if status == "COMPLETED":
+        return donation_id, capture_outcome(order)
+    if status == "APPROVED":
+        try:
+            capture = request_fn(
+                "POST",
+                f"/v2/checkout/orders/{order_id}/capture",
+                data={},
+                headers={"PayPal-Request-Id": capture_request_id(donation_id)},
+            )
+        except Exception as exc:
+            logger.warning(f"Reconcile: capture of {donation_id} (order {order_id}) failed: {exc}")
+            return None
+        return donation_id, capture_outcome(capture)
+    if status == "VOIDED" or donation["created_at"] < expire_before:
+        return donation_id, expired
+    return None
+
+
+def reconcile(
+    request_fn: RequestFn,
+    min_age_minutes: int = DONATION_RECONCILE_MIN_AGE_MINUTES,
+    expire_hours: int = DONATION_EXPIRE_HOURS,
+    concurrency: int = DONATION_RECONCILE_CONCURRENCY,
+    limit: Optional[int] = None,
+    renew: Optional[RenewFn] = None,
+) -> Dict[str, int]:
+    """
+    Settle pending donations older than ``min_age_minutes``.
+
+    Args:
+        renew: Renews the caller's job lease; called before every page, and
+            the run stops once it returns False (another worker took over)
+
+    Returns:
+        dict: Counts of donations examined and of each resulting status
+    """
+    now = datetime.utcnow()
+    created_before = (now - timedelta(minutes=min_age_minutes)).isoformat()
+    expire_before = (now - timedelta(hours=expire_hours)).isoformat()
+
+    counts: Dict[str, int] = {"examined": 0, "completed": 0, "failed": 0, "expired": 0, "unchanged": 0}
+    after = None
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="donation-reconcile") as pool:
+        while limit is None or counts["examined"] < limit:
+            if renew is not None and not renew():
+                logger.warning(f"Donation reconciliation stopped: another worker took the job lease ({counts})")
+                break
+            page_size = PAGE_SIZE if limit is None else min(PAGE_SIZE, limit - counts["examined"])
+            page = donation_store.list_by_status("pending", created_before=created_before, limit=page_size, after=after)
+            if not page:
+                break
+            after = (page[-1]["created_at"], page[-1]["donation_id"])
+            counts["examined"] += len(page)
+
+            outcomes = [o for o in pool.map(lambda d: _reconcile_one(d, request_fn, expire_before), page) if o]
+            counts["unchanged"] += len(page) - len(outcomes)
+            records = donation_store.transition_many(
+                [(donation_id, ["pending"], fields) for donation_id, fields in outcomes]
+            )
+            for record in records:
+                if record is None:
+                    # Settled by /confirm or a webhook while we looked it up
+                    counts["unchanged"] += 1
+                else:
+                    counts[record["status"]] = counts.get(record["status"], 0) + 1
+    return counts
+
+
+def _get_state(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM job_state WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def _set_state(conn: sqlite3.Connection, key: str, value: Optional[str]) -> None:
+    conn.execute("INSERT OR REPLACE INTO job_state (key, value) VALUES (?, ?)", (key, value))
+
+
+_job_lease = Lease(_connection, "job_state", "lease", JOB_LEASE_SECONDS)
+
+
+def run_if_due(request_fn: RequestFn, interval: int = DONATION_RECONCILE_SECONDS) -> Optional[Dict[str, int]]:
+    """
+    Run ``reconcile`` unless another worker holds the lease or it ran recently.
+
+    Returns:
+        dict: Counts from this run, or None if it was skipped
+    """
+    conn = _connection()
+    owner = uuid.uuid4().hex
+    if not _job_lease.acquire(owner):
+        return None
+    try:
+        # Checked under the lease: a run that just finished wrote last_run before releasing it
+        last_run = json.loads(_get_state(conn, "last_run") or "{}")
+        if time.time() - last_run.get("finished_at", 0) < interval:
+            return None
+        renew = functools.partial(_job_lease.acquire, owner)
+        counts = reconcile(request_fn, renew=renew)
+        if not renew():
+            # The worker that took over records its own run
+            return counts
+        with transaction(conn):
+            _set_state(conn, "last_run", json.dumps({**counts, "finished_at": time.time()}))
+    finally:
+        _job_lease.release(owner)
+    if counts["examined"]:
+        logger.info(f"Donation reconciliation: {counts}")
+    return counts
+
+
+def last_run() -> Optional[Dict[str, Any]]:
+    """Counts and finish time of the last scheduled run."""
+    value = _get_state(_connection(), "last_run")
+    return json.loads(value) if value else None
+
+
+_scheduler_thread: Optional[threading.Thread] = None
+_scheduler_pid: Optional[int] = None
+
+
+def _run_forever(request_fn: RequestFn, interval: int) -> None:
+    while True:
+        try:
+            run_if_due(request_fn, interval)
+        except Exception as exc:
+            logger.warning(f"Donation reconciliation failed: {exc}")
+        # Workers wake at different times; the lease and last_run keep it to one run per interval
+        time.sleep(max(1, interval // 4))
+
+
+def start_scheduler(request_fn: RequestFn) -> bool:
+    """
+    Start this worker's reconciliation thread unless disabled or already running.
+
+    Returns True if a scheduler was started by this call.
+    """
+    global _scheduler_thread, _scheduler_pid
+    if DONATION_RECONCILE_SECONDS <= 0:
+        return False
+    if _scheduler_pid == os.getpid() and _scheduler_thread is not None and _scheduler_thread.is_alive():
+        return False
+    _scheduler_pid = os.getpid()
+    _scheduler_thread = threading.Thread(
+        target=_run_forever,
+        args=(request_fn, DONATION_RECONCILE_SECONDS),
+        name=f"donation-reconcile-{uuid.uuid4().hex[:6]}",
+        daemon=True,
+    )
+    _scheduler_thread.start()
+    return True
+
+
+def main() -> None:
+    import argparse
+
+    # The blueprint owns PayPal auth; only the CLI reaches into it
+    from modules.paypal_gateway import _make_paypal_request
+
+    parser = argparse.ArgumentParser(description="Reconcile pending donations with PayPal")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="reconcile once")
+    run_parser.add_argument("--min-age-minutes", type=int, default=DONATION_RECONCILE_MIN_AGE_MINUTES)
+    run_parser.add_argument("--expire-hours", type=int, default=DONATION_EXPIRE_HOURS)
+    run_parser.add_argument("--concurrency", type=int, default=DONATION_RECONCILE_CONCURRENCY)
+    run_parser.add_argument("--limit", type=int, help="examine at most this many donations")
+    schedule_parser = sub.add_parser("schedule", help="reconcile every interval")
+    schedule_parser.add_argument("--interval", type=int, default=DONATION_RECONCILE_SECONDS or 300)
+    sub.add_parser("status", help="show the last scheduled run")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "run":
+        print(json.dumps(reconcile(
+            _make_paypal_request,
+            min_age_minutes=args.min_age_minutes,
+            expire_hours=args.expire_hours,
+            concurrency=args.concurrency,
+            limit=args.limit,
+        )))
+    elif args.command == "status":
+        print(json.dumps(last_run()))
+    else:
+        _run_forever(_make_paypal_request, args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+# /srv/webapps/platform/services/donation_rollups.py
+
+"""
+Precomputed donation totals per client, day, currency and designation.
+
+Reporting ("totals this month per site") reads the small ``rollups`` table in
+the ``donation_rollups`` SQLite database instead of loading every receipt file
+or donation. Rows are kept current as things are recorded:
+
+- receipts: modules/donation_receipts.py calls ``record_receipts`` after
+  appending receipts to the client's file, and ``record_voids`` after voiding
+  receipts of refunded donations (counted as refunds on the receipt's day);
+- donations: services/donation_store.py calls ``apply_donation_change`` after
+  every status change and ``apply_refund`` for every refund. A donation
+  counts on its confirmation day once completed; each later refund or
+  reversal, partial or full, is added to ``refund_*`` on that same day, so
+  net totals per day stay correct.
+
+Receipts and donations describe the same money from two sides, so they are
+kept apart (``source``) and never summed together. Amounts are stored in
+hundredths of the currency unit.
+
+The table is derived data: if an update was lost (a crash between the record
+and its rollup), rebuild it from the sources with::
+
+    python -m services.donation_rollups rebuild
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("receipts", "donations")
+
+# Dimensions /api/donations/stats may group by ("month" is derived from day).
+GROUP_BY_FIELDS = ("client", "day", "month", "currency", "designation")
+
+# Donation statuses that mean money came in, and that it went back out.
+CREDITED_STATUSES = ("completed", "refunded", "reversed")
+REFUNDED_STATUSES = ("refunded", "reversed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    source TEXT NOT NULL,
+    client TEXT NOT NULL,
+    day TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    designation TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    amount_minor INTEGER NOT NULL DEFAULT 0,
+    refund_count INTEGER NOT NULL DEFAULT 0,
+    refund_minor INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, client, day, currency, designation)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollups_day ON rollups (source, day);
+"""
+
+_GROUP_EXPRESSIONS = {
+    "client": "client",
+    "day": "day",
+    "month": "substr(day, 1, 7)",
+    "currency": "currency",
+    "designation": "designation",
+}
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("donation_rollups", schema=_SCHEMA)
+
+
+def to_minor(amount: Any) -> int:
+    """Amount in hundredths, rounded half up (raises ValueError if not a number)."""
+    try:
+        return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {amount!r}")
+
+
+def format_minor(minor: int) -> str:
+    """Hundredths back to a decimal string ("1234" -> "12.34")."""
+    return str((Decimal(minor) / 100).quantize(Decimal("0.01")))
+
+
+def _day(timestamp: Optional[str]) -> str:
+    """UTC calendar day of an ISO timestamp (today if missing)."""
+    if not timestamp:
+        return datetime.now(timezone.utc).date().isoformat()
+    try:
+        parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return timestamp[:10]
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.date().isoformat()
+
+
+def _add(
+    conn: sqlite3.Connection,
+    key: Tuple[str, str, str, str, str],
+    count: int = 0,
+    amount_minor: int = 0,
+    refund_count: int = 0,
+    refund_minor: int = 0,
+) -> None:
+    conn.execute(
+        "INSERT INTO rollups (source, client, day, currency, designation, count, amount_minor, refund_count, refund_minor) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (source, client, day, currency, designation) DO UPDATE SET "
+        "count = count + excluded.count, amount_minor = amount_minor + excluded.amount_minor, "
+        "refund_count = refund_count + excluded.refund_count, refund_minor = refund_minor + excluded.refund_minor",
+        (*key, count, amount_minor, refund_count, refund_minor),
+    )
+
+
+def _receipt_key(client: str, receipt: Dict[str, Any]) -> Tuple[str, str, str, str, str]:
+    return (
+        "receipts",
+        client or "",
+        _day(receipt.get("recorded_at")),
+        str(receipt.get("currency") or "USD").upper(),
+        receipt.get("designation") or "",
+    )
+
+
+def _donation_key(record: Dict[str, Any]) -> Tuple[str, str, str, str, str]:
+    return (
+        "donations",
+        record.get("client_id") or "",
+        _day(record.get("confirmed_at") or record.get("created_at")),
+        str(record.get("currency") or "USD").upper(),
+        record.get("designation") or "",
+    )
+
+
+def record_receipts(client: str, receipts: Iterable[Dict[str, Any]]) -> None:
+    """Count several newly stored receipts in one transaction."""
+    deltas = [(_receipt_key(client, receipt), to_minor(receipt["amount"])) for receipt in receipts]
+    conn = _connection()
+    with transaction(conn):
+        for key, minor in deltas:
+            _add(conn, key, count=1, amount_minor=minor)
+
+
+def record_voids(client: str, receipts: Iterable[Dict[str, Any]]) -> None:
+    """Count newly voided receipts as refunds of their full amount."""
+    deltas = [(_receipt_key(client, receipt), to_minor(receipt["amount"])) for receipt in receipts]
+    conn = _connection()
+    with transaction(conn):
+        for key, minor in deltas:
+            _add(conn, key, refund_count=1, refund_minor=minor)
+
+
+def _credited_delta(before: Optional[Dict[str, Any]], after: Dict[str, Any]) -> int:
+    return int(after.get("status") in CREDITED_STATUSES) - int((before or {}).get("status") in CREDITED_STATUSES)
+
+
+def apply_donation_change(before: Optional[Dict[str, Any]], after: Dict[str, Any]) -> None:
+    """Adjust rollups for a donation whose status went from ``before`` to ``after``."""
+    credited = _credited_delta(before, after)
+    if not credited:
+        return
+    amount = to_minor(after["amount"])
+    conn = _connection()
+    with transaction(conn):
+        _add(conn, _donation_key(after), count=credited, amount_minor=credited * amount)
+
+
+def apply_refund(record: Dict[str, Any], amount: Any) -> None:
+    """Add one (possibly partial) refund of ``amount`` to the donation's day."""
+    minor = to_minor(amount)
+    conn = _connection()
+    with transaction(conn):
+        _add(conn, _donation_key(record), refund_count=1, refund_minor=minor)
+
+
+def rebuild(
+    receipts: Optional[Iterable[Tuple[str, Dict[str, Any]]]] = None,
+    donations: Optional[Iterable[Dict[str, Any]]] = None,
+    refunds: Iterable[Dict[str, Any]] = (),
+) -> Dict[str, int]:
+    """
+    Recompute rollups from scratch for the sources given.
+
+    Args:
+        receipts: ``(client, receipt)`` pairs; None leaves receipt rollups alone
+        donations: Donation records; None leaves donation rollups alone
+        refunds: Donation records with a ``refund_amount``, one per recorded
+            refund (used with ``donations``). Refunded donations without any
+            recorded refund (from before refunds were recorded) count as
+            fully refunded.
+
+    Returns:
+        dict: Records counted per source
+    """
+    counted: Dict[str, int] = {}
+    conn = _connection()
+    with transaction(conn):
+        if receipts is not None:
+            conn.execute("DELETE FROM rollups WHERE source = 'receipts'")
+            counted["receipts"] = 0
+            for client, receipt in receipts:
+                try:
+                    minor = to_minor(receipt.get("amount"))
+                except ValueError:
+                    logger.warning(f"Skipping receipt with invalid amount for {client}: {receipt.get('amount')!r}")
+                    continue
+                voided = bool(receipt.get("voided_at"))
+                _add(conn, _receipt_key(client, receipt), count=1, amount_minor=minor,
+                     refund_count=int(voided), refund_minor=minor if voided else 0)
+                counted["receipts"] += 1
+        if donations is not None:
+            conn.execute("DELETE FROM rollups WHERE source = 'donations'")
+            counted["donations"] = 0
+            refunded_ids = set()
+            for record in refunds:
+                refunded_ids.add(record["donation_id"])
+                _add(conn, _donation_key(record), refund_count=1, refund_minor=to_minor(record["refund_amount"]))
+            for record in donations:
+                if not _credited_delta(None, record):
+                    continue
+                minor = to_minor(record["amount"])
+                legacy_refund = record["status"] in REFUNDED_STATUSES and record["donation_id"] not in refunded_ids
+                _add(conn, _donation_key(record), count=1, amount_minor=minor,
+                     refund_count=int(legacy_refund), refund_minor=minor if legacy_refund else 0)
+                counted["donations"] += 1
+    return counted
+
+
+def query(
+    source: str,
+    day_from: str,
+    day_to: str,
+    group_by: Sequence[str],
+    client: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Totals between two days (inclusive), grouped by the given dimensions.
+
+    Currency is always part of the grouping so amounts are never mixed.
+
+    Raises:
+        ValueError: For an unknown source or group_by field
+    """
+    if source not in SOURCES:
+        raise ValueError(f"source must be one of: {', '.join(SOURCES)}")
+    unknown = [field for field in group_by if field not in GROUP_BY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown group_by field(s): {', '.join(unknown)}")
+
+    fields = list(dict.fromkeys([*group_by, "currency"]))
+    columns = ", ".join(f"{_GROUP_EXPRESSIONS[field]} AS {field}" for field in fields)
+    sql = (
+        f"SELECT {columns}, SUM(count) AS count, SUM(amount_minor) AS amount_minor, "
+        "SUM(refund_count) AS refund_count, SUM(refund_minor) AS refund_minor "
+        "FROM rollups WHERE source = ? AND day >= ? AND day <= ?"
+    )
+    params: List[Any] = [source, day_from, day_to]
+    if client is not None:
+        sql += " AND client = ?"
+        params.append(client)
+    sql += f" GROUP BY {', '.join(fields)} ORDER BY {', '.join(fields)}"
+
+    rows = []
+    for row in _connection().execute(sql, params):
+        result = {field: row[field] for field in fields}
+        result.update(
+            count=row["count"],
+            amount=format_minor(row["amount_minor"]),
+            refund_count=row["refund_count"],
+            refunded=format_minor(row["refund_minor"]),
+            net=format_minor(row["amount_minor"] - row["refund_minor"]),
+        )
+        rows.append(result)
+    return rows
+
+
+def main() -> None:
+    import argparse
+
+    from services import donation_store
+
+    parser = argparse.ArgumentParser(description="Donation rollups")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = sub.add_parser("rebuild", help="recompute rollups from receipts and donations")
+    rebuild_parser.add_argument("--source", choices=SOURCES, help="only rebuild one source")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    receipts = None
+    if args.source in (None, "receipts"):
+        # Receipt files belong to the blueprint; only the CLI reaches into it
+        from modules.donation_receipts import iter_all_receipts
+        receipts = iter_all_receipts()
+    donations = donation_store.iter_all() if args.source in (None, "donations") else None
+    refunds = donation_store.iter_refunds() if donations is not None else ()
+    print(json.dumps(rebuild(receipts=receipts, donations=donations, refunds=refunds)))
+
+
+if __name__ == "__main__":
+    main()
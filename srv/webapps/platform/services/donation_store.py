@@ -0,0 +1,405 @@
+# /srv/webapps/platform/services/donation_store.py
+
+"""
+Persistent store of donation records shared by all workers.
+
+Donations used to live in a per-process dict, so a ``/confirm`` that reached a
+different gunicorn worker than its ``/create`` found nothing, and a restart
+lost every pending donation. Records are now kept in the ``donations`` SQLite
+database (WAL, see services/state.py) with the columns the blueprint queries
+on indexed: the donation ID (primary key), the provider's order ID, status and
+creation time.
+
+Records go in and come out as the same dicts modules/donation_box.py always
+used; ``provider_data`` is stored as JSON. Status changes made through
+``transition`` and ``update`` are passed on to services/donation_rollups.py.
+
+The same database holds the ``outbox``: when a donation becomes completed, a
+``donation.receipt`` entry is written in the transaction that changes its
+status, so the receipt can't be lost or issued twice however the donation got
+there (confirm, webhook or reconciliation). Likewise a ``donation.receipt.void``
+entry is written when a donation becomes refunded or reversed, so its receipt
+stops counting towards the donor's tax statement. services/donation_outbox.py
+dispatches the entries.
+
+Usage::
+
+    from services import donation_store
+
+    donation_store.create(record)
+    record = donation_store.get(donation_id)
+    donation_store.update(donation_id, status="completed", ...)
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from services import donation_rollups
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# Record keys, in column order; provider_data is JSON-encoded.
+DONATION_FIELDS = [
+    "donation_id",
+    "status",
+    "provider",
+    "provider_order_id",
+    "amount",
+    "currency",
+    "created_at",
+    "confirmed_at",
+    "transaction_id",
+    "client_id",
+    "donor_name",
+    "donor_email",
+    "description",
+    "provider_data",
+]
+
+# Outbox topic written when a donation becomes completed.
+RECEIPT_TOPIC = "donation.receipt"
+VOID_TOPIC = "donation.receipt.void"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS donations (
+    donation_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    provider_order_id TEXT,
+    amount REAL NOT NULL,
+    currency TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    confirmed_at TEXT,
+    transaction_id TEXT,
+    client_id TEXT,
+    donor_name TEXT,
+    donor_email TEXT,
+    description TEXT,
+    provider_data TEXT
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX IF NOT EXISTS donations_provider_order
+    ON donations (provider, provider_order_id) WHERE provider_order_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS donations_status ON donations (status, created_at);
+CREATE INDEX IF NOT EXISTS donations_created_at ON donations (created_at);
+CREATE INDEX IF NOT EXISTS donations_transaction ON donations (transaction_id) WHERE transaction_id IS NOT NULL;
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY,
+    topic TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    dispatched_at REAL,
+    error TEXT,
+    UNIQUE (topic, key)
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, available_at, seq);
+CREATE INDEX IF NOT EXISTS outbox_dispatched_at ON outbox (dispatched_at);
+CREATE TABLE IF NOT EXISTS refunds (
+    refund_id TEXT PRIMARY KEY,
+    donation_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    amount REAL NOT NULL,
+    created_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS refunds_donation ON refunds (donation_id);
+"""
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("donations", schema=_SCHEMA)
+
+
+def connection() -> sqlite3.Connection:
+    """This thread's connection to the donations database (for the outbox dispatcher)."""
+    return _connection()
+
+
+def _to_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    row = {name: record.get(name) for name in DONATION_FIELDS}
+    if row["provider_data"] is not None:
+        row["provider_data"] = json.dumps(row["provider_data"])
+    return row
+
+
+def _from_row(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    record = dict(row)
+    if record.get("provider_data") is not None:
+        record["provider_data"] = json.loads(record["provider_data"])
+    return record
+
+
+def _status_changed(before: Optional[sqlite3.Row], after: Optional[Dict[str, Any]]) -> None:
+    """Keep rollups in step; a failure here must not fail the payment flow."""
+    if before is None or after is None or before["status"] == after["status"]:
+        return
+    try:
+        donation_rollups.apply_donation_change(dict(before), after)
+    except (sqlite3.Error, ValueError) as exc:
+        logger.error(f"Donation rollup update failed for {after['donation_id']} (run a rebuild): {exc}")
+
+
+def _write_outbox(conn: sqlite3.Connection, before: Optional[sqlite3.Row], row: Optional[sqlite3.Row]) -> None:
+    """
+    Queue the receipt for a donation that just became completed, or its void
+    for one that just became refunded or reversed (each once per donation).
+    """
+    if before is None or row is None or row["status"] == before["status"]:
+        return
+    if row["status"] == "completed":
+        topic = RECEIPT_TOPIC
+    elif row["status"] in ("refunded", "reversed"):
+        topic = VOID_TOPIC
+    else:
+        return
+    payload = {name: row[name] for name in DONATION_FIELDS if name != "provider_data"}
+    now = time.time()
+    conn.execute(
+        "INSERT OR IGNORE INTO outbox (topic, key, payload, created_at, available_at) VALUES (?, ?, ?, ?, ?)",
+        (topic, row["donation_id"], json.dumps(payload), now, now),
+    )
+
+
+def create(record: Dict[str, Any]) -> None:
+    """
+    Insert a new donation record.
+
+    Raises:
+        sqlite3.IntegrityError: If the donation ID (or provider order ID) exists
+    """
+    row = _to_row(record)
+    conn = _connection()
+    with transaction(conn):
+        conn.execute(
+            f"INSERT INTO donations ({', '.join(DONATION_FIELDS)}) "
+            f"VALUES ({', '.join(':' + name for name in DONATION_FIELDS)})",
+            row,
+        )
+
+
+def get(donation_id: str) -> Optional[Dict[str, Any]]:
+    """Return the donation record for ``donation_id``, or None."""
+    row = _connection().execute(
+        "SELECT * FROM donations WHERE donation_id = ?", (donation_id,)
+    ).fetchone()
+    return _from_row(row)
+
+
+def get_by_provider_order(provider: str, provider_order_id: str) -> Optional[Dict[str, Any]]:
+    """Return the donation created for a provider's order ID, or None."""
+    row = _connection().execute(
+        "SELECT * FROM donations WHERE provider = ? AND provider_order_id = ?",
+        (provider, provider_order_id),
+    ).fetchone()
+    return _from_row(row)
+
+
+def get_by_transaction(transaction_id: str) -> Optional[Dict[str, Any]]:
+    """Return the donation whose capture has ``transaction_id``, or None."""
+    row = _connection().execute(
+        "SELECT * FROM donations WHERE transaction_id = ?", (transaction_id,)
+    ).fetchone()
+    return _from_row(row)
+
+
+def _encode_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
+    unknown = set(fields) - set(DONATION_FIELDS[1:])
+    if unknown:
+        raise ValueError(f"Unknown donation fields: {', '.join(sorted(unknown))}")
+    if fields.get("provider_data") is not None:
+        fields = {**fields, "provider_data": json.dumps(fields["provider_data"])}
+    return fields
+
+
+def transition(donation_id: str, from_statuses: Iterable[str], **fields: Any) -> Optional[Dict[str, Any]]:
+    """
+    Update a donation only while its status is one of ``from_statuses``.
+
+    Lets concurrent writers (confirm, webhooks, reconciliation) apply a status
+    change without overwriting a later one.
+
+    Returns:
+        dict: The updated record, or None if the donation is missing or in
+        another status
+    """
+    return transition_many([(donation_id, from_statuses, fields)])[0]
+
+
+def transition_many(
+    changes: List[Tuple[str, Iterable[str], Dict[str, Any]]]
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Apply several ``transition`` calls in one write transaction.
+
+    Args:
+        changes: ``(donation_id, from_statuses, fields)`` per donation
+
+    Returns:
+        list: Updated record (or None) for each change, in order
+    """
+    encoded = [(donation_id, set(from_statuses), _encode_fields(fields)) for donation_id, from_statuses, fields in changes]
+    applied = []
+    conn = _connection()
+    with transaction(conn):
+        for donation_id, from_statuses, fields in encoded:
+            before = conn.execute(
+                "SELECT donation_id, status FROM donations WHERE donation_id = ?", (donation_id,)
+            ).fetchone()
+            if before is None or before["status"] not in from_statuses:
+                applied.append((None, None))
+                continue
+            conn.execute(
+                f"UPDATE donations SET {', '.join(f'{name} = :{name}' for name in fields)} "
+                "WHERE donation_id = :donation_id",
+                {**fields, "donation_id": donation_id},
+            )
+            row = conn.execute(
+                "SELECT * FROM donations WHERE donation_id = ?", (donation_id,)
+            ).fetchone()
+            _write_outbox(conn, before, row)
+            applied.append((before, row))
+
+    records = []
+    for before, row in applied:
+        record = _from_row(row)
+        _status_changed(before, record)
+        records.append(record)
+    return records
+
+
+def update(donation_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+    """
+    Update some fields of a donation.
+
+    Returns:
+        dict: The updated record, or None if the donation doesn't exist
+    """
+    fields = _encode_fields(fields)
+    conn = _connection()
+    with transaction(conn):
+        before = conn.execute(
+            "SELECT donation_id, status FROM donations WHERE donation_id = ?", (donation_id,)
+        ).fetchone()
+        if fields and before is not None:
+            conn.execute(
+                f"UPDATE donations SET {', '.join(f'{name} = :{name}' for name in fields)} "
+                "WHERE donation_id = :donation_id",
+                {**fields, "donation_id": donation_id},
+            )
+        row = conn.execute(
+            "SELECT * FROM donations WHERE donation_id = ?", (donation_id,)
+        ).fetchone()
+        _write_outbox(conn, before, row)
+    record = _from_row(row)
+    _status_changed(before, record)
+    return record
+
+
+def record_refund(
+    donation_id: str, refund_id: str, amount: float, kind: str = "refunded", created_at: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Record a (possibly partial) refund or reversal of a completed donation.
+
+    Each PayPal refund is recorded once (``refund_id``). The donation's status
+    becomes ``kind`` ("refunded" or "reversed") once refunds cover its whole
+    amount; a partial refund leaves it completed. The refunded amount is
+    added to the donation rollups.
+
+    Returns:
+        dict: The donation record, or None if this refund was already recorded
+
+    Raises:
+        LookupError: If the donation is missing or not (yet) completed
+    """
+    conn = _connection()
+    with transaction(conn):
+        before = conn.execute("SELECT * FROM donations WHERE donation_id = ?", (donation_id,)).fetchone()
+        if before is None or before["status"] not in ("completed", "refunded", "reversed"):
+            raise LookupError(f"Donation {donation_id} is not completed")
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO refunds (refund_id, donation_id, kind, amount, created_at) VALUES (?, ?, ?, ?, ?)",
+            (refund_id, donation_id, kind, amount, created_at or datetime.utcnow().isoformat()),
+        )
+        if cursor.rowcount == 0:
+            return None
+        refunded = conn.execute(
+            "SELECT SUM(amount) AS total FROM refunds WHERE donation_id = ?", (donation_id,)
+        ).fetchone()["total"]
+        if before["status"] == "completed" and round(refunded, 2) >= round(before["amount"], 2):
+            conn.execute("UPDATE donations SET status = ? WHERE donation_id = ?", (kind, donation_id))
+        row = conn.execute("SELECT * FROM donations WHERE donation_id = ?", (donation_id,)).fetchone()
+        _write_outbox(conn, before, row)
+
+    record = _from_row(row)
+    try:
+        donation_rollups.apply_refund(record, amount)
+    except (sqlite3.Error, ValueError) as exc:
+        logger.error(f"Donation rollup refund failed for {donation_id} (run a rebuild): {exc}")
+    return record
+
+
+def iter_refunds() -> Iterator[Dict[str, Any]]:
+    """Every recorded refund with its donation's fields (``refund_amount``), for rollup rebuilds."""
+    rows = _connection().execute(
+        "SELECT donations.*, refunds.amount AS refund_amount FROM refunds "
+        "JOIN donations USING (donation_id) ORDER BY refunds.created_at"
+    )
+    for row in rows:
+        yield _from_row(row)
+
+
+def iter_all(batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """Every donation, oldest first, read in batches (for rebuilds and exports)."""
+    last_key = ("", "")
+    conn = _connection()
+    while True:
+        rows = conn.execute(
+            "SELECT * FROM donations WHERE (created_at, donation_id) > (?, ?) "
+            "ORDER BY created_at, donation_id LIMIT ?",
+            (*last_key, batch_size),
+        ).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield _from_row(row)
+        last_key = (rows[-1]["created_at"], rows[-1]["donation_id"])
+
+
+def list_by_status(
+    status: str,
+    created_before: Optional[str] = None,
+    limit: int = 100,
+    after: Optional[Tuple[str, str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Donations in ``status``, oldest first.
+
+    Args:
+        status: Status to list
+        created_before: Only donations created before this ISO timestamp
+        limit: Page size
+        after: ``(created_at, donation_id)`` of the previous page's last record
+    """
+    query = "SELECT * FROM donations WHERE status = ?"
+    params: List[Any] = [status]
+    if created_before:
+        query += " AND created_at < ?"
+        params.append(created_before)
+    if after:
+        query += " AND (created_at, donation_id) > (?, ?)"
+        params.extend(after)
+    query += " ORDER BY created_at, donation_id LIMIT ?"
+    params.append(limit)
+    return [_from_row(row) for row in _connection().execute(query, params)]
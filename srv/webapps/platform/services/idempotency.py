@@ -0,0 +1,224 @@
+# /srv/webapps/platform/services/idempotency.py
+
+"""
+Idempotency keys for endpoints that create things upstream.
+
+A client that retries ``POST /create-order`` after a dropped connection sends
+the same ``Idempotency-Key`` header. The first request claims the key and, once
+it has an answer, stores the response next to a fingerprint of the request.
+Later requests with that key:
+
+- get the stored response back without calling the provider (a replay),
+- wait for the first one to finish when it is still running (on any worker),
+  then replay its response,
+- are rejected when the key was used for a different request body.
+
+Only responses below 500 are kept; after a server or provider error the key is
+released so the client's retry gets a real second attempt. A claim whose
+worker died is taken over after ``IDEMPOTENCY_LOCK_SECONDS``, and keys are
+forgotten after ``IDEMPOTENCY_TTL_SECONDS``.
+
+This module is framework-free; modules/paypal_gateway.py wraps it for Flask.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+
+# A claim older than this belongs to a worker that died mid-request.
+IDEMPOTENCY_LOCK_SECONDS = 60
+
+# How long a duplicate waits for the first request before giving up.
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+
+MAX_KEY_LENGTH = 255
+
+_POLL_SECONDS = 0.02
+_MAX_POLL_SECONDS = 0.1
+
+# Expired keys are pruned on roughly one claim in this many.
+_PRUNE_EVERY = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    request_hash TEXT NOT NULL,
+    owner TEXT,
+    locked_until REAL,
+    response_status INTEGER,
+    response_body TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (scope, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idempotency_keys_created_at ON idempotency_keys (created_at);
+"""
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body."""
+
+
+class IdempotencyInProgress(Exception):
+    """The first request with this key is still running after the wait."""
+
+
+@dataclass
+class Claim:
+    """
+    Result of ``begin``.
+
+    Either ``replay`` is set (return the stored response) or ``owner`` is
+    (this request runs, then calls ``complete`` or ``release``).
+    """
+
+    scope: str
+    key: str
+    owner: Optional[str] = None
+    replay_status: Optional[int] = None
+    replay_body: Any = None
+
+    @property
+    def replay(self) -> bool:
+        return self.owner is None
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("idempotency", schema=_SCHEMA)
+
+
+def request_fingerprint(method: str, path: str, body: bytes) -> str:
+    """Hash identifying a request, so a key can't be replayed for another one."""
+    digest = hashlib.sha256()
+    digest.update(f"{method.upper()} {path}\n".encode("utf-8"))
+    digest.update(body or b"")
+    return digest.hexdigest()
+
+
+def upstream_request_id(scope: str, key: str) -> str:
+    """
+    Stable ID to forward upstream (e.g. as ``PayPal-Request-Id``), so the
+    provider deduplicates too. Short enough for PayPal's 108-character limit.
+    """
+    return f"{scope}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:40]}"
+
+
+def _try_claim(scope: str, key: str, request_hash: str) -> Optional[Claim]:
+    """Claim the key, or return the stored response; None while another request runs."""
+    now = time.time()
+    conn = _connection()
+    with transaction(conn):
+        row = conn.execute(
+            "SELECT request_hash, owner, locked_until, response_status, response_body, created_at "
+            "FROM idempotency_keys WHERE scope = ? AND key = ?",
+            (scope, key),
+        ).fetchone()
+
+        if row is not None and row["created_at"] < now - IDEMPOTENCY_TTL_SECONDS:
+            row = None
+
+        if row is not None:
+            if row["request_hash"] != request_hash:
+                raise IdempotencyKeyReused(f"Idempotency-Key {key!r} was used for a different request")
+            if row["response_status"] is not None:
+                return Claim(
+                    scope=scope,
+                    key=key,
+                    replay_status=row["response_status"],
+                    replay_body=json.loads(row["response_body"]),
+                )
+            if row["locked_until"] and row["locked_until"] > now:
+                return None
+
+        owner = uuid.uuid4().hex
+        conn.execute(
+            "INSERT OR REPLACE INTO idempotency_keys "
+            "(scope, key, request_hash, owner, locked_until, response_status, response_body, created_at) "
+            "VALUES (?, ?, ?, ?, ?, NULL, NULL, ?)",
+            (scope, key, request_hash, owner, now + IDEMPOTENCY_LOCK_SECONDS, now),
+        )
+    return Claim(scope=scope, key=key, owner=owner)
+
+
+def begin(scope: str, key: str, request_hash: str, wait: float = IDEMPOTENCY_WAIT_SECONDS) -> Claim:
+    """
+    Claim ``key`` for this request, or get the response stored for it.
+
+    Waits (polling the shared store) while another request holds the key.
+
+    Raises:
+        IdempotencyKeyReused: If the key belongs to a request with another hash
+        IdempotencyInProgress: If the other request is still running after ``wait``
+        sqlite3.Error: If the store is unavailable
+    """
+    if random.randrange(_PRUNE_EVERY) == 0:
+        prune()
+
+    deadline = time.monotonic() + wait
+    delay = _POLL_SECONDS
+    while True:
+        claim = _try_claim(scope, key, request_hash)
+        if claim is not None:
+            return claim
+        if time.monotonic() >= deadline:
+            raise IdempotencyInProgress(f"A request with Idempotency-Key {key!r} is still in progress")
+        time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+        delay = min(delay * 2, _MAX_POLL_SECONDS)
+
+
+def complete(claim: Claim, status: int, body: Any) -> None:
+    """Store the response for replays (responses >= 500 release the key instead)."""
+    if status >= 500:
+        release(claim)
+        return
+    conn = _connection()
+    with transaction(conn):
+        conn.execute(
+            "UPDATE idempotency_keys SET response_status = ?, response_body = ?, owner = NULL, locked_until = NULL "
+            "WHERE scope = ? AND key = ? AND owner = ?",
+            (status, json.dumps(body), claim.scope, claim.key, claim.owner),
+        )
+
+
+def release(claim: Claim) -> None:
+    """Give the key up without a stored response, so a retry runs again."""
+    try:
+        conn = _connection()
+        with transaction(conn):
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND owner = ?",
+                (claim.scope, claim.key, claim.owner),
+            )
+    except sqlite3.Error:
+        # The claim expires after IDEMPOTENCY_LOCK_SECONDS anyway.
+        logger.warning(f"Could not release idempotency key {claim.scope}/{claim.key}", exc_info=True)
+
+
+def prune() -> int:
+    """Delete expired keys. Returns the number removed."""
+    try:
+        conn = _connection()
+        with transaction(conn):
+            cursor = conn.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < ?",
+                (time.time() - IDEMPOTENCY_TTL_SECONDS,),
+            )
+        return cursor.rowcount
+    except sqlite3.Error:
+        logger.warning("Could not prune idempotency keys", exc_info=True)
+        return 0
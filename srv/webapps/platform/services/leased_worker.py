@@ -0,0 +1,246 @@
+# /srv/webapps/platform/services/leased_worker.py
+
+"""
+Batch workers that one process at a time runs, behind a lease in SQLite.
+
+services/paypal_webhook_queue.py and services/donation_outbox.py both work
+through a table of pending rows in batches. Every web worker may start a
+thread for that, but only the one holding the lease drains; the others wait
+for a wake-up or the next poll and take over once a dead holder's lease
+expires. The same worker can run from a CLI process instead.
+
+Usage::
+
+    _worker = LeasedWorker("donation-outbox-dispatcher", _state_connection, "dispatcher_state",
+                           batch_size=BATCH_SIZE, prune=prune)
+
+    _worker.drain(dispatch_batch)          # once, if the lease is free
+    _worker.start(dispatch_batch)          # from a daemon thread in this process
+    _worker.wake()                         # look for new rows now
+
+The lease (``Lease``) is a ``"<owner> <taken_at>"`` value under its key in a
+``(key TEXT PRIMARY KEY, value TEXT)`` table of the caller's state database;
+only its owner renews or releases it.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from services.state import transaction
+
+logger = logging.getLogger(__name__)
+
+# batch_fn(renew) handles one batch of due rows and returns how many it
+# handled. It calls renew() before each row and stops, leaving the rest
+# pending, once renew() returns False: the lease went to another worker.
+RenewFn = Callable[[], bool]
+BatchFn = Callable[[RenewFn], int]
+
+
+class Lease:
+    """
+    A lease on one key of a state table, held by one owner at a time.
+
+    Jobs that aren't batch workers (a catalog sync, a reconciliation run) use
+    it on its own: take it with an owner of their own, renew it as they go
+    and release it when done.
+    """
+
+    def __init__(
+        self,
+        state_connection: Callable[[], sqlite3.Connection],
+        table: str,
+        key: str = "lease",
+        seconds: float = 60,
+    ):
+        """
+        Args:
+            state_connection: Returns this thread's connection to the
+                database holding ``table``
+            seconds: Age after which a lease belongs to a dead owner
+        """
+        self.state_connection = state_connection
+        self.table = table
+        self.key = key
+        self.seconds = seconds
+
+    def _value(self, conn: sqlite3.Connection) -> Optional[str]:
+        row = conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (self.key,)).fetchone()
+        return row["value"] if row else None
+
+    def acquire(self, owner: str) -> bool:
+        """Take or renew the lease. Returns False if another live owner holds it."""
+        conn = self.state_connection()
+        now = time.time()
+        with transaction(conn):
+            value = self._value(conn)
+            if value:
+                # Leases written before owners were recorded are a bare timestamp
+                holder, _, taken_at = value.rpartition(" ")
+                if holder != owner and now - float(taken_at) < self.seconds:
+                    return False
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                (self.key, f"{owner} {now}"),
+            )
+        return True
+
+    def release(self, owner: str) -> None:
+        """Give up the lease, unless it has already passed to another owner."""
+        conn = self.state_connection()
+        with transaction(conn):
+            value = self._value(conn)
+            if value and value.rpartition(" ")[0] == owner:
+                conn.execute(f"UPDATE {self.table} SET value = NULL WHERE key = ?", (self.key,))
+
+
+class LeasedWorker:
+    """A batch worker run by at most one process at a time."""
+
+    def __init__(
+        self,
+        name: str,
+        state_connection: Callable[[], sqlite3.Connection],
+        lease_table: str,
+        lease_key: str = "lease",
+        lease_seconds: float = 60,
+        batch_size: int = 100,
+        poll_seconds: float = 5,
+        prune: Optional[Callable[[], int]] = None,
+        prune_every_seconds: float = 3600,
+    ):
+        """
+        Args:
+            name: Thread name, also used in log messages
+            state_connection: Returns this thread's connection to the
+                database holding ``lease_table``
+            lease_seconds: Age after which a lease belongs to a dead worker;
+                longer than the slowest single row, as it is renewed per row
+            batch_size: A batch this full means more rows may be due
+            poll_seconds: How often an idle worker looks for rows other
+                processes wrote
+            prune: Deletes old handled rows; run every ``prune_every_seconds``
+        """
+        self.name = name
+        self.state_connection = state_connection
+        self.lease = Lease(state_connection, lease_table, lease_key, lease_seconds)
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.prune = prune
+        self.prune_every_seconds = prune_every_seconds
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def acquire_lease(self, owner: str) -> bool:
+        """Take or renew the lease. Returns False if another live owner holds it."""
+        return self.lease.acquire(owner)
+
+    def release_lease(self, owner: str) -> None:
+        self.lease.release(owner)
+
+    def drain(self, batch_fn: BatchFn, owner: Optional[str] = None, max_batches: Optional[int] = None) -> Optional[int]:
+        """
+        Run ``batch_fn`` until a batch comes back short or the lease is lost.
+
+        Returns:
+            int: Rows handled, or None if another owner holds the lease
+        """
+        owner = owner or uuid.uuid4().hex
+        if not self.acquire_lease(owner):
+            return None
+        lost = False
+
+        def renew() -> bool:
+            nonlocal lost
+            lost = lost or not self.acquire_lease(owner)
+            return not lost
+
+        handled = 0
+        batches = 0
+        try:
+            while max_batches is None or batches < max_batches:
+                count = batch_fn(renew)
+                handled += count
+                batches += 1
+                if count < self.batch_size or not renew():
+                    break
+                # Let request threads run between batches
+                time.sleep(0)
+        finally:
+            self.release_lease(owner)
+        if lost:
+            logger.warning(f"{self.name} lost its lease to another worker after {handled} rows")
+        return handled
+
+    def run_forever(self, batch_fn: BatchFn, owner: str, wake: threading.Event) -> None:
+        """Drain whenever woken or every ``poll_seconds``, pruning as configured."""
+        last_prune = 0.0
+        while True:
+            wake.wait(self.poll_seconds)
+            wake.clear()
+            try:
+                self.drain(batch_fn, owner)
+                if self.prune is not None and time.time() - last_prune > self.prune_every_seconds:
+                    self.prune()
+                    last_prune = time.time()
+            except Exception as exc:
+                logger.warning(f"{self.name} error: {exc}")
+
+    def wake(self) -> None:
+        """Have this process's thread look for new rows now rather than at the next poll."""
+        self._wake.set()
+
+    def start(self, batch_fn: BatchFn) -> bool:
+        """
+        Start this process's worker thread unless it is already running.
+
+        Returns True if a thread was started by this call.
+        """
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return False
+        # A thread started before a fork doesn't exist in the child
+        self._wake = threading.Event()
+        self._wake.set()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self.run_forever,
+            args=(batch_fn, f"{os.getpid()}-{uuid.uuid4().hex[:8]}", self._wake),
+            name=self.name,
+            daemon=True,
+        )
+        self._thread.start()
+        return True
+
+
+def prune_handled(conn: sqlite3.Connection, table: str, handled_column: str, retention_days: float) -> int:
+    """Delete ``done`` rows of ``table`` handled more than ``retention_days`` ago."""
+    with transaction(conn):
+        cursor = conn.execute(
+            f"DELETE FROM {table} WHERE status = 'done' AND {handled_column} < ?",
+            (time.time() - retention_days * 86400,),
+        )
+    return cursor.rowcount
+
+
+def status_counts(conn: sqlite3.Connection, table: str, created_column: str) -> Dict[str, Any]:
+    """Rows of ``table`` by status, and the age of the oldest pending one."""
+    counts = {row["status"]: row["n"] for row in conn.execute(
+        f"SELECT status, COUNT(*) AS n FROM {table} GROUP BY status"
+    )}
+    oldest = conn.execute(
+        f"SELECT MIN({created_column}) AS t FROM {table} WHERE status = 'pending'"
+    ).fetchone()["t"]
+    return {
+        "pending": counts.get("pending", 0),
+        "done": counts.get("done", 0),
+        "failed": counts.get("failed", 0),
+        "oldest_pending_age": round(time.time() - oldest, 1) if oldest else None,
+    }
@@ -0,0 +1,396 @@
+# /srv/webapps/platform/services/paypal_webhook_queue.py
+
+"""
+Durable queue of PayPal webhook events and the consumer that applies them.
+
+``POST /api/payments/paypal/webhook`` only appends the event to the
+``paypal_webhooks`` SQLite database and answers 200, so PayPal's retry storms
+cost one small insert per delivery instead of tying up a worker. Events are
+deduplicated by their PayPal event ID on insert; redeliveries are
+acknowledged and dropped.
+
+A consumer thread in each worker drains the queue in batches. Only one worker
+at a time holds the consumer lease (see services/leased_worker.py), so
+events are applied in arrival order and the others stay idle. Handlers
+update donation state through services/donation_store.py with status
+transitions that never move a donation backwards, so replaying an event is
+harmless. A failed event is retried with backoff and parked as ``failed``
+after ``MAX_ATTEMPTS``.
+
+Set ``PAYPAL_WEBHOOK_CONSUMER=off`` to keep the consumer out of the web
+workers and run it as its own process instead::
+
+    python -m services.paypal_webhook_queue consume
+    python -m services.paypal_webhook_queue drain   # once, e.g. from cron
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from services import donation_store
+from services.donation_rollups import to_minor
+from services.leased_worker import BatchFn, LeasedWorker, prune_handled, status_counts
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+PAYPAL_WEBHOOK_CONSUMER = os.getenv("PAYPAL_WEBHOOK_CONSUMER", "thread")
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 8
+
+# Idle consumers look for events queued by other workers this often.
+POLL_SECONDS = 5
+
+# A consumer lease older than this belongs to a worker that died. It is
+# renewed before each event, so it only has to outlast the slowest one: a
+# capture lookup with its retries (see services/rate_limit.py).
+CONSUMER_LEASE_SECONDS = 300
+
+# Processed events are kept this long for deduplication and auditing.
+RETENTION_DAYS = 30
+
+RequestFn = Callable[..., Dict[str, Any]]
+
+# handler(event, request_fn); request_fn is the caller's PayPal request function
+EventHandler = Callable[[Dict[str, Any], RequestFn], None]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    event_id TEXT NOT NULL UNIQUE,
+    event_type TEXT,
+    resource_id TEXT,
+    payload TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    processed_at REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS events_pending ON events (status, available_at, seq);
+CREATE INDEX IF NOT EXISTS events_processed_at ON events (processed_at);
+CREATE TABLE IF NOT EXISTS queue_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("paypal_webhooks", schema=_SCHEMA)
+
+
+def _now_iso() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def enqueue(event: Dict[str, Any]) -> bool:
+    """
+    Append a webhook event to the queue.
+
+    Returns:
+        bool: False if an event with the same ID was already queued
+
+    Raises:
+        ValueError: If the event has no ``id``
+        sqlite3.Error: If the queue is unavailable (PayPal will redeliver)
+    """
+    event_id = event.get("id")
+    if not event_id:
+        raise ValueError("PayPal webhook event has no id")
+
+    now = time.time()
+    conn = _connection()
+    with transaction(conn):
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO events (event_id, event_type, resource_id, payload, received_at, available_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                event_id,
+                event.get("event_type"),
+                (event.get("resource") or {}).get("id"),
+                json.dumps(event),
+                now,
+                now,
+            ),
+        )
+    queued = cursor.rowcount == 1
+    if queued:
+        _worker.wake()
+    return queued
+
+
+# ----------------------------------------------------------------------
+# Event handlers
+# ----------------------------------------------------------------------
+
+def _order_id_for_capture(resource: Dict[str, Any]) -> Optional[str]:
+    related = (resource.get("supplementary_data") or {}).get("related_ids") or {}
+    return related.get("order_id")
+
+
+def _capture_id_for_refund(resource: Dict[str, Any]) -> Optional[str]:
+    for link in resource.get("links") or []:
+        if link.get("rel") == "up" and "/captures/" in (link.get("href") or ""):
+            return link["href"].rstrip("/").rsplit("/", 1)[-1]
+    return None
+
+
+def _donation_for_capture(resource: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    order_id = _order_id_for_capture(resource)
+    if order_id:
+        donation = donation_store.get_by_provider_order("paypal", order_id)
+        if donation:
+            return donation
+    if resource.get("id"):
+        return donation_store.get_by_transaction(resource["id"])
+    return None
+
+
+def _verified_capture(capture_id: str, donation: Dict[str, Any], request_fn: RequestFn) -> Optional[Dict[str, Any]]:
+    """
+    PayPal's own record of a capture, if it really completed this donation.
+
+    The webhook body is only a hint: the capture is fetched from PayPal and
+    must be COMPLETED, belong to the donation's order and match its amount.
+    """
+    try:
+        capture = request_fn("GET", f"/v2/payments/captures/{capture_id}")
+    except Exception as exc:
+        if getattr(exc, "status_code", None) == 404:
+            logger.warning(f"PayPal webhook names unknown capture {capture_id}; ignored")
+            return None
+        raise
+    amount = capture.get("amount") or {}
+    checks = {
+        "status": capture.get("status") == "COMPLETED",
+        "order": _order_id_for_capture(capture) == donation.get("provider_order_id"),
+        "currency": str(amount.get("currency_code") or "").upper() == str(donation.get("currency") or "").upper(),
+        "amount": amount.get("value") is not None and to_minor(amount["value"]) == to_minor(donation["amount"]),
+    }
+    failed = [name for name, ok in checks.items() if not ok]
+    if failed:
+        logger.warning(
+            f"PayPal capture {capture_id} does not match donation {donation['donation_id']} "
+            f"({', '.join(failed)}); ignored"
+        )
+        return None
+    return capture
+
+
+def _capture_completed(event: Dict[str, Any], request_fn: RequestFn) -> None:
+    resource = event.get("resource") or {}
+    donation = _donation_for_capture(resource)
+    if donation is None or donation["status"] not in ("pending", "failed") or not resource.get("id"):
+        return
+    if _verified_capture(resource["id"], donation, request_fn) is None:
+        return
+    donation_store.transition(
+        donation["donation_id"],
+        ["pending", "failed"],
+        status="completed",
+        transaction_id=resource.get("id"),
+        confirmed_at=donation.get("confirmed_at") or _now_iso(),
+    )
+
+
+def _capture_denied(event: Dict[str, Any], request_fn: RequestFn) -> None:
+    resource = event.get("resource") or {}
+    donation = _donation_for_capture(resource)
+    if donation is None:
+        return
+    donation_store.transition(
+        donation["donation_id"],
+        ["pending"],
+        status="failed",
+        transaction_id=resource.get("id"),
+        confirmed_at=donation.get("confirmed_at") or _now_iso(),
+    )
+
+
+def _capture_reversed(status: str) -> EventHandler:
+    """
+    Handler recording a refund or reversal of ``resource.amount``.
+
+    PayPal sends PAYMENT.CAPTURE.REFUNDED for partial refunds too, so only the
+    amount in the event is refunded; the donation becomes ``status`` once its
+    refunds add up to the whole amount.
+    """
+    def handle(event: Dict[str, Any], request_fn: RequestFn) -> None:
+        resource = event.get("resource") or {}
+        if event.get("event_type") == "PAYMENT.CAPTURE.REFUNDED":
+            capture_id = _capture_id_for_refund(resource)
+            donation = donation_store.get_by_transaction(capture_id) if capture_id else None
+        else:
+            donation = _donation_for_capture(resource)
+        if donation is None:
+            return
+        amount = resource.get("amount") or {}
+        currency = str(amount.get("currency_code") or donation["currency"]).upper()
+        if currency != str(donation["currency"]).upper():
+            logger.warning(
+                f"PayPal {status} {resource.get('id')} is in {currency}, donation "
+                f"{donation['donation_id']} in {donation['currency']}; ignored"
+            )
+            return
+        value = float(amount["value"]) if amount.get("value") is not None else donation["amount"]
+        # Raises LookupError (retried) while the capture itself is still queued
+        donation_store.record_refund(
+            donation["donation_id"],
+            refund_id=resource.get("id") or event["id"],
+            amount=value,
+            kind=status,
+        )
+    return handle
+
+
+EVENT_HANDLERS: Dict[str, EventHandler] = {
+    "PAYMENT.CAPTURE.COMPLETED": _capture_completed,
+    "PAYMENT.CAPTURE.DENIED": _capture_denied,
+    "PAYMENT.CAPTURE.DECLINED": _capture_denied,
+    "PAYMENT.CAPTURE.REFUNDED": _capture_reversed("refunded"),
+    "PAYMENT.CAPTURE.REVERSED": _capture_reversed("reversed"),
+}
+
+
+# ----------------------------------------------------------------------
+# Consumer
+# ----------------------------------------------------------------------
+
+def _next_batch(conn: sqlite3.Connection, limit: int) -> List[sqlite3.Row]:
+    return conn.execute(
+        "SELECT event_id, event_type, payload, attempts FROM events "
+        "WHERE status = 'pending' AND available_at <= ? ORDER BY seq LIMIT ?",
+        (time.time(), limit),
+    ).fetchall()
+
+
+def process_batch(
+    conn: sqlite3.Connection,
+    request_fn: RequestFn,
+    limit: int = BATCH_SIZE,
+    renew: Optional[Callable[[], bool]] = None,
+) -> int:
+    """
+    Apply up to ``limit`` due events. Returns the number handled.
+
+    ``renew`` is called before each event; once it returns False the rest of
+    the batch is left pending for the worker that now holds the lease.
+    """
+    rows = _next_batch(conn, limit)
+    results = []
+    for row in rows:
+        if renew is not None and not renew():
+            break
+        event = json.loads(row["payload"])
+        handler = EVENT_HANDLERS.get(row["event_type"])
+        try:
+            if handler:
+                handler(event, request_fn)
+            results.append((row["event_id"], "done", None, row["attempts"] + 1))
+        except Exception as exc:
+            logger.warning(f"PayPal webhook {row['event_id']} ({row['event_type']}) failed: {exc}")
+            attempts = row["attempts"] + 1
+            status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+            results.append((row["event_id"], status, str(exc), attempts))
+
+    now = time.time()
+    with transaction(conn):
+        for event_id, status, error, attempts in results:
+            conn.execute(
+                "UPDATE events SET status = ?, error = ?, attempts = ?, processed_at = ?, available_at = ? "
+                "WHERE event_id = ?",
+                (
+                    status,
+                    error,
+                    attempts,
+                    now if status != "pending" else None,
+                    now + min(3600, 2 ** attempts) if status == "pending" else now,
+                    event_id,
+                ),
+            )
+    return len(results)
+
+
+def _batch_fn(request_fn: RequestFn) -> BatchFn:
+    # Connections are per thread, so take one where the batch runs
+    return lambda renew: process_batch(_connection(), request_fn, renew=renew)
+
+
+def drain(request_fn: RequestFn, owner: Optional[str] = None, max_batches: Optional[int] = None) -> Optional[int]:
+    """
+    Apply due events batch by batch until none are left.
+
+    Returns:
+        int: Events handled, or None if another consumer holds the lease
+    """
+    return _worker.drain(_batch_fn(request_fn), owner, max_batches)
+
+
+def prune() -> int:
+    """Delete processed events older than RETENTION_DAYS."""
+    return prune_handled(_connection(), "events", "processed_at", RETENTION_DAYS)
+
+
+def stats() -> Dict[str, Any]:
+    """Queue depth by status."""
+    return status_counts(_connection(), "events", "received_at")
+
+
+_worker = LeasedWorker(
+    "paypal-webhook-consumer",
+    _connection,
+    "queue_state",
+    lease_key="consumer_lease",
+    lease_seconds=CONSUMER_LEASE_SECONDS,
+    batch_size=BATCH_SIZE,
+    poll_seconds=POLL_SECONDS,
+    prune=prune,
+)
+
+
+def start_consumer(request_fn: RequestFn) -> bool:
+    """
+    Start this worker's consumer thread unless disabled or already running.
+
+    Returns True if a consumer was started by this call.
+    """
+    if PAYPAL_WEBHOOK_CONSUMER != "thread":
+        return False
+    return _worker.start(_batch_fn(request_fn))
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PayPal webhook queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("drain", help="apply all due events once")
+    sub.add_parser("consume", help="apply events as they arrive")
+    sub.add_parser("stats", help="show queue depth")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # The blueprint owns PayPal auth; only the CLI reaches into it
+    from modules.paypal_gateway import _make_paypal_request
+
+    if args.command == "drain":
+        print(json.dumps({"handled": drain(_make_paypal_request)}))
+    elif args.command == "stats":
+        print(json.dumps(stats()))
+    else:
+        _worker.run_forever(_batch_fn(_make_paypal_request), f"cli-{os.getpid()}", threading.Event())
+
+
+if __name__ == "__main__":
+    main()
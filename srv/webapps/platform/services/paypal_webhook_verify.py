@@ -0,0 +1,340 @@
+# /srv/webapps/platform/services/paypal_webhook_verify.py
+
+"""
+Local verification of PayPal webhook signatures.
+
+PayPal signs each delivery with SHA256withRSA over::
+
+    <PAYPAL-TRANSMISSION-ID>|<PAYPAL-TRANSMISSION-TIME>|<webhook id>|<CRC32 of the raw body>
+
+and names the signing certificate in ``PAYPAL-CERT-URL``. Instead of calling
+``/v1/notifications/verify-webhook-signature`` for every event, the
+certificate is downloaded once, validated (PayPal host, subject, validity
+period, chain up to a trusted root) and its public key cached per URL until
+the certificate expires. After the first event, verification is one CRC32 and
+one RSA verify.
+
+Local verification needs the optional ``cryptography`` package. Without it
+(or with ``PAYPAL_WEBHOOK_VERIFY=api``) events are checked by PayPal's verify
+API instead, through the request function the caller passes in.
+
+Without a ``PAYPAL_WEBHOOK_ID`` (or with ``PAYPAL_WEBHOOK_VERIFY=off``) no
+delivery can be verified, so ``verify`` refuses them all with
+``WebhookNotConfigured``. Set ``PAYPAL_WEBHOOK_ALLOW_UNVERIFIED=1`` to accept
+unverified events instead, e.g. against a local stand-in.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import logging
+import os
+import threading
+import time
+import warnings
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Mapping, Optional
+from urllib.parse import urlparse
+
+import requests
+
+try:
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.x509.oid import NameOID
+except ImportError:  # pragma: no cover - exercised on hosts without cryptography
+    x509 = None
+
+logger = logging.getLogger(__name__)
+
+PAYPAL_WEBHOOK_ID = os.getenv("PAYPAL_WEBHOOK_ID")
+
+# "local" (default when cryptography is installed), "api" or "off"
+PAYPAL_WEBHOOK_VERIFY = os.getenv("PAYPAL_WEBHOOK_VERIFY", "local" if x509 is not None else "api")
+
+# Accept events unverified when verification is off or has no webhook ID.
+PAYPAL_WEBHOOK_ALLOW_UNVERIFIED = os.getenv("PAYPAL_WEBHOOK_ALLOW_UNVERIFIED", "0") == "1"
+
+# PEM bundle of roots the certificate chain must end in (default: certifi's).
+PAYPAL_CERT_CA_FILE = os.getenv("PAYPAL_CERT_CA_FILE")
+
+# Name PayPal's signing certificates are issued to.
+PAYPAL_CERT_SUBJECT = os.getenv("PAYPAL_CERT_SUBJECT", "messageverificationcerts.paypal.com")
+
+# Certificates are only downloaded over HTTPS from these hosts, or from the
+# configured PAYPAL_API_BASE (which lets a local stand-in serve its own).
+PAYPAL_CERT_HOSTS = ("api.paypal.com", "api.sandbox.paypal.com", "api-m.paypal.com", "api-m.sandbox.paypal.com")
+
+SUPPORTED_AUTH_ALGO = "SHA256withRSA"
+
+# How long a certificate URL that failed validation is not retried.
+FAILED_CERT_RETRY_SECONDS = 60
+
+MAX_CACHED_CERTS = 32
+
+RequestFn = Callable[..., Dict[str, Any]]
+
+
+class WebhookVerificationError(Exception):
+    """A webhook delivery whose signature can't be trusted."""
+
+
+class WebhookNotConfigured(Exception):
+    """Verification is off or has no webhook ID, and unverified events aren't allowed."""
+
+
+@dataclass
+class _CachedCert:
+    public_key: Any
+    not_after: float
+
+
+_certs: Dict[str, _CachedCert] = {}
+_failed_urls: Dict[str, float] = {}
+_cert_lock = threading.Lock()
+_roots: Optional[Dict[Any, List[Any]]] = None
+
+
+def verification_mode() -> str:
+    """The verification actually in effect: "local", "api", "off" or "unconfigured"."""
+    if not PAYPAL_WEBHOOK_ID or PAYPAL_WEBHOOK_VERIFY == "off":
+        return "off" if PAYPAL_WEBHOOK_ALLOW_UNVERIFIED else "unconfigured"
+    if PAYPAL_WEBHOOK_VERIFY == "local" and x509 is not None:
+        return "local"
+    return "api"
+
+
+def signed_message(transmission_id: str, transmission_time: str, webhook_id: str, raw_body: bytes) -> bytes:
+    """The string PayPal signs for a delivery (the CRC32 is unsigned decimal)."""
+    crc = zlib.crc32(raw_body) & 0xFFFFFFFF
+    return f"{transmission_id}|{transmission_time}|{webhook_id}|{crc}".encode("utf-8")
+
+
+def _check_cert_url(cert_url: str, api_base: Optional[str]) -> None:
+    parsed = urlparse(cert_url)
+    if parsed.scheme == "https" and parsed.hostname in PAYPAL_CERT_HOSTS:
+        return
+    if api_base:
+        base = urlparse(api_base)
+        if (parsed.scheme, parsed.netloc) == (base.scheme, base.netloc):
+            return
+    raise WebhookVerificationError(f"Certificate URL is not a PayPal URL: {cert_url}")
+
+
+def _trusted_roots() -> Dict[Any, List[Any]]:
+    """Trusted root certificates, indexed by subject."""
+    global _roots
+    if _roots is None:
+        if PAYPAL_CERT_CA_FILE:
+            path = PAYPAL_CERT_CA_FILE
+        else:
+            import certifi
+            path = certifi.where()
+        with open(path, "rb") as f, warnings.catch_warnings():
+            # Public bundles still carry a few legacy roots cryptography warns about
+            warnings.simplefilter("ignore")
+            certs = x509.load_pem_x509_certificates(f.read())
+        roots: Dict[Any, List[Any]] = {}
+        for cert in certs:
+            roots.setdefault(cert.subject, []).append(cert)
+        _roots = roots
+    return _roots
+
+
+def _check_issuer(cert: Any, depth: int) -> None:
+    """
+    Check that ``cert`` may issue certificates.
+
+    Args:
+        depth: Number of CA certificates between ``cert`` and the leaf
+    """
+    subject = cert.subject.rfc4514_string()
+    try:
+        constraints = cert.extensions.get_extension_for_class(x509.BasicConstraints).value
+    except x509.ExtensionNotFound:
+        constraints = None
+    if constraints is None or not constraints.ca:
+        raise WebhookVerificationError(f"Certificate {subject} is not a CA")
+    if constraints.path_length is not None and depth > constraints.path_length:
+        raise WebhookVerificationError(f"Certificate {subject} exceeds its path length")
+    try:
+        usage = cert.extensions.get_extension_for_class(x509.KeyUsage).value
+    except x509.ExtensionNotFound:
+        return
+    if not usage.key_cert_sign:
+        raise WebhookVerificationError(f"Certificate {subject} may not sign certificates")
+
+
+def _validate_chain(chain: List[Any]) -> None:
+    """
+    Check validity dates, subject, issuer constraints and signatures from the
+    leaf up to a trusted root.
+    """
+    now = datetime.now(timezone.utc)
+    for cert in chain:
+        if not cert.not_valid_before_utc <= now <= cert.not_valid_after_utc:
+            raise WebhookVerificationError(f"Certificate {cert.subject.rfc4514_string()} is expired or not yet valid")
+
+    leaf = chain[0]
+    names = [attr.value for attr in leaf.subject.get_attributes_for_oid(NameOID.COMMON_NAME)]
+    try:
+        names += leaf.extensions.get_extension_for_class(x509.SubjectAlternativeName).value.get_values_for_type(x509.DNSName)
+    except x509.ExtensionNotFound:
+        pass
+    if PAYPAL_CERT_SUBJECT not in names:
+        raise WebhookVerificationError(f"Certificate is not issued to {PAYPAL_CERT_SUBJECT}")
+
+    for depth, issuer in enumerate(chain[1:]):
+        _check_issuer(issuer, depth)
+
+    try:
+        for cert, issuer in zip(chain, chain[1:]):
+            cert.verify_directly_issued_by(issuer)
+    except (ValueError, TypeError, InvalidSignature) as exc:
+        raise WebhookVerificationError(f"Certificate chain is broken: {exc}")
+
+    top = chain[-1]
+    for root in _trusted_roots().get(top.issuer, []):
+        if root == top:
+            return
+        try:
+            top.verify_directly_issued_by(root)
+            return
+        except (ValueError, TypeError, InvalidSignature):
+            continue
+    raise WebhookVerificationError("Certificate chain does not end in a trusted root")
+
+
+def _fetch_cert(cert_url: str) -> _CachedCert:
+    response = requests.get(cert_url, timeout=10)
+    response.raise_for_status()
+    chain = x509.load_pem_x509_certificates(response.content)
+    _validate_chain(chain)
+    return _CachedCert(public_key=chain[0].public_key(), not_after=chain[0].not_valid_after_utc.timestamp())
+
+
+def _public_key(cert_url: str, api_base: Optional[str]) -> Any:
+    """Cached public key for ``cert_url``, fetched and validated on first use."""
+    now = time.time()
+    cached = _certs.get(cert_url)
+    if cached is not None and now < cached.not_after:
+        return cached.public_key
+
+    _check_cert_url(cert_url, api_base)
+    with _cert_lock:
+        cached = _certs.get(cert_url)
+        if cached is not None and now < cached.not_after:
+            return cached.public_key
+        if now - _failed_urls.get(cert_url, 0.0) < FAILED_CERT_RETRY_SECONDS:
+            raise WebhookVerificationError(f"Certificate {cert_url} recently failed validation")
+        try:
+            cached = _fetch_cert(cert_url)
+        except WebhookVerificationError:
+            _failed_urls[cert_url] = now
+            raise
+        except (requests.RequestException, ValueError) as exc:
+            _failed_urls[cert_url] = now
+            raise WebhookVerificationError(f"Could not load certificate {cert_url}: {exc}")
+
+        if len(_certs) >= MAX_CACHED_CERTS:
+            _certs.pop(min(_certs, key=lambda url: _certs[url].not_after))
+        _certs[cert_url] = cached
+        logger.info(f"Cached PayPal webhook certificate {cert_url}")
+        return cached.public_key
+
+
+def _header(headers: Mapping[str, str], name: str) -> str:
+    value = headers.get(name)
+    if not value:
+        raise WebhookVerificationError(f"Missing {name} header")
+    return value
+
+
+def _verify_local(headers: Mapping[str, str], raw_body: bytes, api_base: Optional[str]) -> None:
+    if _header(headers, "PAYPAL-AUTH-ALGO") != SUPPORTED_AUTH_ALGO:
+        raise WebhookVerificationError(f"Unsupported PAYPAL-AUTH-ALGO {headers.get('PAYPAL-AUTH-ALGO')}")
+    try:
+        signature = base64.b64decode(_header(headers, "PAYPAL-TRANSMISSION-SIG"), validate=True)
+    except binascii.Error:
+        raise WebhookVerificationError("PAYPAL-TRANSMISSION-SIG is not base64")
+
+    message = signed_message(
+        _header(headers, "PAYPAL-TRANSMISSION-ID"),
+        _header(headers, "PAYPAL-TRANSMISSION-TIME"),
+        PAYPAL_WEBHOOK_ID,
+        raw_body,
+    )
+    public_key = _public_key(_header(headers, "PAYPAL-CERT-URL"), api_base)
+    try:
+        public_key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+    except InvalidSignature:
+        raise WebhookVerificationError("Signature does not match")
+
+
+def _verify_api(headers: Mapping[str, str], event: Dict[str, Any], request_fn: RequestFn) -> None:
+    response = request_fn(
+        "POST",
+        "/v1/notifications/verify-webhook-signature",
+        data={
+            "auth_algo": _header(headers, "PAYPAL-AUTH-ALGO"),
+            "cert_url": _header(headers, "PAYPAL-CERT-URL"),
+            "transmission_id": _header(headers, "PAYPAL-TRANSMISSION-ID"),
+            "transmission_sig": _header(headers, "PAYPAL-TRANSMISSION-SIG"),
+            "transmission_time": _header(headers, "PAYPAL-TRANSMISSION-TIME"),
+            "webhook_id": PAYPAL_WEBHOOK_ID,
+            "webhook_event": event,
+        },
+    )
+    if response.get("verification_status") != "SUCCESS":
+        raise WebhookVerificationError("PayPal did not verify the signature")
+
+
+def verify(
+    headers: Mapping[str, str],
+    raw_body: bytes,
+    event: Dict[str, Any],
+    request_fn: RequestFn,
+    api_base: Optional[str] = None,
+) -> bool:
+    """
+    Check a webhook delivery's signature.
+
+    Args:
+        headers: Request headers (case-insensitive mapping)
+        raw_body: Body exactly as received (the CRC32 is taken over it)
+        event: Parsed body, for the verify API fallback
+        request_fn: Authenticated PayPal request function for the fallback
+        api_base: PayPal API base URL, also trusted to serve certificates
+
+    Returns:
+        bool: True if verified, False if unverified events are allowed and
+            verification is disabled
+
+    Raises:
+        WebhookVerificationError: If the delivery can't be trusted
+        WebhookNotConfigured: If verification is disabled and unverified
+            events aren't allowed
+    """
+    mode = verification_mode()
+    if mode == "unconfigured":
+        raise WebhookNotConfigured("PAYPAL_WEBHOOK_ID not set or PAYPAL_WEBHOOK_VERIFY=off")
+    if mode == "off":
+        return False
+    if mode == "local":
+        _verify_local(headers, raw_body, api_base)
+    else:
+        _verify_api(headers, event, request_fn)
+    return True
+
+
+def cache_info() -> Dict[str, Any]:
+    """Verification mode and cached certificates, for health checks."""
+    return {
+        "mode": verification_mode(),
+        "cached_certs": len(_certs),
+    }
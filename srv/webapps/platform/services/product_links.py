@@ -0,0 +1,407 @@
+# /srv/webapps/platform/services/product_links.py
+
+"""
+Links between Square catalog items and ``product_type_crop`` products.
+
+CSA recipes and hauls refer to produce by ``product_id`` / ``taxonomy_id``,
+while POS items only carry Square IDs and free-text names. This module maps
+each mirrored Square ITEM to a product once, stores the result in SQLite, and
+lets pages join live stock to products by ``product_id`` without any matching
+at request time.
+
+Matching uses an alias index built from data/product_type_crop.json: every
+product title and alias is normalised (lower case, accents folded, words
+singularised, joined with "_"). An item name is matched whole first; failing
+that, the longest run of consecutive words that is a known alias wins
+("Organic Cherry Tomatoes, pint" -> "cherry_tomato"). Titles beat aliases
+when two products claim the same key.
+
+``refresh`` relinks only items changed in the catalog mirror since the last
+run (``changes_since``), or everything when the product file changes. Links
+set by hand (``set_link``) are never overwritten. Run it from cron or by
+hand with::
+
+    python -m services.product_links link [--full]
+    python -m services.product_links set <item_id> <product_id|none>
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import time
+import unicodedata
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from data_access import PLATFORM_ROOT, load_json
+from services import square_catalog_mirror
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_PATH = PLATFORM_ROOT / "data" / "product_type_crop.json"
+
+# How often request handlers re-check the mirror for changed items
+REFRESH_SECONDS = 30
+
+# Longest run of words tried when matching part of an item name
+MAX_PHRASE_WORDS = 6
+
+METHOD_EXACT = "exact"
+METHOD_PHRASE = "phrase"
+METHOD_MANUAL = "manual"
+METHOD_NONE = "none"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS product_links (
+    item_id TEXT PRIMARY KEY,
+    product_id TEXT,
+    taxonomy_id TEXT,
+    method TEXT NOT NULL,
+    matched_key TEXT,
+    item_name TEXT,
+    variation_ids TEXT NOT NULL DEFAULT '[]',
+    linked_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_product_links_product ON product_links (product_id);
+CREATE TABLE IF NOT EXISTS link_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+@dataclass(frozen=True)
+class Product:
+    product_id: str
+    taxonomy_id: Optional[str]
+    title: str
+
+
+@dataclass(frozen=True)
+class Match:
+    product: Product
+    method: str
+    key: str
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("product_links", schema=_SCHEMA)
+
+
+def _get_state(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM link_state WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def _set_state(conn: sqlite3.Connection, key: str, value: Optional[str]) -> None:
+    conn.execute(
+        "INSERT INTO link_state (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value),
+    )
+
+
+def _singular(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("oes", "ches", "shes", "xes", "sses")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize_words(text: Optional[str]) -> List[str]:
+    """Lower-case, accent-folded, singularised words of a name or alias."""
+    if not text:
+        return []
+    folded = unicodedata.normalize("NFKD", text.replace("_", " "))
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch)).lower()
+    return [_singular(word) for word in _WORD_RE.findall(folded)]
+
+
+class AliasIndex:
+    """Normalised title/alias key -> product."""
+
+    def __init__(self, products: Iterable[Dict[str, Any]]):
+        self.keys: Dict[str, Product] = {}
+        self.products: Dict[str, Product] = {}
+        aliases: List[Tuple[str, Product]] = []
+        for entry in products:
+            if not entry.get("product_id"):
+                continue
+            product = Product(
+                product_id=str(entry["product_id"]),
+                taxonomy_id=entry.get("taxonomy_id"),
+                title=entry.get("title") or "",
+            )
+            self.products[product.product_id] = product
+            # Titles are registered first so they win over another product's alias.
+            key = "_".join(normalize_words(product.title))
+            if key:
+                self.keys.setdefault(key, product)
+            aliases.extend(
+                ("_".join(normalize_words(alias)), product) for alias in entry.get("alias") or []
+            )
+        for key, product in aliases:
+            if key:
+                self.keys.setdefault(key, product)
+
+    def match(self, name: Optional[str]) -> Optional[Match]:
+        """Match an item name: whole name first, then the longest known phrase."""
+        words = normalize_words(name)
+        if not words:
+            return None
+        whole = "_".join(words)
+        if whole in self.keys:
+            return Match(self.keys[whole], METHOD_EXACT, whole)
+        for size in range(min(len(words) - 1, MAX_PHRASE_WORDS), 0, -1):
+            for start in range(len(words) - size + 1):
+                key = "_".join(words[start:start + size])
+                if key in self.keys:
+                    return Match(self.keys[key], METHOD_PHRASE, key)
+        return None
+
+
+_alias_index: Optional[Tuple[str, AliasIndex]] = None
+
+
+def _products_fingerprint() -> str:
+    return hashlib.sha256(PRODUCTS_PATH.read_bytes()).hexdigest()
+
+
+def load_alias_index() -> Tuple[str, AliasIndex]:
+    """Return (fingerprint of product_type_crop.json, its alias index), cached per process."""
+    global _alias_index
+    fingerprint = _products_fingerprint()
+    if _alias_index is None or _alias_index[0] != fingerprint:
+        products = load_json(PRODUCTS_PATH).get("products") or []
+        _alias_index = (fingerprint, AliasIndex(products))
+    return _alias_index
+
+
+def _object_data(obj: Dict[str, Any]) -> Dict[str, Any]:
+    obj_type = obj.get("type") or ""
+    return obj.get(f"{obj_type.lower()}_data") or obj.get(obj_type) or {}
+
+
+def _variation_ids(objects: List[Dict[str, Any]]) -> List[str]:
+    item = objects[0]
+    data = _object_data(item)
+    ids = list(data.get("item_variation_ids") or [var.get("id") for var in data.get("variations") or []])
+    ids += [
+        obj["id"] for obj in objects[1:]
+        if obj.get("type") == "ITEM_VARIATION" and obj["id"] not in ids
+    ]
+    return [variation_id for variation_id in ids if variation_id]
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _link_rows(index: AliasIndex, item_ids: Iterable[str]) -> Tuple[List[Tuple[Any, ...]], List[str]]:
+    """Build link rows for live items; returns (rows, IDs of items no longer in the catalog)."""
+    rows = []
+    gone = []
+    now = _now_iso()
+    for item_id in item_ids:
+        objects = square_catalog_mirror.get_item_objects(item_id)
+        if not objects:
+            gone.append(item_id)
+            continue
+        name = _object_data(objects[0]).get("name")
+        match = index.match(name)
+        rows.append((
+            item_id,
+            match.product.product_id if match else None,
+            match.product.taxonomy_id if match else None,
+            match.method if match else METHOD_NONE,
+            match.key if match else None,
+            name,
+            json.dumps(_variation_ids(objects)),
+            now,
+        ))
+    return rows, gone
+
+
+def refresh(full: bool = False) -> Dict[str, Any]:
+    """
+    Bring the stored links up to date with the catalog mirror.
+
+    Args:
+        full: Relink every item (also done when product_type_crop.json changed)
+
+    Returns:
+        dict: ``{"mode", "linked", "unmatched", "removed"}`` for this run
+
+    Raises:
+        MirrorEmptyError: If the mirror has not completed a full sync
+    """
+    if not square_catalog_mirror.is_ready():
+        raise square_catalog_mirror.MirrorEmptyError("Square catalog mirror has not been synced yet")
+
+    fingerprint, index = load_alias_index()
+    conn = _connection()
+    seen_seq = int(_get_state(conn, "mirror_seq") or 0)
+    if _get_state(conn, "products_fingerprint") != fingerprint:
+        full = True
+
+    changes, latest = square_catalog_mirror.changes_since(0 if full else seen_seq)
+    if not full and latest < seen_seq:
+        # The mirror database was recreated.
+        full = True
+        changes, latest = square_catalog_mirror.changes_since(0)
+
+    item_ids = set()
+    for obj in changes:
+        if obj.get("type") == "ITEM":
+            item_ids.add(obj["id"])
+        elif obj.get("type") == "ITEM_VARIATION" and _object_data(obj).get("item_id"):
+            item_ids.add(_object_data(obj)["item_id"])
+
+    manual = {
+        row["item_id"]
+        for row in conn.execute("SELECT item_id FROM product_links WHERE method = ?", (METHOD_MANUAL,))
+    }
+    rows, gone = _link_rows(index, sorted(item_ids - manual))
+
+    with transaction(conn):
+        if full:
+            conn.execute("DELETE FROM product_links WHERE method != ?", (METHOD_MANUAL,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO product_links (item_id, product_id, taxonomy_id, method, "
+            "matched_key, item_name, variation_ids, linked_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.executemany("DELETE FROM product_links WHERE item_id = ?", [(item_id,) for item_id in gone])
+        _set_state(conn, "mirror_seq", str(latest))
+        _set_state(conn, "products_fingerprint", fingerprint)
+        _set_state(conn, "linked_at", _now_iso())
+
+    unmatched = sum(1 for row in rows if row[1] is None)
+    if rows or gone:
+        logger.info(
+            f"Product links {'rebuilt' if full else 'updated'}: {len(rows)} items "
+            f"({unmatched} unmatched), {len(gone)} removed"
+        )
+    return {
+        "mode": "full" if full else "incremental",
+        "linked": len(rows) - unmatched,
+        "unmatched": unmatched,
+        "removed": len(gone),
+    }
+
+
+_refreshed_at = 0.0
+
+
+def refresh_if_due(max_age_seconds: float = REFRESH_SECONDS) -> None:
+    """Run ``refresh`` at most every ``max_age_seconds`` in this process."""
+    global _refreshed_at
+    now = time.monotonic()
+    if now - _refreshed_at < max_age_seconds:
+        return
+    _refreshed_at = now
+    refresh()
+
+
+def set_link(item_id: str, product_id: Optional[str]) -> None:
+    """
+    Pin an item to a product by hand (``None`` pins it as "no product").
+
+    Raises:
+        KeyError: If ``product_id`` is not in product_type_crop.json
+    """
+    _, index = load_alias_index()
+    product = None
+    if product_id is not None:
+        product = index.products.get(product_id)
+        if product is None:
+            raise KeyError(f"Unknown product_id: {product_id}")
+
+    objects = square_catalog_mirror.get_item_objects(item_id) or []
+    conn = _connection()
+    with transaction(conn):
+        conn.execute(
+            "INSERT OR REPLACE INTO product_links (item_id, product_id, taxonomy_id, method, "
+            "matched_key, item_name, variation_ids, linked_at) VALUES (?, ?, ?, ?, NULL, ?, ?, ?)",
+            (
+                item_id,
+                product.product_id if product else None,
+                product.taxonomy_id if product else None,
+                METHOD_MANUAL,
+                _object_data(objects[0]).get("name") if objects else None,
+                json.dumps(_variation_ids(objects) if objects else []),
+                _now_iso(),
+            ),
+        )
+
+
+def links_by_product(product_ids: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Return linked items grouped by product.
+
+    Args:
+        product_ids: Optional subset of products to return
+
+    Returns:
+        dict: ``{product_id: [{"item_id", "name", "taxonomy_id", "method",
+        "variation_ids"}, ...]}``
+    """
+    conn = _connection()
+    query = "SELECT * FROM product_links WHERE product_id IS NOT NULL"
+    params: List[str] = []
+    if product_ids:
+        query += f" AND product_id IN ({', '.join('?' * len(product_ids))})"
+        params = list(product_ids)
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for row in conn.execute(query + " ORDER BY product_id, item_name", params):
+        grouped.setdefault(row["product_id"], []).append({
+            "item_id": row["item_id"],
+            "name": row["item_name"],
+            "taxonomy_id": row["taxonomy_id"],
+            "method": row["method"],
+            "variation_ids": json.loads(row["variation_ids"]),
+        })
+    return grouped
+
+
+def stats() -> Dict[str, Any]:
+    conn = _connection()
+    counts = {
+        row["method"]: row["n"]
+        for row in conn.execute("SELECT method, COUNT(*) AS n FROM product_links GROUP BY method")
+    }
+    return {"by_method": counts, "linked_at": _get_state(conn, "linked_at")}
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Link Square items to product_type_crop products")
+    commands = parser.add_subparsers(dest="command", required=True)
+    link = commands.add_parser("link", help="relink items changed since the last run")
+    link.add_argument("--full", action="store_true", help="relink every item")
+    pin = commands.add_parser("set", help="pin an item to a product by hand")
+    pin.add_argument("item_id")
+    pin.add_argument("product_id", help='product_id, or "none" for no product')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "link":
+        print(json.dumps(refresh(full=args.full)))
+    else:
+        set_link(args.item_id, None if args.product_id == "none" else args.product_id)
+
+
+if __name__ == "__main__":
+    main()
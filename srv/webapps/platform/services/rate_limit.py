@@ -0,0 +1,251 @@
+# /srv/webapps/platform/services/rate_limit.py
+
+"""
+Outbound rate limiting and retry for calls to third-party APIs.
+
+Each upstream credential gets a token bucket kept in SQLite, so every gunicorn
+worker draws from the same budget: ``rate`` tokens per second, up to ``burst``
+saved. A call takes one token, sleeping until one is available. When the
+provider answers 429 anyway, the bucket is blocked until its ``Retry-After``
+passes, so the other workers back off too instead of piling on.
+
+``send_with_retry`` wraps one HTTP call with the limiter and retries:
+
+- 429 is always retried (the provider rejected the call without acting on it),
+- 5xx responses, timeouts and connection errors only when ``idempotent``,
+
+with full-jitter exponential backoff, or the provider's ``Retry-After`` when
+given. Waits longer than ``RETRY_MAX_DELAY_SECONDS`` are not slept through;
+the last response is returned instead.
+
+A call made while serving a web request also gets a ``deadline``
+(``REQUEST_DEADLINE_SECONDS``): token waits and HTTP timeouts are cut to the
+time left, and no retry starts that wouldn't fit, so the whole call ends
+within about that long instead of up to several 30-second attempts.
+
+If the state database is unavailable the limiter lets calls through.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+import requests
+
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.25"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "8"))
+
+# Longest a call waits for a token before giving up
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "10"))
+
+# Overall budget, retries included, for a call made while serving a web request
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "8"))
+
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    bucket TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+"""
+
+
+class RateLimitExceeded(Exception):
+    """Raised when no token becomes available within the allowed wait."""
+
+    def __init__(self, bucket: str, retry_after: float):
+        super().__init__(f"Rate limit for {bucket} exhausted; retry in {retry_after:.1f}s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("rate_limits", schema=_SCHEMA)
+
+
+def bucket_name(upstream: str, credential: Optional[str]) -> str:
+    """
+    Name the bucket for an upstream and credential.
+
+    Only a short hash of the credential is stored, never the secret itself.
+    """
+    digest = hashlib.sha256((credential or "").encode("utf-8")).hexdigest()[:12]
+    return f"{upstream}:{digest}"
+
+
+def _take(bucket: str, rate: float, burst: float, now: float) -> float:
+    """Try to take a token. Returns 0 on success, else seconds to wait."""
+    conn = _connection()
+    with transaction(conn):
+        row = conn.execute(
+            "SELECT tokens, updated_at, blocked_until FROM buckets WHERE bucket = ?", (bucket,)
+        ).fetchone()
+        if row is None:
+            tokens, blocked_until = float(burst), 0.0
+        else:
+            elapsed = max(0.0, now - row["updated_at"])
+            tokens = min(float(burst), row["tokens"] + elapsed * rate)
+            blocked_until = row["blocked_until"]
+
+        if now < blocked_until:
+            wait = blocked_until - now
+        elif tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / rate
+
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (bucket, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)",
+            (bucket, tokens, now, blocked_until),
+        )
+    return wait
+
+
+def acquire(bucket: str, rate: float, burst: float, max_wait: float = RATE_LIMIT_MAX_WAIT_SECONDS) -> None:
+    """
+    Take one token from ``bucket``, sleeping until one is available.
+
+    Raises:
+        RateLimitExceeded: If no token is available within ``max_wait`` seconds
+    """
+    deadline = time.monotonic() + max_wait
+    while True:
+        try:
+            wait = _take(bucket, rate, burst, time.time())
+        except sqlite3.Error:
+            logger.warning(f"Rate limit state unavailable, not limiting {bucket}", exc_info=True)
+            return
+        if wait <= 0:
+            return
+        remaining = deadline - time.monotonic()
+        if wait > remaining:
+            raise RateLimitExceeded(bucket, wait)
+        time.sleep(wait)
+
+
+def block(bucket: str, seconds: float) -> None:
+    """Stop every worker from using ``bucket`` for ``seconds`` (after a 429)."""
+    now = time.time()
+    try:
+        conn = _connection()
+        with transaction(conn):
+            conn.execute(
+                "INSERT INTO buckets (bucket, tokens, updated_at, blocked_until) VALUES (?, 0, ?, ?) "
+                "ON CONFLICT(bucket) DO UPDATE SET tokens = 0, updated_at = excluded.updated_at, "
+                "blocked_until = MAX(buckets.blocked_until, excluded.blocked_until)",
+                (bucket, now, now + seconds),
+            )
+    except sqlite3.Error:
+        logger.warning(f"Rate limit state unavailable, not blocking {bucket}", exc_info=True)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a ``Retry-After`` header (seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for retry ``attempt`` (1-based)."""
+    ceiling = min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * (2 ** (attempt - 1)))
+    return random.uniform(0, ceiling)
+
+
+def send_with_retry(
+    send: Callable[[float], requests.Response],
+    bucket: str,
+    rate: float,
+    burst: float,
+    idempotent: bool,
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+    timeout: float = 30,
+    deadline: Optional[float] = None,
+) -> requests.Response:
+    """
+    Perform ``send()`` under the rate limiter, retrying throttled/failed calls.
+
+    Args:
+        send: Performs the HTTP call with the given timeout in seconds and
+            returns the response (no raise_for_status)
+        bucket: Bucket name from ``bucket_name``
+        rate: Sustained calls per second allowed for the bucket
+        burst: Calls that may be made back to back after an idle period
+        idempotent: Whether 5xx responses and network errors may be retried
+        max_attempts: Total attempts, including the first
+        timeout: HTTP timeout of one attempt
+        deadline: Seconds the whole call may take, waits and retries
+            included (None: only ``max_attempts`` limits it)
+
+    Returns:
+        requests.Response: The first non-retryable response, or the last one
+
+    Raises:
+        RateLimitExceeded: If the limiter can't supply a token in time
+        requests.RequestException: Network errors that can't be retried
+    """
+    expires = None if deadline is None else time.monotonic() + deadline
+
+    def remaining() -> float:
+        return float("inf") if expires is None else max(0.0, expires - time.monotonic())
+
+    attempt = 0
+    while True:
+        attempt += 1
+        acquire(bucket, rate, burst, max_wait=min(RATE_LIMIT_MAX_WAIT_SECONDS, remaining()))
+        try:
+            # A token wait may use up the budget; requests rejects a zero timeout
+            response = send(max(0.5, min(timeout, remaining())))
+        except (requests.ConnectionError, requests.Timeout):
+            if not idempotent or attempt >= max_attempts:
+                raise
+            delay = backoff_delay(attempt)
+            if delay >= remaining():
+                raise
+            logger.info(f"Retrying {bucket} after network error (attempt {attempt}) in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+
+        status = response.status_code
+        if status not in RETRYABLE_STATUSES:
+            return response
+
+        if status != 429 and not idempotent:
+            return response
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        delay = retry_after if retry_after is not None else backoff_delay(attempt)
+        if status == 429:
+            block(bucket, delay)
+        if attempt >= max_attempts or delay > RETRY_MAX_DELAY_SECONDS or delay >= remaining():
+            return response
+
+        logger.info(f"Retrying {bucket} after HTTP {status} (attempt {attempt}) in {delay:.2f}s")
+        time.sleep(delay)
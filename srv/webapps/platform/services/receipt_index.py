@@ -0,0 +1,244 @@
+# /srv/webapps/platform/services/receipt_index.py
+
+"""
+Queryable index of the donation receipt files.
+
+Receipts stay in each client's JSON file (modules/donation_receipts.py); this
+module keeps a copy of every receipt in the ``receipt_index`` SQLite database
+with the fields admin views filter on (recorded_at, donor email, designation,
+provider, amount) indexed, so ``GET /api/donation-receipts`` can return one
+filtered page without reading the file.
+
+The index follows the files:
+
+- receipts the blueprint appends are added with ``record``;
+- each file's size and mtime are stored with its rows, and a query against a
+  file that changed some other way (hand edits, restores) first rebuilds that
+  file's rows with ``reindex``.
+
+Pages are newest first. The cursor is opaque to clients; it encodes the
+``(recorded_at, seq)`` of the last receipt returned, ``seq`` being the
+receipt's position in its file.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import json
+import logging
+import os
+import sqlite3
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from services.donation_rollups import to_minor
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipt_files (
+    client TEXT NOT NULL,
+    source TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (client, source)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS receipts (
+    client TEXT NOT NULL,
+    source TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    recorded_at TEXT NOT NULL,
+    donor_email TEXT,
+    designation TEXT,
+    provider TEXT,
+    amount_minor INTEGER,
+    receipt TEXT NOT NULL,
+    PRIMARY KEY (client, source, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS receipts_recorded ON receipts (client, source, recorded_at, seq);
+CREATE INDEX IF NOT EXISTS receipts_donor ON receipts (client, source, donor_email, recorded_at, seq);
+CREATE INDEX IF NOT EXISTS receipts_designation ON receipts (client, source, designation, recorded_at, seq);
+CREATE INDEX IF NOT EXISTS receipts_provider ON receipts (client, source, provider, recorded_at, seq);
+"""
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("receipt_index", schema=_SCHEMA)
+
+
+def _row(client: str, source: str, seq: int, receipt: Dict[str, Any]) -> Tuple[Any, ...]:
+    donor = receipt.get("donor") if isinstance(receipt.get("donor"), dict) else {}
+    try:
+        amount_minor = to_minor(receipt.get("amount"))
+    except ValueError:
+        amount_minor = None
+    return (
+        client,
+        source,
+        seq,
+        str(receipt.get("recorded_at") or ""),
+        str(donor.get("email") or "").strip().lower() or None,
+        receipt.get("designation") or None,
+        receipt.get("provider") or None,
+        amount_minor,
+        json.dumps(receipt),
+    )
+
+
+def _insert(conn: sqlite3.Connection, rows: Sequence[Tuple[Any, ...]]) -> None:
+    conn.executemany(
+        "INSERT OR REPLACE INTO receipts (client, source, seq, recorded_at, donor_email, designation, provider, "
+        "amount_minor, receipt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def _save_file_state(conn: sqlite3.Connection, client: str, source: str, stat: os.stat_result, count: int) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO receipt_files (client, source, mtime_ns, size, count) VALUES (?, ?, ?, ?, ?)",
+        (client, source, stat.st_mtime_ns, stat.st_size, count),
+    )
+
+
+def is_current(client: str, source: str, stat: Optional[os.stat_result]) -> bool:
+    """
+    Whether the indexed rows match the file as it is now.
+
+    Args:
+        stat: ``os.stat`` of the receipts file, or None if it doesn't exist
+    """
+    row = _connection().execute(
+        "SELECT mtime_ns, size FROM receipt_files WHERE client = ? AND source = ?", (client, source)
+    ).fetchone()
+    if stat is None:
+        return row is None
+    return row is not None and (row["mtime_ns"], row["size"]) == (stat.st_mtime_ns, stat.st_size)
+
+
+def reindex(client: str, source: str, receipts: List[Any], stat: Optional[os.stat_result]) -> int:
+    """
+    Replace a file's indexed rows with ``receipts``.
+
+    Args:
+        stat: ``os.stat`` of the file taken before it was read (None if the
+            file doesn't exist), so a write racing the read is caught next time
+
+    Returns:
+        int: Receipts indexed
+    """
+    rows = [_row(client, source, seq, receipt) for seq, receipt in enumerate(receipts) if isinstance(receipt, dict)]
+    conn = _connection()
+    with transaction(conn):
+        conn.execute("DELETE FROM receipts WHERE client = ? AND source = ?", (client, source))
+        conn.execute("DELETE FROM receipt_files WHERE client = ? AND source = ?", (client, source))
+        _insert(conn, rows)
+        if stat is not None:
+            _save_file_state(conn, client, source, stat, len(receipts))
+    logger.info(f"Reindexed {len(rows)} receipts for {client}/{source}")
+    return len(rows)
+
+
+def record(client: str, source: str, first_seq: int, receipts: List[Dict[str, Any]], stat: os.stat_result) -> None:
+    """
+    Add receipts just appended to their file, starting at position ``first_seq``.
+
+    The file is only marked current if the index already held every earlier
+    receipt; otherwise the next query reindexes it.
+    """
+    conn = _connection()
+    with transaction(conn):
+        _insert(conn, [_row(client, source, first_seq + i, receipt) for i, receipt in enumerate(receipts)])
+        row = conn.execute(
+            "SELECT count FROM receipt_files WHERE client = ? AND source = ?", (client, source)
+        ).fetchone()
+        if (row["count"] if row else 0) == first_seq:
+            _save_file_state(conn, client, source, stat, first_seq + len(receipts))
+
+
+def encode_cursor(recorded_at: str, seq: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([recorded_at, seq]).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Raises ValueError for a cursor this module didn't produce."""
+    try:
+        recorded_at, seq = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(recorded_at, str) or not isinstance(seq, int):
+        raise ValueError("Invalid cursor")
+    return recorded_at, seq
+
+
+def query(
+    client: str,
+    source: str,
+    day_from: Optional[date] = None,
+    day_to: Optional[date] = None,
+    donor_email: Optional[str] = None,
+    designation: Optional[str] = None,
+    provider: Optional[str] = None,
+    min_amount: Optional[Any] = None,
+    max_amount: Optional[Any] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of a file's receipts, newest first.
+
+    Args:
+        day_from: First recorded day (UTC), inclusive
+        day_to: Last recorded day (UTC), inclusive
+        donor_email: Exact donor email, case-insensitive
+        min_amount: Smallest amount, inclusive
+        max_amount: Largest amount, inclusive
+        limit: Page size, at most MAX_PAGE_SIZE
+        cursor: ``next_cursor`` from the previous page
+
+    Returns:
+        tuple: Receipts and the cursor for the next page (None on the last)
+
+    Raises:
+        ValueError: For an invalid amount, limit or cursor
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    sql = "SELECT seq, recorded_at, receipt FROM receipts WHERE client = ? AND source = ?"
+    params: List[Any] = [client, source]
+    if donor_email:
+        sql += " AND donor_email = ?"
+        params.append(donor_email.strip().lower())
+    if designation:
+        sql += " AND designation = ?"
+        params.append(designation)
+    if provider:
+        sql += " AND provider = ?"
+        params.append(provider)
+    if day_from:
+        sql += " AND recorded_at >= ?"
+        params.append(day_from.isoformat())
+    if day_to:
+        sql += " AND recorded_at < ?"
+        params.append((day_to + timedelta(days=1)).isoformat())
+    if min_amount is not None:
+        sql += " AND amount_minor >= ?"
+        params.append(to_minor(min_amount))
+    if max_amount is not None:
+        sql += " AND amount_minor <= ?"
+        params.append(to_minor(max_amount))
+    if cursor:
+        sql += " AND (recorded_at, seq) < (?, ?)"
+        params.extend(decode_cursor(cursor))
+    sql += " ORDER BY recorded_at DESC, seq DESC LIMIT ?"
+    params.append(limit + 1)
+
+    rows = _connection().execute(sql, params).fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]["recorded_at"], rows[limit - 1]["seq"]) if len(rows) > limit else None
+    return [json.loads(row["receipt"]) for row in rows[:limit]], next_cursor
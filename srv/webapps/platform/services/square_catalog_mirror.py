@@ -0,0 +1,492 @@
+# /srv/webapps/platform/services/square_catalog_mirror.py
+
+"""
+Local SQLite mirror of the Square catalog.
+
+The catalog changes a few times a day, so instead of calling
+``/v2/catalog/list`` on every request the platform keeps a mirror:
+
+- ``full_sync`` walks ``/v2/catalog/list`` once and replaces the mirror.
+- ``incremental_sync`` asks ``/v2/catalog/search`` for objects changed since
+  the last sync (``begin_time`` + ``include_deleted_objects``), so deletes are
+  mirrored too.
+- ``refresh_in_background`` starts an incremental sync from a daemon thread
+  when the mirror is older than ``SQUARE_CATALOG_SYNC_SECONDS``; one worker at
+  a time holds the sync lease (services/leased_worker.py) and renews it page
+  by page, so a slow sync is never joined by a second one.
+
+Reads (``query_item_page``, ``get_item_objects``) return raw Square objects
+so callers shape them exactly like live responses. Every stored change bumps
+a sequence number, which lets derived indexes catch up incrementally
+(``changes_since``).
+
+Sync functions take the caller's Square request function
+(``modules.square_inventory._make_square_request``) so this module does not
+import the blueprint. Run a sync from cron or by hand with::
+
+    python -m services.square_catalog_mirror sync [--full]
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from services.leased_worker import Lease
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+SQUARE_CATALOG_MIRROR_ENABLED = os.getenv("SQUARE_CATALOG_MIRROR", "1") == "1"
+SQUARE_CATALOG_SYNC_SECONDS = int(os.getenv("SQUARE_CATALOG_SYNC_SECONDS", "300"))
+
+# Object types the mirror keeps.
+MIRRORED_TYPES = ["ITEM", "ITEM_VARIATION", "CATEGORY", "IMAGE"]
+
+# A sync lease older than this is considered abandoned (crashed worker). It
+# is renewed before every page, so it only has to outlast one page request.
+SYNC_LEASE_SECONDS = 120
+
+RequestFn = Callable[..., Dict[str, Any]]
+
+# renew() -> False once the sync lease has passed to another worker
+RenewFn = Callable[[], bool]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_objects (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    version INTEGER,
+    updated_at TEXT,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    item_id TEXT,
+    category_id TEXT,
+    name TEXT,
+    present_at_all_locations INTEGER NOT NULL DEFAULT 1,
+    present_at_location_ids TEXT NOT NULL DEFAULT '[]',
+    absent_at_location_ids TEXT NOT NULL DEFAULT '[]',
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_catalog_type_id ON catalog_objects (type, is_deleted, id);
+CREATE INDEX IF NOT EXISTS idx_catalog_item ON catalog_objects (item_id);
+CREATE INDEX IF NOT EXISTS idx_catalog_category ON catalog_objects (category_id);
+CREATE INDEX IF NOT EXISTS idx_catalog_seq ON catalog_objects (seq);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class MirrorEmptyError(Exception):
+    """Raised when the mirror is read before its first full sync."""
+    pass
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("square_catalog", schema=_SCHEMA)
+
+
+def _now_iso() -> str:
+    """Current time in Square's RFC 3339 form (millisecond precision)."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _get_state(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def _set_state(conn: sqlite3.Connection, key: str, value: Optional[str]) -> None:
+    conn.execute(
+        "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value),
+    )
+
+
+def _object_data(obj: Dict[str, Any]) -> Dict[str, Any]:
+    obj_type = obj.get("type") or ""
+    return obj.get(f"{obj_type.lower()}_data") or obj.get(obj_type) or {}
+
+
+def _row_for(obj: Dict[str, Any], seq: int) -> Tuple[Any, ...]:
+    data = _object_data(obj)
+    return (
+        obj["id"],
+        obj.get("type"),
+        obj.get("version"),
+        obj.get("updated_at"),
+        1 if obj.get("is_deleted") else 0,
+        data.get("item_id"),
+        data.get("category_id"),
+        data.get("name"),
+        0 if obj.get("present_at_all_locations") is False else 1,
+        json.dumps(obj.get("present_at_location_ids") or []),
+        json.dumps(obj.get("absent_at_location_ids") or []),
+        seq,
+        json.dumps(obj),
+    )
+
+
+def _upsert(conn: sqlite3.Connection, objects: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Store objects inside the caller's transaction; returns the ones that changed.
+
+    Objects whose version and deletion flag match the stored row are skipped
+    so repeated syncs over the same window don't bump the sequence.
+    """
+    objects = [obj for obj in objects if obj.get("id")]
+    stored: Dict[str, Tuple[Any, int]] = {}
+    ids = [obj["id"] for obj in objects]
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        for row in conn.execute(
+            f"SELECT id, version, is_deleted FROM catalog_objects WHERE id IN ({placeholders})",
+            chunk,
+        ):
+            stored[row["id"]] = (row["version"], row["is_deleted"])
+
+    seq = int(_get_state(conn, "seq") or 0)
+    rows = []
+    changed = []
+    for obj in objects:
+        current = stored.get(obj["id"])
+        if current and obj.get("version") is not None and current == (
+            obj.get("version"), 1 if obj.get("is_deleted") else 0
+        ):
+            continue
+        seq += 1
+        rows.append(_row_for(obj, seq))
+        changed.append(obj)
+    if rows:
+        conn.executemany(
+            "INSERT OR REPLACE INTO catalog_objects (id, type, version, updated_at, is_deleted, "
+            "item_id, category_id, name, present_at_all_locations, present_at_location_ids, "
+            "absent_at_location_ids, seq, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        _set_state(conn, "seq", str(seq))
+    return changed
+
+
+def _lease_lost(renew: Optional[RenewFn], mode: str) -> bool:
+    if renew is None or renew():
+        return False
+    logger.warning(f"Square catalog mirror {mode} sync abandoned: another worker took the sync lease")
+    return True
+
+
+def full_sync(request_fn: RequestFn, renew: Optional[RenewFn] = None) -> Optional[Dict[str, Any]]:
+    """
+    Rebuild the mirror from ``/v2/catalog/list``.
+
+    Objects missing from the listing are marked deleted. The incremental
+    watermark is set to the time the listing started.
+
+    Args:
+        renew: Renews the caller's sync lease; called before every page and
+            before writing. Returns None without writing once it fails.
+    """
+    started_at = _now_iso()
+    objects: List[Dict[str, Any]] = []
+    cursor = None
+    while True:
+        if _lease_lost(renew, "full"):
+            return None
+        request_data: Dict[str, Any] = {"types": MIRRORED_TYPES}
+        if cursor:
+            request_data["cursor"] = cursor
+        page = request_fn("POST", "/v2/catalog/list", data=request_data)
+        objects.extend(page.get("objects", []))
+        cursor = page.get("cursor")
+        if not cursor:
+            break
+
+    if _lease_lost(renew, "full"):
+        return None
+    conn = _connection()
+    with transaction(conn):
+        seen = {obj.get("id") for obj in objects}
+        stale = [
+            json.loads(row["data"])
+            for row in conn.execute("SELECT id, data FROM catalog_objects WHERE is_deleted = 0")
+            if row["id"] not in seen
+        ]
+        for obj in stale:
+            obj["is_deleted"] = True
+        changed = _upsert(conn, objects + stale)
+        _set_state(conn, "begin_time", started_at)
+        _set_state(conn, "last_full_sync_at", started_at)
+        _set_state(conn, "last_sync_at", started_at)
+
+    logger.info(f"Square catalog mirror full sync: {len(objects)} objects, {len(stale)} removed")
+    return {"mode": "full", "objects": len(changed), "deleted": len(stale), "synced_at": started_at}
+
+
+def incremental_sync(request_fn: RequestFn, renew: Optional[RenewFn] = None) -> Optional[Dict[str, Any]]:
+    """
+    Apply catalog changes since the last sync via ``/v2/catalog/search``.
+
+    Falls back to ``full_sync`` when the mirror has never been filled.
+    ``renew`` works as for ``full_sync``.
+    """
+    conn = _connection()
+    begin_time = _get_state(conn, "begin_time")
+    if not begin_time:
+        return full_sync(request_fn, renew)
+
+    started_at = _now_iso()
+    objects: List[Dict[str, Any]] = []
+    latest_time = None
+    cursor = None
+    while True:
+        if _lease_lost(renew, "incremental"):
+            return None
+        request_data: Dict[str, Any] = {
+            "object_types": MIRRORED_TYPES,
+            "include_deleted_objects": True,
+            "begin_time": begin_time,
+        }
+        if cursor:
+            request_data["cursor"] = cursor
+        page = request_fn("POST", "/v2/catalog/search", data=request_data)
+        objects.extend(page.get("objects", []))
+        latest_time = page.get("latest_time") or latest_time
+        cursor = page.get("cursor")
+        if not cursor:
+            break
+
+    if _lease_lost(renew, "incremental"):
+        return None
+    with transaction(conn):
+        changed = _upsert(conn, objects)
+        # Square's latest_time is the newest change it knows about; fall back to
+        # our own clock when it isn't reported.
+        _set_state(conn, "begin_time", latest_time or started_at)
+        _set_state(conn, "last_sync_at", started_at)
+
+    deleted = sum(1 for obj in changed if obj.get("is_deleted"))
+    if changed:
+        logger.info(f"Square catalog mirror incremental sync: {len(changed)} changed, {deleted} deleted")
+    return {"mode": "incremental", "objects": len(changed), "deleted": deleted, "synced_at": started_at}
+
+
+_sync_lease = Lease(_connection, "sync_state", "sync_lease", SYNC_LEASE_SECONDS)
+
+
+def sync(request_fn: RequestFn, full: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Run a sync under the cross-worker lease, renewing it page by page.
+
+    Returns None if another worker holds the lease or takes it over midway.
+    """
+    owner = uuid.uuid4().hex
+    if not _sync_lease.acquire(owner):
+        return None
+    renew = functools.partial(_sync_lease.acquire, owner)
+    try:
+        return full_sync(request_fn, renew) if full else incremental_sync(request_fn, renew)
+    finally:
+        _sync_lease.release(owner)
+
+
+def is_stale(max_age_seconds: int = SQUARE_CATALOG_SYNC_SECONDS) -> bool:
+    """True when the last successful sync is older than ``max_age_seconds``."""
+    last = _get_state(_connection(), "last_sync_at")
+    if not last:
+        return True
+    synced = datetime.strptime(last, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - synced).total_seconds() > max_age_seconds
+
+
+def is_ready() -> bool:
+    """True once a full sync has completed."""
+    return bool(_get_state(_connection(), "last_full_sync_at"))
+
+
+def last_synced_at() -> Optional[str]:
+    return _get_state(_connection(), "last_sync_at")
+
+
+_refresh_thread: Optional[threading.Thread] = None
+
+
+def refresh_in_background(request_fn: RequestFn) -> bool:
+    """
+    Start an incremental sync on a daemon thread if the mirror is stale.
+
+    Returns True if a refresh was started by this call.
+    """
+    global _refresh_thread
+    if _refresh_thread is not None and _refresh_thread.is_alive():
+        return False
+    if not is_stale():
+        return False
+
+    def run() -> None:
+        try:
+            sync(request_fn)
+        except Exception as exc:
+            # The mirror keeps serving its last good state.
+            logger.warning(f"Square catalog mirror refresh failed: {exc}")
+
+    _refresh_thread = threading.Thread(target=run, name="square-catalog-sync", daemon=True)
+    _refresh_thread.start()
+    return True
+
+
+_LOCATION_FILTER = (
+    "((o.present_at_all_locations = 1 AND NOT EXISTS "
+    "(SELECT 1 FROM json_each(o.absent_at_location_ids) WHERE value = :{param})) "
+    "OR EXISTS (SELECT 1 FROM json_each(o.present_at_location_ids) WHERE value = :{param}))"
+)
+
+
+def _related_objects(conn: sqlite3.Connection, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Load the live variations, categories and images referenced by ``items``."""
+    if not items:
+        return []
+    item_ids = [item["id"] for item in items]
+    related_ids = set()
+    for item in items:
+        data = _object_data(item)
+        if data.get("category_id"):
+            related_ids.add(data["category_id"])
+        related_ids.update(data.get("image_ids") or [])
+
+    objects = []
+    placeholders = ", ".join("?" * len(item_ids))
+    for row in conn.execute(
+        f"SELECT data FROM catalog_objects WHERE type = 'ITEM_VARIATION' AND is_deleted = 0 "
+        f"AND item_id IN ({placeholders})",
+        item_ids,
+    ):
+        objects.append(json.loads(row["data"]))
+    if related_ids:
+        placeholders = ", ".join("?" * len(related_ids))
+        for row in conn.execute(
+            f"SELECT data FROM catalog_objects WHERE is_deleted = 0 AND id IN ({placeholders})",
+            list(related_ids),
+        ):
+            objects.append(json.loads(row["data"]))
+    return objects
+
+
+def query_item_page(
+    location_id: Optional[str] = None,
+    category_id: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    location_ids: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Return one page of live ITEM objects plus their related objects.
+
+    Pages are ordered by object ID; ``cursor`` is the last ID of the previous
+    page. ``location_ids`` keeps items present at any of the given locations
+    (``location_id`` is shorthand for a single one).
+
+    Returns:
+        tuple: (raw objects for the page, cursor for the next page or None)
+
+    Raises:
+        MirrorEmptyError: If no full sync has completed yet
+    """
+    if not is_ready():
+        raise MirrorEmptyError("Square catalog mirror has not been synced yet")
+
+    conn = _connection()
+    clauses = ["o.type = 'ITEM'", "o.is_deleted = 0"]
+    params: Dict[str, Any] = {"limit": limit + 1}
+    if cursor:
+        clauses.append("o.id > :cursor")
+        params["cursor"] = cursor
+    if category_id:
+        clauses.append("o.category_id = :category_id")
+        params["category_id"] = category_id
+    locations = list(location_ids or ([location_id] if location_id else []))
+    if locations:
+        filters = []
+        for index, value in enumerate(locations):
+            filters.append(_LOCATION_FILTER.format(param=f"location_{index}"))
+            params[f"location_{index}"] = value
+        clauses.append(f"({' OR '.join(filters)})")
+
+    rows = conn.execute(
+        f"SELECT o.id, o.data FROM catalog_objects o WHERE {' AND '.join(clauses)} "
+        "ORDER BY o.id LIMIT :limit",
+        params,
+    ).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]["id"]
+
+    items = [json.loads(row["data"]) for row in rows]
+    return items + _related_objects(conn, items), next_cursor
+
+
+def get_item_objects(item_id: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Return a live ITEM and its related objects, or None if it isn't mirrored.
+
+    Raises:
+        MirrorEmptyError: If no full sync has completed yet
+    """
+    if not is_ready():
+        raise MirrorEmptyError("Square catalog mirror has not been synced yet")
+
+    conn = _connection()
+    row = conn.execute(
+        "SELECT data FROM catalog_objects WHERE id = ? AND type = 'ITEM' AND is_deleted = 0",
+        (item_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    item = json.loads(row["data"])
+    return [item] + _related_objects(conn, [item])
+
+
+def changes_since(seq: int) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Return objects (including deletions) stored after sequence ``seq``.
+
+    Returns:
+        tuple: (raw objects in change order, latest sequence number)
+    """
+    conn = _connection()
+    rows = conn.execute(
+        "SELECT data, seq FROM catalog_objects WHERE seq > ? ORDER BY seq", (seq,)
+    ).fetchall()
+    latest = int(_get_state(conn, "seq") or 0)
+    return [json.loads(row["data"]) for row in rows], latest
+
+
+def main() -> None:
+    import argparse
+
+    from modules.square_inventory import _make_square_request
+
+    parser = argparse.ArgumentParser(description="Sync the local Square catalog mirror")
+    parser.add_argument("command", choices=["sync"])
+    parser.add_argument("--full", action="store_true", help="rebuild instead of applying changes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = sync(_make_square_request, full=args.full)
+    print(json.dumps(result or {"status": "skipped", "reason": "another sync holds the lease"}))
+
+
+if __name__ == "__main__":
+    main()
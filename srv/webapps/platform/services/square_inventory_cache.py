@@ -0,0 +1,190 @@
+# /srv/webapps/platform/services/square_inventory_cache.py
+
+"""
+Short-lived cache of Square inventory counts, shared by all workers.
+
+Entries are keyed by (catalog_object_id, location_id, state). A separate
+fetch marker per (catalog_object_id, location_id) records when Square was last
+asked for that pair, so "no counts" is cached as well as counts. Markers
+expire after ``SQUARE_INVENTORY_TTL_SECONDS`` (default 60).
+
+``inventory.count.updated`` webhooks call ``apply_counts`` which writes the
+new quantities straight into the cache (newer ``calculated_at`` wins), so stock
+displays pick up changes immediately instead of waiting for the TTL.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+SQUARE_INVENTORY_TTL_SECONDS = int(os.getenv("SQUARE_INVENTORY_TTL_SECONDS", "60"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventory_counts (
+    catalog_object_id TEXT NOT NULL,
+    location_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    quantity TEXT,
+    calculated_at TEXT,
+    catalog_object_type TEXT,
+    PRIMARY KEY (catalog_object_id, location_id, state)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS inventory_fetches (
+    catalog_object_id TEXT NOT NULL,
+    location_id TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (catalog_object_id, location_id)
+) WITHOUT ROWID;
+"""
+
+# SQLite's default limit on bound parameters is 999.
+_CHUNK = 400
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("square_inventory", schema=_SCHEMA)
+
+
+def _chunks(values: List[str]) -> Iterable[List[str]]:
+    for start in range(0, len(values), _CHUNK):
+        yield values[start:start + _CHUNK]
+
+
+def get_counts(
+    catalog_object_ids: List[str], location_ids: List[str]
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Look up cached counts.
+
+    Returns:
+        tuple: (cached counts in Square's count format, object IDs that have no
+        fresh entry for at least one of ``location_ids`` and must be fetched)
+    """
+    conn = _connection()
+    cutoff = time.time() - SQUARE_INVENTORY_TTL_SECONDS
+    wanted_locations = set(location_ids)
+
+    fresh: Dict[str, set] = {}
+    counts: List[Dict[str, Any]] = []
+    for chunk in _chunks(catalog_object_ids):
+        placeholders = ", ".join("?" * len(chunk))
+        for row in conn.execute(
+            f"SELECT catalog_object_id, location_id FROM inventory_fetches "
+            f"WHERE catalog_object_id IN ({placeholders}) AND fetched_at >= ?",
+            (*chunk, cutoff),
+        ):
+            if row["location_id"] in wanted_locations:
+                fresh.setdefault(row["catalog_object_id"], set()).add(row["location_id"])
+
+    hits = [object_id for object_id in catalog_object_ids if fresh.get(object_id) == wanted_locations]
+    missing = [object_id for object_id in catalog_object_ids if fresh.get(object_id) != wanted_locations]
+
+    for chunk in _chunks(hits):
+        placeholders = ", ".join("?" * len(chunk))
+        for row in conn.execute(
+            f"SELECT * FROM inventory_counts WHERE catalog_object_id IN ({placeholders})",
+            chunk,
+        ):
+            if row["location_id"] in wanted_locations:
+                counts.append({
+                    "catalog_object_id": row["catalog_object_id"],
+                    "catalog_object_type": row["catalog_object_type"],
+                    "state": row["state"],
+                    "location_id": row["location_id"],
+                    "quantity": row["quantity"],
+                    "calculated_at": row["calculated_at"],
+                })
+
+    return counts, missing
+
+
+def store_counts(
+    catalog_object_ids: List[str], location_ids: List[str], counts: List[Dict[str, Any]]
+) -> None:
+    """
+    Replace the cached counts for every (object, location) pair that was fetched.
+
+    ``counts`` is the complete Square answer for those pairs; states absent
+    from it are dropped from the cache.
+    """
+    now = time.time()
+    conn = _connection()
+    with transaction(conn):
+        for chunk in _chunks(catalog_object_ids):
+            placeholders = ", ".join("?" * len(chunk))
+            location_placeholders = ", ".join("?" * len(location_ids))
+            conn.execute(
+                f"DELETE FROM inventory_counts WHERE catalog_object_id IN ({placeholders}) "
+                f"AND location_id IN ({location_placeholders})",
+                (*chunk, *location_ids),
+            )
+        conn.executemany(
+            "INSERT OR REPLACE INTO inventory_fetches (catalog_object_id, location_id, fetched_at) "
+            "VALUES (?, ?, ?)",
+            [(object_id, location_id, now) for object_id in catalog_object_ids for location_id in location_ids],
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO inventory_counts (catalog_object_id, location_id, state, quantity, "
+            "calculated_at, catalog_object_type) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (count["catalog_object_id"], count["location_id"], count["state"], count.get("quantity"),
+                 count.get("calculated_at"), count.get("catalog_object_type"))
+                for count in counts
+                if count.get("catalog_object_id") and count.get("location_id") and count.get("state")
+            ],
+        )
+
+
+def apply_counts(counts: List[Dict[str, Any]]) -> int:
+    """
+    Apply pushed counts (e.g. from an ``inventory.count.updated`` webhook).
+
+    A count only replaces the cached one when its ``calculated_at`` is not
+    older, so out-of-order deliveries can't roll stock back. Cached pairs are
+    marked fresh again; pairs never fetched stay uncached so the next read
+    gets every state from Square.
+
+    Returns:
+        int: Number of counts written
+    """
+    conn = _connection()
+    written = 0
+    with transaction(conn):
+        for count in counts:
+            key = (count.get("catalog_object_id"), count.get("location_id"), count.get("state"))
+            if not all(key):
+                continue
+            cursor = conn.execute(
+                "INSERT INTO inventory_counts (catalog_object_id, location_id, state, quantity, "
+                "calculated_at, catalog_object_type) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(catalog_object_id, location_id, state) DO UPDATE SET "
+                "quantity = excluded.quantity, calculated_at = excluded.calculated_at, "
+                "catalog_object_type = excluded.catalog_object_type "
+                "WHERE inventory_counts.calculated_at IS NULL "
+                "OR excluded.calculated_at >= inventory_counts.calculated_at",
+                (*key, count.get("quantity"), count.get("calculated_at"), count.get("catalog_object_type")),
+            )
+            written += cursor.rowcount
+            conn.execute(
+                "UPDATE inventory_fetches SET fetched_at = ? WHERE catalog_object_id = ? AND location_id = ?",
+                (time.time(), key[0], key[1]),
+            )
+    return written
+
+
+def invalidate(catalog_object_ids: List[str]) -> None:
+    """Drop cached counts for the given objects at every location."""
+    conn = _connection()
+    with transaction(conn):
+        for chunk in _chunks(catalog_object_ids):
+            placeholders = ", ".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM inventory_fetches WHERE catalog_object_id IN ({placeholders})", chunk)
+            conn.execute(f"DELETE FROM inventory_counts WHERE catalog_object_id IN ({placeholders})", chunk)
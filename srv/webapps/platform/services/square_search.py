@@ -0,0 +1,374 @@
+# /srv/webapps/platform/services/square_search.py
+
+"""
+In-memory search index over the Square catalog mirror.
+
+Each worker keeps its own index, built from the mirror on first use and
+brought up to date with ``square_catalog_mirror.changes_since`` before a
+query, so only objects changed since the last query are re-indexed. The
+index holds:
+
+- an inverted index of name and description tokens (name hits rank higher),
+  with a sorted vocabulary for prefix matching ("tom" finds "tomato"),
+- item IDs per category,
+- a sorted array of (lowest variation price, item ID) for price ranges,
+- the raw ITEM, ITEM_VARIATION and CATEGORY objects, so results can be
+  shaped without touching SQLite.
+
+Queries never call Square. Prices are in the currency's smallest unit, like
+``price_money.amount``.
+"""
+
+from __future__ import annotations
+
+import bisect
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from services import square_catalog_mirror
+
+logger = logging.getLogger(__name__)
+
+# Minimum time between two ``changes_since`` checks in one process
+REFRESH_INTERVAL_SECONDS = 1.0
+
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+# Score multiplier for a prefix (rather than whole-token) match
+PREFIX_FACTOR = 0.5
+
+SORT_ORDERS = ("relevance", "name", "price", "-price")
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lower-case, accent-folded word tokens."""
+    if not text:
+        return []
+    folded = unicodedata.normalize("NFKD", text)
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return _TOKEN_RE.findall(folded.lower())
+
+
+def _object_data(obj: Dict[str, Any]) -> Dict[str, Any]:
+    obj_type = obj.get("type") or ""
+    return obj.get(f"{obj_type.lower()}_data") or obj.get(obj_type) or {}
+
+
+@dataclass
+class _ItemDoc:
+    name: str
+    category_ids: Set[str]
+    price: Optional[int]
+    tokens: Dict[str, float]
+    present_at_all_locations: bool = True
+    present_at_location_ids: Set[str] = field(default_factory=set)
+    absent_at_location_ids: Set[str] = field(default_factory=set)
+
+    def available_at(self, location_ids: Iterable[str]) -> bool:
+        for location_id in location_ids:
+            if self.present_at_all_locations and location_id not in self.absent_at_location_ids:
+                return True
+            if location_id in self.present_at_location_ids:
+                return True
+        return False
+
+
+class CatalogSearchIndex:
+    """Token, category and price indexes over live catalog ITEMs."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.seq = 0
+        self._objects: Dict[str, Dict[str, Any]] = {}
+        self._variations_by_item: Dict[str, Set[str]] = {}
+        self._docs: Dict[str, _ItemDoc] = {}
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._vocabulary: List[str] = []
+        self._vocabulary_dirty = False
+        self._by_category: Dict[str, Set[str]] = {}
+        self._prices: List[Tuple[int, str]] = []
+        self._checked_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    # -- maintenance -------------------------------------------------------
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Apply mirror changes made since the last refresh.
+
+        Returns:
+            int: Number of changed objects applied
+
+        Raises:
+            MirrorEmptyError: If the mirror has not completed a full sync
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._checked_at < REFRESH_INTERVAL_SECONDS:
+                return 0
+            if not square_catalog_mirror.is_ready():
+                raise square_catalog_mirror.MirrorEmptyError("Square catalog mirror has not been synced yet")
+            changes, latest = square_catalog_mirror.changes_since(self.seq)
+            if latest < self.seq:
+                # The mirror database was recreated; start over.
+                self._reset()
+                changes, latest = square_catalog_mirror.changes_since(0)
+            self._checked_at = now
+            if changes:
+                self.apply(changes)
+            self.seq = latest
+            return len(changes)
+
+    def apply(self, objects: List[Dict[str, Any]]) -> None:
+        """Index changed raw objects (deleted ones are removed)."""
+        with self._lock:
+            dirty: Set[str] = set()
+            for obj in objects:
+                obj_id = obj.get("id")
+                obj_type = obj.get("type")
+                if not obj_id:
+                    continue
+
+                previous = self._objects.pop(obj_id, None)
+                if not obj.get("is_deleted"):
+                    self._objects[obj_id] = obj
+
+                if obj_type == "ITEM":
+                    dirty.add(obj_id)
+                elif obj_type == "ITEM_VARIATION":
+                    for version in (previous, obj):
+                        item_id = _object_data(version).get("item_id") if version else None
+                        if item_id:
+                            dirty.add(item_id)
+                    self._link_variation(obj_id, previous, None if obj.get("is_deleted") else obj)
+
+            for item_id in dirty:
+                self._reindex_item(item_id)
+
+    def _link_variation(
+        self, variation_id: str, previous: Optional[Dict[str, Any]], current: Optional[Dict[str, Any]]
+    ) -> None:
+        if previous:
+            old_item = _object_data(previous).get("item_id")
+            if old_item in self._variations_by_item:
+                self._variations_by_item[old_item].discard(variation_id)
+        if current:
+            item_id = _object_data(current).get("item_id")
+            if item_id:
+                self._variations_by_item.setdefault(item_id, set()).add(variation_id)
+
+    def _unindex_item(self, item_id: str) -> None:
+        doc = self._docs.pop(item_id, None)
+        if doc is None:
+            return
+        for token in doc.tokens:
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(item_id, None)
+                if not postings:
+                    del self._postings[token]
+                    self._vocabulary_dirty = True
+        for category_id in doc.category_ids:
+            members = self._by_category.get(category_id)
+            if members is not None:
+                members.discard(item_id)
+                if not members:
+                    del self._by_category[category_id]
+        if doc.price is not None:
+            position = bisect.bisect_left(self._prices, (doc.price, item_id))
+            if position < len(self._prices) and self._prices[position] == (doc.price, item_id):
+                del self._prices[position]
+
+    def _reindex_item(self, item_id: str) -> None:
+        self._unindex_item(item_id)
+        item = self._objects.get(item_id)
+        if item is None or item.get("type") != "ITEM":
+            return
+
+        data = _object_data(item)
+        tokens: Dict[str, float] = {}
+        for token in tokenize(data.get("description")):
+            tokens[token] = DESCRIPTION_WEIGHT
+        for token in tokenize(data.get("name")):
+            tokens[token] = NAME_WEIGHT
+
+        category_ids = {data["category_id"]} if data.get("category_id") else set()
+        category_ids.update(
+            category.get("id") for category in data.get("categories") or [] if category.get("id")
+        )
+
+        doc = _ItemDoc(
+            name=(data.get("name") or "").lower(),
+            category_ids=category_ids,
+            price=self._lowest_price(item_id, data),
+            tokens=tokens,
+            present_at_all_locations=item.get("present_at_all_locations") is not False,
+            present_at_location_ids=set(item.get("present_at_location_ids") or []),
+            absent_at_location_ids=set(item.get("absent_at_location_ids") or []),
+        )
+        self._docs[item_id] = doc
+        for token, weight in tokens.items():
+            postings = self._postings.setdefault(token, {})
+            if not postings:
+                self._vocabulary_dirty = True
+            postings[item_id] = weight
+        for category_id in category_ids:
+            self._by_category.setdefault(category_id, set()).add(item_id)
+        if doc.price is not None:
+            bisect.insort(self._prices, (doc.price, item_id))
+
+    def _variation_objects(self, item_id: str, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        embedded = {var.get("id"): var for var in data.get("variations") or [] if var.get("id")}
+        variation_ids = list(data.get("item_variation_ids") or embedded)
+        variation_ids += [vid for vid in self._variations_by_item.get(item_id, ()) if vid not in variation_ids]
+        variations = []
+        for variation_id in variation_ids:
+            variation = self._objects.get(variation_id) or embedded.get(variation_id)
+            if variation and not variation.get("is_deleted"):
+                variations.append(variation)
+        return variations
+
+    def _lowest_price(self, item_id: str, data: Dict[str, Any]) -> Optional[int]:
+        amounts = []
+        for variation in self._variation_objects(item_id, data):
+            amount = (_object_data(variation).get("price_money") or {}).get("amount")
+            if isinstance(amount, int):
+                amounts.append(amount)
+        return min(amounts) if amounts else None
+
+    # -- queries -------------------------------------------------------------
+
+    def _term_matches(self, term: str) -> Dict[str, float]:
+        """Item scores for one query term: whole-token hits plus prefix hits."""
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+
+        scores: Dict[str, float] = dict(self._postings.get(term, {}))
+        position = bisect.bisect_left(self._vocabulary, term)
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(term):
+            token = self._vocabulary[position]
+            position += 1
+            if token == term:
+                continue
+            for item_id, weight in self._postings[token].items():
+                prefix_score = weight * PREFIX_FACTOR
+                if prefix_score > scores.get(item_id, 0.0):
+                    scores[item_id] = prefix_score
+        return scores
+
+    def _price_range(self, min_price: Optional[int], max_price: Optional[int]) -> Set[str]:
+        low = bisect.bisect_left(self._prices, (min_price, "")) if min_price is not None else 0
+        high = (
+            bisect.bisect_left(self._prices, (max_price + 1, ""))
+            if max_price is not None else len(self._prices)
+        )
+        return {item_id for _, item_id in self._prices[low:high]}
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        category_id: Optional[str] = None,
+        min_price: Optional[int] = None,
+        max_price: Optional[int] = None,
+        location_ids: Optional[List[str]] = None,
+        sort: str = "relevance",
+        offset: int = 0,
+        limit: int = 20,
+    ) -> Tuple[List[str], int]:
+        """
+        Rank items matching every query term and filter.
+
+        Returns:
+            tuple: (item IDs for the requested page, total number of matches)
+        """
+        with self._lock:
+            scores: Optional[Dict[str, float]] = None
+            for term in dict.fromkeys(tokenize(query)):
+                matches = self._term_matches(term)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {item_id: score + matches[item_id] for item_id, score in scores.items()
+                              if item_id in matches}
+                if not scores:
+                    return [], 0
+
+            candidates: Set[str] = set(scores) if scores is not None else set(self._docs)
+            if category_id:
+                candidates &= self._by_category.get(category_id, set())
+            if min_price is not None or max_price is not None:
+                candidates &= self._price_range(min_price, max_price)
+            if location_ids:
+                candidates = {item_id for item_id in candidates if self._docs[item_id].available_at(location_ids)}
+
+            docs = self._docs
+            if sort == "price":
+                key = lambda i: (docs[i].price is None, docs[i].price or 0, docs[i].name, i)
+            elif sort == "-price":
+                key = lambda i: (docs[i].price is None, -(docs[i].price or 0), docs[i].name, i)
+            elif sort == "relevance" and scores is not None:
+                key = lambda i: (-scores[i], docs[i].name, i)
+            else:
+                key = lambda i: (docs[i].name, i)
+
+            # Only the requested page needs ordering, not every match.
+            ordered = heapq.nsmallest(offset + limit, candidates, key=key)
+            return ordered[offset:], len(candidates)
+
+    def objects_for(self, item_ids: List[str]) -> List[Dict[str, Any]]:
+        """Raw ITEMs plus their variations and categories, for shaping."""
+        with self._lock:
+            objects: List[Dict[str, Any]] = []
+            related: Dict[str, Dict[str, Any]] = {}
+            for item_id in item_ids:
+                item = self._objects.get(item_id)
+                if item is None:
+                    continue
+                objects.append(item)
+                data = _object_data(item)
+                for variation in self._variation_objects(item_id, data):
+                    related[variation["id"]] = variation
+                for category_id in self._docs[item_id].category_ids:
+                    category = self._objects.get(category_id)
+                    if category is not None:
+                        related[category_id] = category
+            return objects + list(related.values())
+
+
+_index = CatalogSearchIndex()
+
+
+def search(**kwargs: Any) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Query this process's index after catching it up with the mirror.
+
+    Accepts the keyword arguments of ``CatalogSearchIndex.search``.
+
+    Returns:
+        tuple: (raw objects for the page's items and their related objects,
+        total number of matches); item order in the list is the ranking
+
+    Raises:
+        MirrorEmptyError: If the mirror has not completed a full sync
+    """
+    _index.refresh()
+    item_ids, total = _index.search(**kwargs)
+    return _index.objects_for(item_ids), total
+
+
+def index_stats() -> Dict[str, Any]:
+    return {"items": len(_index), "seq": _index.seq}
@@ -0,0 +1,93 @@
+# /srv/webapps/platform/services/state.py
+
+"""
+Location of, and connections to, the platform's local SQLite state.
+
+Every gunicorn worker opens its own connections, so anything stored here is
+shared across workers and survives restarts. Databases live under
+``PLATFORM_STATE_DIR`` (default ``srv/webapps/platform/state``), one file per
+subsystem, and run in WAL mode so readers never block the single writer.
+
+Usage::
+
+    from services.state import get_connection, transaction
+
+    conn = get_connection("weather", schema=_SCHEMA)
+    with transaction(conn):
+        conn.execute("INSERT ...")
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from data_access import PLATFORM_ROOT
+
+STATE_DIR = Path(os.getenv("PLATFORM_STATE_DIR", str(PLATFORM_ROOT / "state")))
+
+# sqlite3 connections must not cross threads or forked workers, so they are
+# cached per thread and discarded when the process id changes.
+_local = threading.local()
+
+
+def _connections() -> Dict[str, sqlite3.Connection]:
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+    return _local.connections
+
+
+def database_path(name: str) -> Path:
+    """Return the SQLite file path for a named state database."""
+    return STATE_DIR / f"{name}.sqlite3"
+
+
+def get_connection(name: str, schema: Optional[str] = None) -> sqlite3.Connection:
+    """
+    Return this thread's connection to the named state database.
+
+    Args:
+        name: Database name (file stem under STATE_DIR)
+        schema: Optional idempotent DDL script run when the connection is opened
+
+    Returns:
+        sqlite3.Connection: Autocommit connection with ``sqlite3.Row`` rows
+    """
+    connections = _connections()
+    conn = connections.get(name)
+    if conn is not None:
+        return conn
+
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(database_path(name), timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=10000")
+    if schema:
+        conn.executescript(schema)
+
+    connections[name] = conn
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection, immediate: bool = True) -> Iterator[sqlite3.Connection]:
+    """
+    Run a block inside one transaction, committing on success.
+
+    ``immediate`` takes the write lock up front so read-modify-write blocks
+    from different workers serialize instead of failing on upgrade.
+    """
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
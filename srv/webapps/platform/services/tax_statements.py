@@ -0,0 +1,389 @@
+# /srv/webapps/platform/services/tax_statements.py
+
+"""
+Year-end donor statements built from the donation receipt files.
+
+Each January every nonprofit client sends its donors one statement listing
+the year's gifts (date, amount, designation), the organization's EIN and the
+no-goods-or-services statement. The pipeline:
+
+1. streams ``(client, receipt)`` pairs once, keeping only receipts recorded in
+   the tax year and not voided by a refund, grouped by client and donor email;
+2. skips donors whose statement is already rendered with the same content (the
+   checkpoint table in the ``tax_statements`` SQLite database), so a rerun after
+   a crash or a late receipt only renders what changed;
+3. renders the rest in chunks on a process pool, each file written atomically;
+4. records each finished chunk's checkpoints in one transaction and writes a
+   ``manifest.json`` per client (donor, totals, file) for the mail merge.
+
+Statements are HTML (Jinja2, which ships with Flask). PDF output needs the
+optional ``weasyprint`` package. Usage::
+
+    python -m services.tax_statements build --year 2025 --out /srv/statements
+    python -m services.tax_statements build --year 2025 --client example.org --format pdf
+
+Output goes to ``<out>/<client>/<year>/<donor key>.<format>``; the donor key is
+a hash of the email so file names don't expose it.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from jinja2 import Environment
+
+from services.donation_rollups import format_minor, to_minor
+from services.state import get_connection, transaction
+
+try:
+    from weasyprint import HTML as WeasyHTML
+except ImportError:  # pragma: no cover - exercised on hosts without weasyprint
+    WeasyHTML = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("html", "pdf")
+
+# Donors per pool task; large enough to amortize pickling, small enough to
+# checkpoint often.
+CHUNK_SIZE = 200
+
+# Bump when the template changes so every statement is rendered again.
+TEMPLATE_VERSION = "1"
+
+DEFAULT_NO_GOODS_STATEMENT = "No goods or services were provided in exchange for these contributions."
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS statements (
+    client TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    donor_key TEXT NOT NULL,
+    format TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    path TEXT NOT NULL,
+    rendered_at TEXT NOT NULL,
+    PRIMARY KEY (client, year, format, donor_key)
+) WITHOUT ROWID;
+"""
+
+_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{{ year }} contribution statement - {{ organization }}</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; width: 100%; }
+th, td { border-bottom: 1px solid #ccc; padding: 4px 8px; text-align: left; }
+td.amount, th.amount { text-align: right; }
+</style>
+</head>
+<body>
+<h1>{{ year }} contribution statement</h1>
+<p>{{ organization }}{% if ein %}<br>EIN {{ ein }}{% endif %}</p>
+<p>{{ donor_name or donor_email }}{% if donor_address %}<br>{{ donor_address }}{% endif %}</p>
+<table>
+<thead><tr><th>Date</th><th>Designation</th><th class="amount">Amount</th></tr></thead>
+<tbody>
+{% for gift in gifts %}<tr><td>{{ gift.date }}</td><td>{{ gift.designation or "General" }}</td><td class="amount">{{ gift.amount }} {{ gift.currency }}</td></tr>
+{% endfor %}</tbody>
+<tfoot>
+{% for currency, total in totals.items() %}<tr><th colspan="2">Total</th><th class="amount">{{ total }} {{ currency }}</th></tr>
+{% endfor %}</tfoot>
+</table>
+{% for text in statements %}<p>{{ text }}</p>
+{% endfor %}</body>
+</html>
+"""
+
+_template = None
+
+
+@dataclass
+class DonorStatement:
+    """One donor's gifts to one client in the tax year."""
+
+    client: str
+    donor_key: str
+    donor_email: str
+    donor_name: Optional[str] = None
+    donor_address: Optional[str] = None
+    ein: Optional[str] = None
+    gifts: List[Dict[str, str]] = field(default_factory=list)
+    statements: List[str] = field(default_factory=list)
+
+    def totals(self) -> Dict[str, str]:
+        minor: Dict[str, int] = {}
+        for gift in self.gifts:
+            minor[gift["currency"]] = minor.get(gift["currency"], 0) + to_minor(gift["amount"])
+        return {currency: format_minor(value) for currency, value in sorted(minor.items())}
+
+    def digest(self) -> str:
+        payload = json.dumps([TEMPLATE_VERSION, asdict(self)], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def donor_key(email: str) -> str:
+    """Stable, non-identifying file name for a donor email."""
+    return hashlib.sha256(email.encode("utf-8")).hexdigest()[:20]
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("tax_statements", schema=_SCHEMA)
+
+
+def group_receipts(
+    receipts: Iterable[Tuple[str, Dict[str, Any]]],
+    year: int,
+    client: Optional[str] = None,
+) -> Tuple[Dict[Tuple[str, str], DonorStatement], Dict[str, int]]:
+    """
+    Group one year's receipts by client and donor email in a single pass.
+
+    Returns:
+        tuple: ``{(client, email): DonorStatement}`` and counts of receipts
+        used and skipped
+    """
+    prefix = f"{year:04d}-"
+    donors: Dict[Tuple[str, str], DonorStatement] = {}
+    counts = {"receipts": 0, "no_email": 0, "invalid_amount": 0, "voided": 0}
+    for client_slug, receipt in receipts:
+        recorded_at = receipt.get("recorded_at") or ""
+        if (client is not None and client_slug != client) or not recorded_at.startswith(prefix):
+            continue
+        if receipt.get("voided_at"):
+            # Refunded or reversed gifts aren't deductible
+            counts["voided"] += 1
+            continue
+        donor = receipt.get("donor") if isinstance(receipt.get("donor"), dict) else {}
+        email = str(donor.get("email") or "").strip().lower()
+        if not email:
+            counts["no_email"] += 1
+            continue
+        try:
+            amount = format_minor(to_minor(receipt.get("amount")))
+        except ValueError:
+            logger.warning(f"Skipping receipt with invalid amount for {client_slug}: {receipt.get('amount')!r}")
+            counts["invalid_amount"] += 1
+            continue
+
+        statement = donors.get((client_slug, email))
+        if statement is None:
+            statement = donors[(client_slug, email)] = DonorStatement(
+                client=client_slug, donor_key=donor_key(email), donor_email=email
+            )
+        # Later receipts carry the most recent name, address and EIN
+        statement.donor_name = donor.get("name") or statement.donor_name
+        statement.donor_address = donor.get("address") or statement.donor_address
+        statement.ein = receipt.get("ein") or statement.ein
+        statement.gifts.append({
+            "date": recorded_at[:10],
+            "amount": amount,
+            "currency": str(receipt.get("currency") or "USD").upper(),
+            "designation": receipt.get("designation") or "",
+        })
+        text = receipt.get("no_goods_or_services_statement") or DEFAULT_NO_GOODS_STATEMENT
+        if text not in statement.statements:
+            statement.statements.append(text)
+        counts["receipts"] += 1
+
+    for statement in donors.values():
+        statement.gifts.sort(key=lambda gift: gift["date"])
+    return donors, counts
+
+
+def render_html(statement: DonorStatement, year: int) -> str:
+    """The statement as a standalone HTML page."""
+    global _template
+    if _template is None:
+        _template = Environment(autoescape=True).from_string(_TEMPLATE)
+    return _template.render(
+        year=year,
+        organization=statement.client,
+        ein=statement.ein,
+        donor_name=statement.donor_name,
+        donor_email=statement.donor_email,
+        donor_address=statement.donor_address,
+        gifts=statement.gifts,
+        totals=statement.totals(),
+        statements=statement.statements,
+    )
+
+
+def _write_atomic(path: Path, content: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def statement_path(out_dir: Path, statement: DonorStatement, year: int, fmt: str) -> Path:
+    return out_dir / statement.client / str(year) / f"{statement.donor_key}.{fmt}"
+
+
+def _render_chunk(
+    chunk: List[DonorStatement], year: int, out_dir: str, fmt: str
+) -> List[Tuple[str, str, str, str]]:
+    """
+    Pool task: render and write a chunk of statements.
+
+    Returns:
+        list: ``(client, donor_key, digest, path)`` per statement written
+    """
+    written = []
+    for statement in chunk:
+        html = render_html(statement, year)
+        content = WeasyHTML(string=html).write_pdf() if fmt == "pdf" else html.encode("utf-8")
+        path = statement_path(Path(out_dir), statement, year, fmt)
+        _write_atomic(path, content)
+        written.append((statement.client, statement.donor_key, statement.digest(), str(path)))
+    return written
+
+
+def _checkpoints(year: int, fmt: str) -> Dict[Tuple[str, str], Tuple[str, str]]:
+    rows = _connection().execute(
+        "SELECT client, donor_key, digest, path FROM statements WHERE year = ? AND format = ?",
+        (year, fmt),
+    )
+    return {(row["client"], row["donor_key"]): (row["digest"], row["path"]) for row in rows}
+
+
+def _record_checkpoints(year: int, fmt: str, written: List[Tuple[str, str, str, str]]) -> None:
+    rendered_at = datetime.now(timezone.utc).isoformat()
+    conn = _connection()
+    with transaction(conn):
+        conn.executemany(
+            "INSERT OR REPLACE INTO statements (client, year, donor_key, format, digest, path, rendered_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(client, year, key, fmt, digest, path, rendered_at) for client, key, digest, path in written],
+        )
+
+
+def _write_manifests(donors: Dict[Tuple[str, str], DonorStatement], year: int, out_dir: Path, fmt: str) -> None:
+    by_client: Dict[str, List[Dict[str, Any]]] = {}
+    for statement in donors.values():
+        by_client.setdefault(statement.client, []).append({
+            "donor_key": statement.donor_key,
+            "donor_email": statement.donor_email,
+            "donor_name": statement.donor_name,
+            "gifts": len(statement.gifts),
+            "totals": statement.totals(),
+            "file": statement_path(out_dir, statement, year, fmt).name,
+        })
+    for client, entries in by_client.items():
+        entries.sort(key=lambda entry: entry["donor_email"])
+        payload = {"client": client, "year": year, "format": fmt, "donors": entries}
+        _write_atomic(out_dir / client / str(year) / "manifest.json", json.dumps(payload, indent=2).encode("utf-8"))
+
+
+def build_statements(
+    receipts: Iterable[Tuple[str, Dict[str, Any]]],
+    year: int,
+    out_dir: Path,
+    fmt: str = "html",
+    client: Optional[str] = None,
+    workers: Optional[int] = None,
+    force: bool = False,
+) -> Dict[str, int]:
+    """
+    Render every donor's statement for ``year``, resuming from checkpoints.
+
+    Args:
+        receipts: ``(client, receipt)`` pairs, e.g. ``iter_all_receipts()``
+        year: Tax year (receipts are matched on ``recorded_at``)
+        out_dir: Root output directory
+        fmt: "html" or "pdf"
+        client: Only this client's donors
+        workers: Pool size (default: CPU count); 1 renders in-process
+        force: Render every statement even if its checkpoint is current
+
+    Returns:
+        dict: Counts of donors, statements rendered and skipped, and receipts
+
+    Raises:
+        ValueError: For an unknown format
+        RuntimeError: For PDF output without weasyprint
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    if fmt == "pdf" and WeasyHTML is None:
+        raise RuntimeError("PDF statements need the weasyprint package")
+    out_dir = Path(out_dir)
+
+    donors, counts = group_receipts(receipts, year, client)
+    done = {} if force else _checkpoints(year, fmt)
+    pending = []
+    for statement in donors.values():
+        checkpoint = done.get((statement.client, statement.donor_key))
+        if checkpoint and checkpoint[0] == statement.digest() and Path(checkpoint[1]).exists():
+            continue
+        pending.append(statement)
+
+    counts.update(donors=len(donors), rendered=0, current=len(donors) - len(pending))
+    chunks = [pending[i:i + CHUNK_SIZE] for i in range(0, len(pending), CHUNK_SIZE)]
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            written = _render_chunk(chunk, year, str(out_dir), fmt)
+            _record_checkpoints(year, fmt, written)
+            counts["rendered"] += len(written)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_render_chunk, chunk, year, str(out_dir), fmt) for chunk in chunks]
+            for future in as_completed(futures):
+                written = future.result()
+                _record_checkpoints(year, fmt, written)
+                counts["rendered"] += len(written)
+                logger.info(f"Tax statements: {counts['rendered']}/{len(pending)} rendered")
+
+    _write_manifests(donors, year, out_dir, fmt)
+    return counts
+
+
+def main() -> None:
+    import argparse
+
+    from services.state import STATE_DIR
+
+    parser = argparse.ArgumentParser(description="Year-end donor tax statements")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="render statements for a tax year")
+    build_parser.add_argument("--year", type=int, default=datetime.now(timezone.utc).year - 1)
+    build_parser.add_argument("--out", type=Path, default=STATE_DIR / "tax_statements")
+    build_parser.add_argument("--client", help="only this client slug")
+    build_parser.add_argument("--format", choices=FORMATS, default="html")
+    build_parser.add_argument("--workers", type=int, help="process pool size (default: CPU count)")
+    build_parser.add_argument("--force", action="store_true", help="ignore checkpoints and render everything")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Receipt files belong to the blueprint; only the CLI reaches into it
+    from modules.donation_receipts import iter_all_receipts
+
+    print(json.dumps(build_statements(
+        iter_all_receipts(args.client),
+        year=args.year,
+        out_dir=args.out,
+        fmt=args.format,
+        client=args.client,
+        workers=args.workers,
+        force=args.force,
+    )))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# /srv/webapps/platform/services/token_cache.py
+
+"""
+OAuth access tokens shared by every gunicorn worker.
+
+Each token lives in a small JSON file under ``PLATFORM_RUN_DIR`` (default
+``/run/platform``, a tmpfs, so tokens never reach the disk and vanish on
+reboot). Readers take a shared ``flock`` on a sibling lock file; the one
+process that refreshes holds the exclusive lock, so the others wait for its
+result instead of asking the provider themselves. Within a process a thread
+lock does the same for concurrent requests.
+
+Tokens are refreshed ahead of expiry by a daemon thread in each worker. All
+of them wake near the same time, but only the first to get the lock calls the
+provider; the rest find the new token already written. Request threads only
+fetch a token themselves when none is cached or it has actually expired
+(first boot, or the refresher failing for a long time).
+
+Usage::
+
+    from services.token_cache import SharedToken
+
+    token = SharedToken("paypal", client_id, fetch=fetch_token)
+    access_token = token.get()
+
+where ``fetch()`` returns ``(access_token, expires_in_seconds)``.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from services.state import STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+RUN_DIR = Path(os.getenv("PLATFORM_RUN_DIR", "/run/platform"))
+
+# Treat tokens as expired this long before the provider says they are.
+TOKEN_EXPIRY_MARGIN_SECONDS = 60
+
+# The background refresher renews tokens this long before they expire.
+TOKEN_REFRESH_AHEAD_SECONDS = int(os.getenv("TOKEN_REFRESH_AHEAD_SECONDS", "600"))
+
+# Wait after a failed background refresh before trying again.
+TOKEN_REFRESH_RETRY_SECONDS = 30
+
+FetchFn = Callable[[], Tuple[str, int]]
+
+_run_dir: Optional[Path] = None
+
+
+def run_dir() -> Path:
+    """
+    Directory holding the token files.
+
+    Falls back to ``<PLATFORM_STATE_DIR>/run`` when ``PLATFORM_RUN_DIR`` can't
+    be created (e.g. a development checkout without a systemd RuntimeDirectory).
+    """
+    global _run_dir
+    if _run_dir is None:
+        try:
+            RUN_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+            if not os.access(RUN_DIR, os.W_OK):
+                raise PermissionError(f"{RUN_DIR} is not writable")
+            _run_dir = RUN_DIR
+        except OSError as exc:
+            fallback = STATE_DIR / "run"
+            logger.warning(f"Token cache using {fallback}: {exc}")
+            fallback.mkdir(mode=0o700, parents=True, exist_ok=True)
+            _run_dir = fallback
+    return _run_dir
+
+
+class SharedToken:
+    """An access token cached in a file shared by all workers."""
+
+    def __init__(self, name: str, credential: Optional[str], fetch: FetchFn):
+        """
+        Args:
+            name: Provider name, used in the file name and thread name
+            credential: Client ID the token belongs to (only a hash is stored)
+            fetch: Returns a fresh ``(access_token, expires_in_seconds)``
+        """
+        digest = hashlib.sha256((credential or "").encode("utf-8")).hexdigest()[:12]
+        self.name = name
+        self.key = f"{name}-{digest}"
+        self.fetch = fetch
+        self._cached: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._refresher_pid: Optional[int] = None
+        self._wake = threading.Event()
+
+    @property
+    def path(self) -> Path:
+        return run_dir() / f"{self.key}.json"
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool) -> Iterator[None]:
+        lock_path = run_dir() / f"{self.key}.lock"
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or not entry.get("access_token"):
+            return None
+        return entry
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _remaining(entry: Optional[Dict[str, Any]]) -> float:
+        if not entry:
+            return 0.0
+        return float(entry.get("expires_at", 0)) - time.time()
+
+    def _fetch_locked(self, min_remaining: float) -> Dict[str, Any]:
+        """Refresh under the exclusive lock unless another process just did."""
+        with self._file_lock(exclusive=True):
+            entry = self._read()
+            if self._remaining(entry) > min_remaining:
+                return entry
+
+            access_token, expires_in = self.fetch()
+            entry = {
+                "access_token": access_token,
+                "expires_at": time.time() + int(expires_in) - TOKEN_EXPIRY_MARGIN_SECONDS,
+                "fetched_at": time.time(),
+                "fetched_by": os.getpid(),
+            }
+            self._write(entry)
+            logger.info(f"Refreshed {self.name} access token (expires in {expires_in}s)")
+            return entry
+
+    def get(self) -> str:
+        """
+        Return a valid access token, fetching one only if none is usable.
+
+        Raises:
+            Whatever ``fetch`` raises when a token has to be fetched and can't be
+        """
+        self._ensure_refresher()
+
+        entry = self._cached
+        if self._remaining(entry) > 0:
+            return entry["access_token"]
+
+        with self._lock:
+            entry = self._cached
+            if self._remaining(entry) <= 0:
+                with self._file_lock(exclusive=False):
+                    entry = self._read()
+                if self._remaining(entry) <= 0:
+                    entry = self._fetch_locked(min_remaining=0)
+                self._cached = entry
+                self._wake.set()
+        return entry["access_token"]
+
+    def invalidate(self, access_token: str) -> None:
+        """Drop ``access_token`` after the provider rejected it (e.g. a 401)."""
+        with self._lock:
+            if self._cached and self._cached.get("access_token") == access_token:
+                self._cached = None
+            with self._file_lock(exclusive=True):
+                entry = self._read()
+                if entry and entry.get("access_token") == access_token:
+                    try:
+                        self.path.unlink()
+                    except FileNotFoundError:
+                        pass
+
+    def status(self) -> Dict[str, Any]:
+        """Expiry of the shared token, without the token itself."""
+        with self._file_lock(exclusive=False):
+            entry = self._read()
+        return {
+            "cached": entry is not None,
+            "expires_in": max(0, int(self._remaining(entry))) if entry else None,
+        }
+
+    def refresh_if_due(self) -> float:
+        """
+        Renew the shared token if it expires within the refresh-ahead window.
+
+        Returns:
+            float: Seconds until the next refresh is due
+        """
+        with self._lock:
+            with self._file_lock(exclusive=False):
+                entry = self._read()
+            if self._remaining(entry) <= TOKEN_REFRESH_AHEAD_SECONDS:
+                entry = self._fetch_locked(min_remaining=TOKEN_REFRESH_AHEAD_SECONDS)
+            self._cached = entry
+        return self._remaining(entry) - TOKEN_REFRESH_AHEAD_SECONDS
+
+    def _ensure_refresher(self) -> None:
+        """Start this worker's refresher thread (again after a fork)."""
+        if self._refresher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+            # Locks and events copied across a fork belong to the parent.
+            self._wake = threading.Event()
+            if self._cached:
+                self._wake.set()
+            thread = threading.Thread(target=self._refresh_loop, name=f"{self.name}-token-refresh", daemon=True)
+            thread.start()
+
+    def _refresh_loop(self) -> None:
+        wake = self._wake
+        # Nothing to renew until a request has needed a token.
+        wake.wait()
+        while True:
+            try:
+                delay = self.refresh_if_due()
+            except Exception as exc:
+                # Requests keep using the current token until it expires.
+                logger.warning(f"Background {self.name} token refresh failed: {exc}")
+                delay = TOKEN_REFRESH_RETRY_SECONDS
+            # Jitter spreads the workers out; the file lock makes the late ones no-ops.
+            wake.clear()
+            wake.wait(max(1.0, delay) + random.uniform(0, 5))
@@ -0,0 +1,217 @@
+# /srv/webapps/platform/services/weather_store.py
+
+"""
+Persistent per-location store of settled daily weather observations.
+
+Days before the location's local "today" don't change once they have passed,
+so every weather response is mined for them and they are kept in SQLite
+(one row per location and day, one column per daily variable). When a client
+asks for ``past_days`` of history, the stored days are served locally and only
+the days not yet stored plus the forecast tail go upstream. The upstream
+payload therefore stays roughly constant no matter how far back a client looks.
+
+The column list mirrors the ``daily`` keys shaped by modules/weather.py; keep
+them in sync.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from services.state import get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+WEATHER_STORE_ENABLED = os.getenv("WEATHER_STORE_ENABLED", "1") == "1"
+
+# Rows older than this are pruned (the weather API caps past_days at 92).
+RETENTION_DAYS = 100
+
+OBSERVATION_FIELDS = [
+    "temperature_max",
+    "temperature_min",
+    "temperature_mean",
+    "apparent_temperature_max",
+    "apparent_temperature_min",
+    "sunrise",
+    "sunset",
+    "precipitation_sum",
+    "windspeed_max",
+    "winddirection_dominant",
+    "uv_index_max",
+]
+
+# Whole-number fields. Stores created before the column was INTEGER hold them
+# as REAL, so they are also cast when read.
+INTEGER_FIELDS = {"winddirection_dominant"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS locations (
+    location_key TEXT PRIMARY KEY,
+    utc_offset_seconds INTEGER NOT NULL,
+    timezone TEXT,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_observations (
+    location_key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    temperature_max REAL,
+    temperature_min REAL,
+    temperature_mean REAL,
+    apparent_temperature_max REAL,
+    apparent_temperature_min REAL,
+    sunrise TEXT,
+    sunset TEXT,
+    precipitation_sum REAL,
+    windspeed_max REAL,
+    winddirection_dominant INTEGER,
+    uv_index_max REAL,
+    PRIMARY KEY (location_key, day)
+) WITHOUT ROWID;
+"""
+
+
+@dataclass
+class HistoryPlan:
+    """What to request upstream for one location, and what is already local."""
+
+    upstream_past_days: int
+    rows: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+
+def _connection() -> sqlite3.Connection:
+    return get_connection("weather", schema=_SCHEMA)
+
+
+def location_key(lat: float, lon: float) -> str:
+    """Stable key for a (rounded) coordinate pair."""
+    return f"{lat:.4f},{lon:.4f}"
+
+
+def _local_today(utc_offset_seconds: int) -> date:
+    return (datetime.now(timezone.utc) + timedelta(seconds=utc_offset_seconds)).date()
+
+
+def plan(key: str, past_days: int) -> HistoryPlan:
+    """
+    Decide how many past days must still come from upstream for a location.
+
+    Unknown locations (or a disabled/unavailable store) need the full range.
+    At least one past day is always requested so that a local-midnight
+    boundary between planning and the upstream call can't open a gap.
+    """
+    if past_days <= 0 or not WEATHER_STORE_ENABLED:
+        return HistoryPlan(upstream_past_days=past_days)
+
+    try:
+        conn = _connection()
+        location = conn.execute(
+            "SELECT utc_offset_seconds FROM locations WHERE location_key = ?", (key,)
+        ).fetchone()
+        if location is None:
+            return HistoryPlan(upstream_past_days=past_days)
+
+        today = _local_today(location["utc_offset_seconds"])
+        start = today - timedelta(days=past_days)
+        columns = ", ".join(
+            f"CAST({name} AS INTEGER) AS {name}" if name in INTEGER_FIELDS else name for name in OBSERVATION_FIELDS
+        )
+        cursor = conn.execute(
+            f"SELECT day, {columns} FROM daily_observations "
+            "WHERE location_key = ? AND day >= ? AND day < ? ORDER BY day",
+            (key, start.isoformat(), today.isoformat()),
+        )
+        rows = {row["day"]: {name: row[name] for name in OBSERVATION_FIELDS} for row in cursor}
+    except sqlite3.Error:
+        logger.warning("Weather store unavailable, fetching full history", exc_info=True)
+        return HistoryPlan(upstream_past_days=past_days)
+
+    earliest_missing = None
+    for offset in range(past_days, 0, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        if day not in rows:
+            earliest_missing = offset
+            break
+
+    return HistoryPlan(upstream_past_days=max(1, earliest_missing or 0), rows=rows)
+
+
+def record(key: str, shaped: Dict[str, Any], utc_offset_seconds: Optional[int]) -> None:
+    """Persist the settled (before local today) days of a shaped response."""
+    if not WEATHER_STORE_ENABLED or utc_offset_seconds is None:
+        return
+
+    today = _local_today(int(utc_offset_seconds))
+    daily = shaped.get("daily") or {}
+    times = daily.get("time") or []
+    rows = []
+    for index, day in enumerate(times):
+        if day >= today.isoformat():
+            break
+        rows.append(
+            (key, day, *[_value_at(daily.get(name), index) for name in OBSERVATION_FIELDS])
+        )
+
+    try:
+        conn = _connection()
+        with transaction(conn):
+            conn.execute(
+                "INSERT INTO locations (location_key, utc_offset_seconds, timezone, updated_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(location_key) DO UPDATE SET "
+                "utc_offset_seconds = excluded.utc_offset_seconds, "
+                "timezone = excluded.timezone, updated_at = excluded.updated_at",
+                (key, int(utc_offset_seconds), shaped.get("timezone"),
+                 datetime.now(timezone.utc).isoformat()),
+            )
+            if rows:
+                placeholders = ", ".join("?" * (len(OBSERVATION_FIELDS) + 2))
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO daily_observations "
+                    f"(location_key, day, {', '.join(OBSERVATION_FIELDS)}) VALUES ({placeholders})",
+                    rows,
+                )
+            conn.execute(
+                "DELETE FROM daily_observations WHERE location_key = ? AND day < ?",
+                (key, (today - timedelta(days=RETENTION_DAYS)).isoformat()),
+            )
+    except sqlite3.Error:
+        logger.warning(f"Failed to record weather observations for {key}", exc_info=True)
+
+
+def _value_at(values: Optional[List[Any]], index: int) -> Any:
+    if not values or index >= len(values):
+        return None
+    return values[index]
+
+
+def merge(shaped: Dict[str, Any], history: HistoryPlan, past_days: int) -> Dict[str, Any]:
+    """
+    Prepend stored history to a response fetched with ``history.upstream_past_days``.
+
+    Returns a response covering ``past_days`` of history, as if it had been
+    requested upstream in full. Upstream values win for overlapping days.
+    """
+    daily = shaped["daily"]
+    times = daily["time"]
+    if history.upstream_past_days == past_days or history.upstream_past_days >= len(times):
+        return shaped
+
+    today = date.fromisoformat(times[history.upstream_past_days])
+    start = (today - timedelta(days=past_days)).isoformat()
+    local_days = sorted(day for day in history.rows if start <= day < times[0])
+
+    merged = {"time": local_days + list(times)}
+    for name in OBSERVATION_FIELDS:
+        upstream_values = list(daily.get(name) or [None] * len(times))
+        merged[name] = [history.rows[day][name] for day in local_days] + upstream_values
+
+    # Upstream may have returned a few extra past days (the planning margin).
+    first = merged["time"].index(start) if start in merged["time"] else 0
+    shaped = dict(shaped)
+    shaped["daily"] = {name: values[first:] for name, values in merged.items()}
+    return shaped
@@ -0,0 +1,30 @@
+# /srv/webapps/platform/standin/__init__.py
+
+"""
+Local stand-in for the upstream services the platform calls.
+
+Serves the response shapes consumed by modules/weather.py (Open-Meteo),
+modules/paypal_gateway.py (PayPal) and modules/square_inventory.py (Square)
+with configurable latency, error rate and payload size, so caching, pooling
+and concurrency changes can be benchmarked without network access.
+
+In-process::
+
+    from standin import Profile, StandinServer
+
+    with StandinServer(profiles={"square": Profile(latency_ms=80, catalog_items=2000)}) as server:
+        os.environ["SQUARE_API_BASE"] = server.base_url
+        ...
+        print(server.stats)
+
+As a subprocess::
+
+    python -m standin --port 8089 --latency-ms 50 --error-rate 0.02
+
+then point the platform at it with ``OPEN_METEO_BASE_URL=http://127.0.0.1:8089/v1/forecast``,
+``PAYPAL_API_BASE=http://127.0.0.1:8089`` and ``SQUARE_API_BASE=http://127.0.0.1:8089``.
+"""
+
+from standin.server import Profile, StandinServer
+
+__all__ = ["Profile", "StandinServer"]
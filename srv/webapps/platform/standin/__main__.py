@@ -0,0 +1,46 @@
+# /srv/webapps/platform/standin/__main__.py
+
+"""Run the stand-in server as a subprocess: ``python -m standin --help``."""
+
+from __future__ import annotations
+
+import argparse
+
+from standin.server import Profile, StandinServer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local Open-Meteo/PayPal/Square stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="base latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra uniform random latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="status used for injected errors")
+    parser.add_argument("--catalog-items", type=int, default=200, help="Square ITEM objects to generate")
+    parser.add_argument("--variations-per-item", type=int, default=3)
+    parser.add_argument("--page-size", type=int, default=100, help="Square objects per page")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    profile = Profile(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        catalog_items=args.catalog_items,
+        variations_per_item=args.variations_per_item,
+        page_size=args.page_size,
+    )
+    server = StandinServer(host=args.host, port=args.port, default_profile=profile, seed=args.seed)
+    print(f"Stand-in listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
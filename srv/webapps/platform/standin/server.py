@@ -0,0 +1,682 @@
+# /srv/webapps/platform/standin/server.py
+
+"""
+Threaded HTTP stand-in for Open-Meteo, PayPal and Square.
+
+Only the endpoints and fields the platform modules read are implemented.
+Generated data is deterministic for a given seed so benchmark runs are
+comparable. Each upstream gets its own ``Profile`` (latency, error rate,
+payload size); request counts per handler (e.g. ``square_catalog_list``) are
+kept in ``StandinServer.stats`` and served at ``GET /_standin/stats``.
+
+PayPal webhook deliveries can be signed with ``sign_paypal_webhook`` against
+a throwaway CA (``paypal_ca_pem``) and leaf certificate served at
+``paypal_cert_url``; this needs the optional ``cryptography`` package.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+SERVICES = ("open_meteo", "paypal", "square")
+
+PAYPAL_CERT_SUBJECT = "messageverificationcerts.paypal.com"
+
+
+def _square_now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+@dataclass
+class Profile:
+    """Behaviour of one stand-in upstream."""
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    # Square payload size
+    catalog_items: int = 200
+    variations_per_item: int = 3
+    categories: int = 12
+    locations: int = 1
+    page_size: int = 100
+    description_bytes: int = 120
+    images_per_item: int = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_HTTPServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002 - stdlib signature
+        pass
+
+    def do_GET(self) -> None:
+        self.server.standin.dispatch(self, "GET")
+
+    def do_POST(self) -> None:
+        self.server.standin.dispatch(self, "POST")
+
+    def do_PATCH(self) -> None:
+        self.server.standin.dispatch(self, "PATCH")
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    standin: "StandinServer"
+
+
+class StandinServer:
+    """In-process stand-in server; also used by ``python -m standin``."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        profiles: Optional[Dict[str, Profile]] = None,
+        default_profile: Optional[Profile] = None,
+        seed: int = 1,
+    ):
+        default_profile = default_profile or Profile()
+        self.profiles = {name: default_profile for name in SERVICES}
+        self.profiles.update(profiles or {})
+        self.seed = seed
+        self.stats: Counter = Counter()
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._orders: Dict[str, Dict[str, Any]] = {}
+        self._captures_by_request_id: Dict[str, Dict[str, Any]] = {}
+        self._catalog = self._generate_catalog(self.profiles["square"])
+        self._thread: Optional[threading.Thread] = None
+        self._paypal_signing: Optional[Dict[str, Any]] = None
+
+        self._routes: List[Tuple[str, re.Pattern, str, Callable]] = [
+            ("GET", re.compile(r"^/_standin/stats$"), "", self._stats),
+            ("GET", re.compile(r"^/v1/forecast$"), "open_meteo", self._forecast),
+            ("POST", re.compile(r"^/v1/oauth2/token$"), "paypal", self._paypal_token),
+            ("POST", re.compile(r"^/v2/checkout/orders$"), "paypal", self._paypal_create_order),
+            ("GET", re.compile(r"^/v2/checkout/orders/(?P<order_id>[^/]+)$"), "paypal", self._paypal_get_order),
+            ("POST", re.compile(r"^/v2/checkout/orders/(?P<order_id>[^/]+)/capture$"), "paypal", self._paypal_capture),
+            ("GET", re.compile(r"^/v2/payments/captures/(?P<capture_id>[^/]+)$"), "paypal", self._paypal_get_capture),
+            ("GET", re.compile(r"^/v1/notifications/certs/(?P<cert_id>[^/]+)$"), "paypal", self._paypal_cert),
+            ("POST", re.compile(r"^/v1/notifications/verify-webhook-signature$"), "paypal", self._paypal_verify_webhook),
+            ("GET", re.compile(r"^/v2/catalog/list$"), "square", self._square_catalog_list),
+            ("POST", re.compile(r"^/v2/catalog/list$"), "square", self._square_catalog_list),
+            ("POST", re.compile(r"^/v2/catalog/search$"), "square", self._square_catalog_search),
+            ("GET", re.compile(r"^/v2/catalog/object/(?P<object_id>[^/]+)$"), "square", self._square_catalog_object),
+            ("POST", re.compile(r"^/v2/catalog/batch-retrieve$"), "square", self._square_catalog_batch_retrieve),
+            ("POST", re.compile(r"^/v2/inventory/batch-retrieve-counts$"), "square", self._square_inventory_counts),
+        ]
+
+        self._httpd = _HTTPServer((host, port), _Handler)
+        self._httpd.standin = self
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StandinServer":
+        """Serve from a daemon thread and return immediately."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self) -> "StandinServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def catalog_objects(self) -> List[Dict[str, Any]]:
+        """The generated Square catalog, as returned on the wire."""
+        return [self._square_wire(obj) for obj in self._catalog]
+
+    def upsert_catalog_object(self, obj: Dict[str, Any]) -> None:
+        """Add or replace a catalog object (stored form, ``<type>_data`` keys), bumping updated_at."""
+        obj = dict(obj, updated_at=_square_now(), version=int(time.time() * 1000))
+        obj.setdefault("is_deleted", False)
+        with self._lock:
+            self._catalog = [o for o in self._catalog if o["id"] != obj["id"]] + [obj]
+
+    def delete_catalog_object(self, object_id: str) -> None:
+        """Mark a catalog object deleted, as Square reports it to incremental searches."""
+        with self._lock:
+            for obj in self._catalog:
+                if obj["id"] == object_id:
+                    obj.update(is_deleted=True, updated_at=_square_now())
+
+    # ------------------------------------------------------------------
+    # PayPal webhook signing
+    # ------------------------------------------------------------------
+
+    def _signing_material(self) -> Dict[str, Any]:
+        """Create (once) a CA and a leaf certificate issued to PayPal's signing name."""
+        with self._lock:
+            if self._paypal_signing is not None:
+                return self._paypal_signing
+
+            from cryptography import x509
+            from cryptography.hazmat.primitives import hashes, serialization
+            from cryptography.hazmat.primitives.asymmetric import rsa
+            from cryptography.x509.oid import NameOID
+
+            now = datetime.now(timezone.utc)
+
+            def issue(subject_cn, key, issuer_name, issuer_key, is_ca):
+                builder = (
+                    x509.CertificateBuilder()
+                    .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject_cn)]))
+                    .issuer_name(issuer_name)
+                    .public_key(key.public_key())
+                    .serial_number(x509.random_serial_number())
+                    .not_valid_before(now - timedelta(days=1))
+                    .not_valid_after(now + timedelta(days=30))
+                    .add_extension(x509.BasicConstraints(ca=is_ca, path_length=None), critical=True)
+                )
+                if not is_ca:
+                    builder = builder.add_extension(
+                        x509.SubjectAlternativeName([x509.DNSName(subject_cn)]), critical=False
+                    )
+                return builder.sign(issuer_key, hashes.SHA256())
+
+            ca_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            ca_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Stand-in PayPal Root CA")])
+            ca_cert = issue("Stand-in PayPal Root CA", ca_key, ca_name, ca_key, True)
+            leaf_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            leaf_cert = issue(PAYPAL_CERT_SUBJECT, leaf_key, ca_name, ca_key, False)
+
+            pem = serialization.Encoding.PEM
+            self._paypal_signing = {
+                "key": leaf_key,
+                "chain_pem": leaf_cert.public_bytes(pem) + ca_cert.public_bytes(pem),
+                "ca_pem": ca_cert.public_bytes(pem),
+            }
+            return self._paypal_signing
+
+    @property
+    def paypal_cert_url(self) -> str:
+        return f"{self.base_url}/v1/notifications/certs/CERT-standin"
+
+    def paypal_ca_pem(self) -> bytes:
+        """Root certificate the served chain ends in (write it to PAYPAL_CERT_CA_FILE)."""
+        return self._signing_material()["ca_pem"]
+
+    def sign_paypal_webhook(self, raw_body: bytes, webhook_id: str) -> Dict[str, str]:
+        """Headers PayPal would send with ``raw_body`` for the given webhook ID."""
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        transmission_id = str(uuid.uuid4())
+        transmission_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        message = f"{transmission_id}|{transmission_time}|{webhook_id}|{zlib.crc32(raw_body) & 0xFFFFFFFF}"
+        signature = self._signing_material()["key"].sign(message.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256())
+        return {
+            "PAYPAL-AUTH-ALGO": "SHA256withRSA",
+            "PAYPAL-CERT-URL": self.paypal_cert_url,
+            "PAYPAL-TRANSMISSION-ID": transmission_id,
+            "PAYPAL-TRANSMISSION-SIG": base64.b64encode(signature).decode("ascii"),
+            "PAYPAL-TRANSMISSION-TIME": transmission_time,
+        }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats.clear()
+
+    # ------------------------------------------------------------------
+    # Dispatch
+    # ------------------------------------------------------------------
+
+    def dispatch(self, handler: _Handler, method: str) -> None:
+        parsed = urlparse(handler.path)
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw_body = handler.rfile.read(length) if length else b""
+
+        for route_method, pattern, service, view in self._routes:
+            match = pattern.match(parsed.path)
+            if route_method != method or not match:
+                continue
+
+            with self._lock:
+                self.stats[view.__name__.lstrip("_")] += 1
+
+            if service:
+                profile = self.profiles[service]
+                self._delay(profile)
+                if profile.error_rate and self._random.random() < profile.error_rate:
+                    self._send_error(handler, service, profile.error_status)
+                    return
+
+            query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+            try:
+                body = json.loads(raw_body) if raw_body else {}
+            except ValueError:
+                body = {}
+            context = {
+                "query": query,
+                "body": body,
+                "raw_body": raw_body,
+                "headers": handler.headers,
+                "params": match.groupdict(),
+            }
+            status, payload, headers = view(context)
+            self._send_json(handler, status, payload, headers)
+            return
+
+        self._send_json(handler, 404, {"error": "not_found", "path": parsed.path}, {})
+
+    def _delay(self, profile: Profile) -> None:
+        delay_ms = profile.latency_ms
+        if profile.jitter_ms:
+            delay_ms += self._random.uniform(0, profile.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+
+    def _send_json(self, handler: _Handler, status: int, payload: Any, headers: Dict[str, str]) -> None:
+        # Views may return raw bytes (e.g. a PEM certificate) with their own Content-Type
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        if "Content-Type" not in headers:
+            handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _send_error(self, handler: _Handler, service: str, status: int) -> None:
+        if service == "square":
+            payload = {"errors": [{"category": "API_ERROR", "code": "INTERNAL_SERVER_ERROR",
+                                   "detail": "Injected stand-in error"}]}
+            if status == 429:
+                payload["errors"][0].update(category="RATE_LIMIT_ERROR", code="RATE_LIMITED")
+        elif service == "paypal":
+            payload = {"name": "INTERNAL_SERVER_ERROR", "message": "Injected stand-in error"}
+            if status == 429:
+                payload["name"] = "RATE_LIMIT_REACHED"
+        else:
+            payload = {"error": True, "reason": "Injected stand-in error"}
+        headers = {"Retry-After": "1"} if status in (429, 503) else {}
+        self._send_json(handler, status, payload, headers)
+
+    def _stats(self, context: Dict[str, Any]):
+        with self._lock:
+            return 200, dict(self.stats), {}
+
+    # ------------------------------------------------------------------
+    # Open-Meteo
+    # ------------------------------------------------------------------
+
+    def _forecast(self, context: Dict[str, Any]):
+        query = context["query"]
+        try:
+            lats = [float(v) for v in query.get("latitude", "").split(",")]
+            lons = [float(v) for v in query.get("longitude", "").split(",")]
+            forecast_days = int(query.get("forecast_days", 7))
+            past_days = int(query.get("past_days", 0))
+        except ValueError:
+            return 400, {"error": True, "reason": "Invalid coordinates or day counts"}, {}
+        if len(lats) != len(lons):
+            return 400, {"error": True, "reason": "Parameter 'latitude' and 'longitude' must have the same number of elements"}, {}
+
+        variables = [v for v in query.get("daily", "").split(",") if v]
+        today = datetime.now(timezone.utc).date()
+        days = [today + timedelta(days=offset) for offset in range(-past_days, forecast_days)]
+
+        locations = [self._forecast_location(lat, lon, days, variables) for lat, lon in zip(lats, lons)]
+        return 200, (locations if len(locations) > 1 else locations[0]), {}
+
+    def _forecast_location(self, lat: float, lon: float, days, variables: List[str]) -> Dict[str, Any]:
+        daily: Dict[str, List[Any]] = {"time": [day.isoformat() for day in days]}
+        for variable in variables:
+            values = []
+            for day in days:
+                rng = random.Random(f"{self.seed}:{lat:.4f}:{lon:.4f}:{day.isoformat()}")
+                season = -12 * math.cos((day.timetuple().tm_yday - 15) / 365.0 * 6.283)
+                high = round(14 + season + rng.uniform(-4, 4), 1)
+                low = round(high - rng.uniform(6, 12), 1)
+                if variable in ("sunrise", "sunset"):
+                    hour = "07:12" if variable == "sunrise" else "18:47"
+                    values.append(f"{day.isoformat()}T{hour}")
+                elif variable in ("temperature_2m_max", "apparent_temperature_max"):
+                    values.append(high)
+                elif variable in ("temperature_2m_min", "apparent_temperature_min"):
+                    values.append(low)
+                elif variable == "temperature_2m_mean":
+                    values.append(round((high + low) / 2, 1))
+                elif variable == "precipitation_sum":
+                    values.append(round(max(0.0, rng.gauss(1.5, 4)), 1))
+                elif variable == "winddirection_10m_dominant":
+                    values.append(rng.randrange(0, 360))
+                else:
+                    values.append(round(rng.uniform(0, 20), 1))
+            daily[variable] = values
+
+        return {
+            "latitude": round(lat, 4),
+            "longitude": round(lon, 4),
+            "generationtime_ms": 0.1,
+            "utc_offset_seconds": 0,
+            "timezone": "GMT",
+            "timezone_abbreviation": "GMT",
+            "elevation": 250.0,
+            "daily_units": {variable: "" for variable in ["time", *variables]},
+            "daily": daily,
+        }
+
+    # ------------------------------------------------------------------
+    # PayPal
+    # ------------------------------------------------------------------
+
+    def _paypal_token(self, context: Dict[str, Any]):
+        return 200, {
+            "scope": "https://uri.paypal.com/services/payments/payment",
+            "access_token": f"A21AA{uuid.uuid4().hex}",
+            "token_type": "Bearer",
+            "app_id": "APP-STANDIN",
+            "expires_in": 32400,
+            "nonce": uuid.uuid4().hex,
+        }, {}
+
+    def _paypal_create_order(self, context: Dict[str, Any]):
+        body = context["body"]
+        order_id = uuid.uuid4().hex[:17].upper()
+        order = {
+            "id": order_id,
+            "status": "CREATED",
+            "intent": body.get("intent", "CAPTURE"),
+            "purchase_units": body.get("purchase_units", []),
+            "create_time": datetime.now(timezone.utc).isoformat(),
+            "links": [
+                {"href": f"/v2/checkout/orders/{order_id}", "rel": "self", "method": "GET"},
+                {"href": f"https://www.sandbox.paypal.com/checkoutnow?token={order_id}", "rel": "approve", "method": "GET"},
+                {"href": f"/v2/checkout/orders/{order_id}/capture", "rel": "capture", "method": "POST"},
+            ],
+        }
+        with self._lock:
+            self._orders[order_id] = order
+        return 201, order, {}
+
+    def _paypal_get_order(self, context: Dict[str, Any]):
+        with self._lock:
+            order = self._orders.get(context["params"]["order_id"])
+        if order is None:
+            return 404, {"name": "RESOURCE_NOT_FOUND", "message": "The specified resource does not exist."}, {}
+        return 200, order, {}
+
+    def _paypal_capture(self, context: Dict[str, Any]):
+        order_id = context["params"]["order_id"]
+        request_id = context["headers"].get("PayPal-Request-Id")
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None:
+                return 404, {"name": "RESOURCE_NOT_FOUND", "message": "The specified resource does not exist."}, {}
+            if request_id and request_id in self._captures_by_request_id:
+                # PayPal replays the original response for a repeated PayPal-Request-Id
+                return 201, self._captures_by_request_id[request_id], {}
+            if order["status"] == "COMPLETED":
+                return 422, {"name": "UNPROCESSABLE_ENTITY", "message": "ORDER_ALREADY_CAPTURED"}, {}
+
+            amount = (order["purchase_units"] or [{}])[0].get("amount", {"currency_code": "USD", "value": "0.00"})
+            order["status"] = "COMPLETED"
+            order["purchase_units"] = [{
+                "reference_id": "default",
+                "payments": {"captures": [{
+                    "id": uuid.uuid4().hex[:17].upper(),
+                    "status": "COMPLETED",
+                    "amount": amount,
+                    "create_time": datetime.now(timezone.utc).isoformat(),
+                }]},
+            }]
+            order["payer"] = {"name": {"given_name": "Stand", "surname": "In"},
+                              "email_address": "payer@example.com", "payer_id": "STANDINPAYER"}
+            if request_id:
+                self._captures_by_request_id[request_id] = order
+        return 201, order, {}
+
+    def _paypal_get_capture(self, context: Dict[str, Any]):
+        capture_id = context["params"]["capture_id"]
+        with self._lock:
+            for order_id, order in self._orders.items():
+                for unit in order.get("purchase_units") or []:
+                    for capture in (unit.get("payments") or {}).get("captures") or []:
+                        if capture.get("id") == capture_id:
+                            return 200, dict(capture, supplementary_data={"related_ids": {"order_id": order_id}}), {}
+        return 404, {"name": "RESOURCE_NOT_FOUND", "message": "The specified resource does not exist."}, {}
+
+    def _paypal_cert(self, context: Dict[str, Any]):
+        return 200, self._signing_material()["chain_pem"], {"Content-Type": "application/x-pem-file"}
+
+    def _paypal_verify_webhook(self, context: Dict[str, Any]):
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        body = context["body"]
+        # PayPal re-serializes webhook_event itself; so does the stand-in
+        raw_event = json.dumps(body.get("webhook_event")).encode("utf-8")
+        message = (f"{body.get('transmission_id')}|{body.get('transmission_time')}|"
+                   f"{body.get('webhook_id')}|{zlib.crc32(raw_event) & 0xFFFFFFFF}")
+        try:
+            self._signing_material()["key"].public_key().verify(
+                base64.b64decode(body.get("transmission_sig") or ""),
+                message.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256(),
+            )
+            status = "SUCCESS"
+        except (InvalidSignature, ValueError):
+            status = "FAILURE"
+        return 200, {"verification_status": status}, {}
+
+    # ------------------------------------------------------------------
+    # Square
+    # ------------------------------------------------------------------
+
+    def _generate_catalog(self, profile: Profile) -> List[Dict[str, Any]]:
+        rng = random.Random(self.seed)
+        updated_at = "2024-01-01T00:00:00.000Z"
+        filler = "Fresh from the valley. "
+        description = (filler * (profile.description_bytes // len(filler) + 1))[:profile.description_bytes]
+
+        objects: List[Dict[str, Any]] = []
+        for index in range(profile.categories):
+            objects.append({
+                "type": "CATEGORY", "id": f"CAT_{index:04d}", "updated_at": updated_at, "version": 1,
+                "is_deleted": False, "present_at_all_locations": True,
+                "category_data": {"name": f"Category {index}"},
+            })
+
+        for index in range(profile.catalog_items):
+            item_id = f"ITEM_{index:06d}"
+            variation_ids = [f"VAR_{index:06d}_{n}" for n in range(profile.variations_per_item)]
+            image_ids = [f"IMG_{index:06d}_{n}" for n in range(profile.images_per_item)]
+            for image_id in image_ids:
+                objects.append({
+                    "type": "IMAGE", "id": image_id, "updated_at": updated_at, "version": 1,
+                    "is_deleted": False, "present_at_all_locations": True,
+                    "image_data": {"url": f"https://images.example/{image_id}.jpg", "caption": f"Produce {index}"},
+                })
+            objects.append({
+                "type": "ITEM", "id": item_id, "updated_at": updated_at, "version": 1,
+                "is_deleted": False, "present_at_all_locations": True,
+                "item_data": {
+                    "name": f"Produce {index}",
+                    "description": description,
+                    "category_id": f"CAT_{rng.randrange(profile.categories):04d}" if profile.categories else None,
+                    "item_variation_ids": variation_ids,
+                    "variations": [{"id": variation_id} for variation_id in variation_ids],
+                    **({"image_ids": image_ids} if image_ids else {}),
+                },
+            })
+            for n, variation_id in enumerate(variation_ids):
+                objects.append({
+                    "type": "ITEM_VARIATION", "id": variation_id, "updated_at": updated_at, "version": 1,
+                    "is_deleted": False, "present_at_all_locations": True,
+                    "item_variation_data": {
+                        "item_id": item_id,
+                        "name": ["Pint", "Quart", "Half peck", "Peck"][n % 4],
+                        "pricing_type": "FIXED_PRICING",
+                        "price_money": {"amount": rng.randrange(200, 2500, 25), "currency": "USD"},
+                    },
+                })
+
+        # Square pages don't group related objects, so neither do we.
+        rng.shuffle(objects)
+        return objects
+
+    def _page(self, items: List[Any], cursor: Optional[str], page_size: int):
+        start = int(cursor) if cursor and cursor.isdigit() else 0
+        page = items[start:start + page_size]
+        next_cursor = str(start + page_size) if start + page_size < len(items) else None
+        return page, next_cursor
+
+    def _square_catalog_list(self, context: Dict[str, Any]):
+        params = {**context["query"], **context["body"]}
+        types = params.get("types")
+        if isinstance(types, str):
+            types = types.split(",")
+        types = {t.strip().upper() for t in types} if types else None
+
+        objects = [obj for obj in self._catalog
+                   if not obj["is_deleted"] and (types is None or obj["type"] in types)]
+        page, cursor = self._page(objects, params.get("cursor"), self.profiles["square"].page_size)
+
+        payload: Dict[str, Any] = {"objects": [self._square_wire(obj) for obj in page]}
+        if cursor:
+            payload["cursor"] = cursor
+        return 200, payload, {}
+
+    def _square_catalog_search(self, context: Dict[str, Any]):
+        body = context["body"]
+        types = {t.upper() for t in body.get("object_types") or []} or None
+        begin_time = body.get("begin_time")
+        include_deleted = bool(body.get("include_deleted_objects"))
+
+        objects = [
+            obj for obj in self._catalog
+            if (types is None or obj["type"] in types)
+            and (include_deleted or not obj["is_deleted"])
+            and (not begin_time or obj["updated_at"] >= begin_time)
+        ]
+        page_size = min(int(body.get("limit") or 1000), self.profiles["square"].page_size)
+        page, cursor = self._page(objects, body.get("cursor"), page_size)
+
+        payload: Dict[str, Any] = {
+            "objects": [self._square_wire(obj) for obj in page],
+            "latest_time": max((obj["updated_at"] for obj in self._catalog), default=_square_now()),
+        }
+        if body.get("include_related_objects"):
+            payload["related_objects"] = self._related(page)
+        if cursor:
+            payload["cursor"] = cursor
+        return 200, payload, {}
+
+    def _related(self, objects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Categories and images referenced by items in ``objects``."""
+        wanted = set()
+        for obj in objects:
+            data = obj.get("item_data") or {}
+            if data.get("category_id"):
+                wanted.add(data["category_id"])
+            wanted.update(data.get("image_ids") or [])
+        return [self._square_wire(obj) for obj in self._catalog
+                if obj["id"] in wanted and not obj["is_deleted"]]
+
+    def _square_catalog_object(self, context: Dict[str, Any]):
+        object_id = context["params"]["object_id"]
+        obj = next((o for o in self._catalog if o["id"] == object_id and not o["is_deleted"]), None)
+        if obj is None:
+            return 404, {"errors": [{"category": "INVALID_REQUEST_ERROR", "code": "NOT_FOUND",
+                                     "detail": f"Object with ID `{object_id}` not found."}]}, {}
+        payload: Dict[str, Any] = {"object": self._square_wire(obj)}
+        if context["query"].get("include_related_objects") == "true":
+            related = self._related([obj])
+            if obj["type"] == "ITEM":
+                variation_ids = set(obj["item_data"].get("item_variation_ids") or [])
+                related += [self._square_wire(o) for o in self._catalog
+                            if o["id"] in variation_ids and not o["is_deleted"]]
+            payload["related_objects"] = related
+        return 200, payload, {}
+
+    def _square_catalog_batch_retrieve(self, context: Dict[str, Any]):
+        body = context["body"]
+        wanted = set(body.get("object_ids") or [])
+        if not wanted or len(wanted) > 1000:
+            return 400, {"errors": [{"category": "INVALID_REQUEST_ERROR", "code": "INVALID_ARRAY_LENGTH",
+                                     "detail": "object_ids must contain 1 to 1000 entries"}]}, {}
+        objects = [o for o in self._catalog if o["id"] in wanted and not o["is_deleted"]]
+        payload: Dict[str, Any] = {"objects": [self._square_wire(obj) for obj in objects]}
+        if body.get("include_related_objects"):
+            payload["related_objects"] = self._related(objects)
+        return 200, payload, {}
+
+    @staticmethod
+    def _square_wire(obj: Dict[str, Any]) -> Dict[str, Any]:
+        """Square's JSON keys object data by type; the platform reads it as obj[type]."""
+        wire = dict(obj)
+        data_key = next((key for key in obj if key.endswith("_data")), None)
+        if data_key:
+            wire[obj["type"]] = obj[data_key]
+        return wire
+
+    def _square_inventory_counts(self, context: Dict[str, Any]):
+        body = context["body"]
+        profile = self.profiles["square"]
+        location_ids = body.get("location_ids") or [f"LOC_{n}" for n in range(profile.locations)]
+        requested = body.get("catalog_object_ids")
+        if requested is not None and len(requested) > 1000:
+            return 400, {"errors": [{"category": "INVALID_REQUEST_ERROR", "code": "INVALID_ARRAY_LENGTH",
+                                     "detail": "catalog_object_ids may contain at most 1000 entries"}]}, {}
+
+        variation_ids = [obj["id"] for obj in self._catalog if obj["type"] == "ITEM_VARIATION"]
+        if requested is not None:
+            wanted = set(requested)
+            variation_ids = [vid for vid in variation_ids if vid in wanted]
+
+        counts = []
+        for variation_id in variation_ids:
+            for location_id in location_ids:
+                quantity = zlib.crc32(f"{self.seed}:{variation_id}:{location_id}".encode()) % 40
+                counts.append({
+                    "catalog_object_id": variation_id,
+                    "catalog_object_type": "ITEM_VARIATION",
+                    "state": "IN_STOCK",
+                    "location_id": location_id,
+                    "quantity": str(quantity),
+                    "calculated_at": "2024-01-01T00:00:00.000Z",
+                })
+
+        page, cursor = self._page(counts, body.get("cursor"), profile.page_size)
+        payload: Dict[str, Any] = {"counts": page}
+        if cursor:
+            payload["cursor"] = cursor
+        return 200, payload, {}
@@ -0,0 +1,23 @@
+# /srv/webapps/platform/tests/conftest.py
+
+"""
+Shared fixtures. Run from srv/webapps/platform::
+
+    python -m pytest -q tests
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from standin import StandinServer  # noqa: E402
+
+
+@pytest.fixture
+def standin():
+    """A stand-in upstream server on a free local port."""
+    with StandinServer() as server:
+        yield server
@@ -0,0 +1,81 @@
+# /srv/webapps/platform/tests/test_leased_worker.py
+
+"""Lease handling of services/leased_worker.py."""
+
+import time
+import uuid
+
+import pytest
+
+from services import state
+from services.leased_worker import LeasedWorker
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS worker_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+
+
+@pytest.fixture
+def worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(state, "STATE_DIR", tmp_path)
+    name = f"worker_{uuid.uuid4().hex[:8]}"
+    return LeasedWorker("test-worker", lambda: state.get_connection(name, schema=_SCHEMA), "worker_state",
+                        batch_size=3)
+
+
+def _steal(worker, owner="other"):
+    worker.state_connection().execute(
+        "INSERT OR REPLACE INTO worker_state (key, value) VALUES ('lease', ?)", (f"{owner} {time.time()}",)
+    )
+
+
+def test_lease_is_exclusive_until_released(worker):
+    assert worker.acquire_lease("a")
+    assert not worker.acquire_lease("b")
+    worker.release_lease("b")
+    assert not worker.acquire_lease("b")
+    worker.release_lease("a")
+    assert worker.acquire_lease("b")
+
+
+def test_expired_lease_is_taken_over(worker):
+    worker.lease.seconds = 0
+    assert worker.acquire_lease("a")
+    assert worker.acquire_lease("b")
+    worker.release_lease("a")
+    assert worker.state_connection().execute("SELECT value FROM worker_state").fetchone()["value"].startswith("b ")
+
+
+def test_drain_stops_when_the_lease_is_lost(worker):
+    rows = list(range(10))
+    handled = []
+
+    def batch(renew):
+        count = 0
+        for row in rows[len(handled):len(handled) + worker.batch_size]:
+            if not renew():
+                break
+            handled.append(row)
+            count += 1
+            if len(handled) == 4:
+                _steal(worker)
+        return count
+
+    assert worker.drain(batch, owner="a") == 4
+    assert handled == [0, 1, 2, 3]
+    # The new holder's lease survives the release
+    assert worker.state_connection().execute("SELECT value FROM worker_state").fetchone()["value"].startswith("other ")
+
+
+def test_drain_runs_batches_until_one_is_short(worker):
+    rows = list(range(7))
+
+    def batch(renew):
+        taken = [rows.pop(0) for _ in range(min(worker.batch_size, len(rows))) if renew()]
+        return len(taken)
+
+    assert worker.drain(batch) == 7
+    assert worker.drain(batch) == 0
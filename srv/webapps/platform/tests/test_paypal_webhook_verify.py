@@ -0,0 +1,163 @@
+# /srv/webapps/platform/tests/test_paypal_webhook_verify.py
+
+"""Local PayPal webhook verification against the stand-in's signing certificate."""
+
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("cryptography")
+
+from cryptography import x509  # noqa: E402
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+from cryptography.x509.oid import NameOID  # noqa: E402
+
+from services import paypal_webhook_verify  # noqa: E402
+from services.paypal_webhook_verify import WebhookVerificationError  # noqa: E402
+
+WEBHOOK_ID = "WH-TEST-1"
+
+EVENT = {"id": "WH-EVENT-1", "event_type": "PAYMENT.CAPTURE.COMPLETED", "resource": {"id": "CAP-1"}}
+
+
+def _no_api_call(*args, **kwargs):
+    raise AssertionError("local verification must not call PayPal's verify API")
+
+
+def _issue(cn, key, issuer_name, issuer_key, ca, expired=False, key_cert_sign=True):
+    now = datetime.now(timezone.utc)
+    valid_from = now - timedelta(days=60 if expired else 1)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)]))
+        .issuer_name(issuer_name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(valid_from)
+        .not_valid_after(valid_from + timedelta(days=30))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+    )
+    if ca:
+        builder = builder.add_extension(
+            x509.KeyUsage(
+                digital_signature=True, content_commitment=False, key_encipherment=False,
+                data_encipherment=False, key_agreement=False, key_cert_sign=key_cert_sign,
+                crl_sign=key_cert_sign, encipher_only=False, decipher_only=False,
+            ),
+            critical=True,
+        )
+    return builder.sign(issuer_key, hashes.SHA256())
+
+
+def _key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    """A root CA of our own, trusted through PAYPAL_CERT_CA_FILE."""
+    key = _key()
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Test Root CA")])
+    cert = _issue("Test Root CA", key, name, key, ca=True)
+    ca_file = tmp_path / "roots.pem"
+    ca_file.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    monkeypatch.setattr(paypal_webhook_verify, "PAYPAL_CERT_CA_FILE", str(ca_file))
+    monkeypatch.setattr(paypal_webhook_verify, "_roots", None)
+    return key, cert
+
+
+@pytest.fixture
+def verifier(standin, tmp_path, monkeypatch):
+    """Local verification configured to trust the stand-in's root."""
+    ca_file = tmp_path / "standin-ca.pem"
+    ca_file.write_bytes(standin.paypal_ca_pem())
+    monkeypatch.setattr(paypal_webhook_verify, "PAYPAL_WEBHOOK_ID", WEBHOOK_ID)
+    monkeypatch.setattr(paypal_webhook_verify, "PAYPAL_WEBHOOK_VERIFY", "local")
+    monkeypatch.setattr(paypal_webhook_verify, "PAYPAL_CERT_CA_FILE", str(ca_file))
+    monkeypatch.setattr(paypal_webhook_verify, "_roots", None)
+    monkeypatch.setattr(paypal_webhook_verify, "_certs", {})
+    monkeypatch.setattr(paypal_webhook_verify, "_failed_urls", {})
+
+    def verify(raw_body, headers, api_base=standin.base_url):
+        return paypal_webhook_verify.verify(headers, raw_body, json.loads(raw_body), _no_api_call, api_base=api_base)
+
+    return verify
+
+
+def test_valid_signature_is_accepted(standin, verifier):
+    raw_body = json.dumps(EVENT).encode("utf-8")
+    assert verifier(raw_body, standin.sign_paypal_webhook(raw_body, WEBHOOK_ID)) is True
+
+
+def test_tampered_body_is_rejected(standin, verifier):
+    raw_body = json.dumps(EVENT).encode("utf-8")
+    headers = standin.sign_paypal_webhook(raw_body, WEBHOOK_ID)
+    tampered = json.dumps(dict(EVENT, resource={"id": "CAP-2"})).encode("utf-8")
+    with pytest.raises(WebhookVerificationError, match="Signature does not match"):
+        verifier(tampered, headers)
+
+
+def test_signature_for_another_webhook_id_is_rejected(standin, verifier):
+    raw_body = json.dumps(EVENT).encode("utf-8")
+    with pytest.raises(WebhookVerificationError, match="Signature does not match"):
+        verifier(raw_body, standin.sign_paypal_webhook(raw_body, "WH-OTHER"))
+
+
+def test_cert_url_outside_paypal_hosts_is_rejected(standin, verifier):
+    raw_body = json.dumps(EVENT).encode("utf-8")
+    headers = standin.sign_paypal_webhook(raw_body, WEBHOOK_ID)
+    # The stand-in is only trusted as the configured API base
+    with pytest.raises(WebhookVerificationError, match="not a PayPal URL"):
+        verifier(raw_body, headers, api_base=None)
+    with pytest.raises(WebhookVerificationError, match="not a PayPal URL"):
+        verifier(raw_body, dict(headers, **{"PAYPAL-CERT-URL": "https://certs.example.com/paypal.pem"}))
+    assert standin.stats["paypal_cert"] == 0
+
+
+def test_chain_to_untrusted_root_is_rejected(standin, verifier, root):
+    raw_body = json.dumps(EVENT).encode("utf-8")
+    with pytest.raises(WebhookVerificationError, match="trusted root"):
+        verifier(raw_body, standin.sign_paypal_webhook(raw_body, WEBHOOK_ID))
+
+
+def test_expired_leaf_is_rejected(root):
+    root_key, root_cert = root
+    leaf = _issue(paypal_webhook_verify.PAYPAL_CERT_SUBJECT, _key(), root_cert.subject, root_key, ca=False, expired=True)
+    with pytest.raises(WebhookVerificationError, match="expired"):
+        paypal_webhook_verify._validate_chain([leaf, root_cert])
+
+
+def test_leaf_issued_by_end_entity_is_rejected(root):
+    root_key, root_cert = root
+    issuer_key = _key()
+    issuer = _issue("shop.example.com", issuer_key, root_cert.subject, root_key, ca=False)
+    leaf = _issue(paypal_webhook_verify.PAYPAL_CERT_SUBJECT, _key(), issuer.subject, issuer_key, ca=False)
+    with pytest.raises(WebhookVerificationError, match="not a CA"):
+        paypal_webhook_verify._validate_chain([leaf, issuer])
+
+
+def test_intermediate_without_key_cert_sign_is_rejected(root):
+    root_key, root_cert = root
+    issuer_key = _key()
+    issuer = _issue("Test Intermediate", issuer_key, root_cert.subject, root_key, ca=True, key_cert_sign=False)
+    leaf = _issue(paypal_webhook_verify.PAYPAL_CERT_SUBJECT, _key(), issuer.subject, issuer_key, ca=False)
+    with pytest.raises(WebhookVerificationError, match="may not sign"):
+        paypal_webhook_verify._validate_chain([leaf, issuer])
+
+
+def test_chain_through_intermediate_is_accepted(root):
+    root_key, root_cert = root
+    issuer_key = _key()
+    issuer = _issue("Test Intermediate", issuer_key, root_cert.subject, root_key, ca=True)
+    leaf = _issue(paypal_webhook_verify.PAYPAL_CERT_SUBJECT, _key(), issuer.subject, issuer_key, ca=False)
+    paypal_webhook_verify._validate_chain([leaf, issuer])
+
+
+def test_certificate_is_fetched_once(standin, verifier):
+    for n in range(3):
+        raw_body = json.dumps(dict(EVENT, id=f"WH-EVENT-{n}")).encode("utf-8")
+        assert verifier(raw_body, standin.sign_paypal_webhook(raw_body, WEBHOOK_ID)) is True
+    assert standin.stats["paypal_cert"] == 1
+    assert list(paypal_webhook_verify._certs) == [standin.paypal_cert_url]